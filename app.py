@@ -1,20 +1,40 @@
 import os
+import sys
 import time
+import hashlib
+import threading
 import logging
-import traceback
+from contextlib import contextmanager
+import click
 from flask import Flask, request, jsonify, render_template
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import select
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.schema import CreateIndex
 from flask_login import LoginManager
 
 # Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# 記錄只放入佇列，由背景執行緒輸出到 console 並批次寫入 log_entry；等級由 LOG_LEVEL / LOG_LEVELS 設定
+from services.log_pipeline import LogPipeline
+LogPipeline.configure()
 logger = logging.getLogger(__name__)
 
+# 冷啟動剖析：STARTUP_PROFILE=true 時記錄各初始化階段的耗時；import 時間可用 tools/startup_profile.py 量測
+STARTUP_PROFILE = os.environ.get("STARTUP_PROFILE", "false").lower() == "true"
+# 載入較慢、應在第一次使用時才導入的模組
+HEAVY_MODULES = ("openai", "numpy", "faiss", "linebot", "requests")
+_startup_timings = []
+
+@contextmanager
+def startup_phase(name):
+    """Record how long an initialization phase takes"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _startup_timings.append((name, time.perf_counter() - started))
+
 class Base(DeclarativeBase):
     pass
 
@@ -39,8 +59,10 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_size": 10,  # 設置連接池大小
     "max_overflow": 15,  # 設置最大溢出連接數
     "pool_timeout": 30,  # 連接池超時時間
-    "connect_args": {"connect_timeout": 10}  # 設置連接超時
 }
+# sqlite3 不支援 connect_timeout 參數，只對網路資料庫設置連接超時
+if not app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"):
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"]["connect_args"] = {"connect_timeout": 10}
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
 # Initialize extensions with app
@@ -50,6 +72,7 @@ login_manager.login_view = 'auth.login'
 login_manager.login_message_category = 'info'
 
 # Import and initialize models
+_models_started = time.perf_counter()
 import models
 
 # Setup model classes with SQLAlchemy
@@ -60,17 +83,88 @@ models.BotStyle = type('BotStyle', (models.BotStyle, db.Model), {})
 models.Config = type('Config', (models.Config, db.Model), {})
 models.Document = type('Document', (models.Document, db.Model), {})
 models.LogEntry = type('LogEntry', (models.LogEntry, db.Model), {})
+models.IndexJob = type('IndexJob', (models.IndexJob, db.Model), {})
+models.DocumentFingerprint = type('DocumentFingerprint', (models.DocumentFingerprint, db.Model), {})
+models.DocumentStats = type('DocumentStats', (models.DocumentStats, db.Model), {})
+models.UsageRecord = type('UsageRecord', (models.UsageRecord, db.Model), {})
+models.StatCounter = type('StatCounter', (models.StatCounter, db.Model), {})
+models.MessageVolume = type('MessageVolume', (models.MessageVolume, db.Model), {})
 
 # Import for easy access
 User = models.User
+LineUser = models.LineUser
+ChatMessage = models.ChatMessage
 BotStyle = models.BotStyle
 Config = models.Config
+Document = models.Document
+LogEntry = models.LogEntry
+IndexJob = models.IndexJob
+DocumentFingerprint = models.DocumentFingerprint
+DocumentStats = models.DocumentStats
+UsageRecord = models.UsageRecord
+StatCounter = models.StatCounter
+MessageVolume = models.MessageVolume
+
+# 儀表板計數器：訊息、用戶、文件寫入時以 ORM 事件累加，不需每次載入頁面都執行 COUNT(*)
+from services.stats_service import StatsService
+StatsService.install(db)
+
+# 訊息全文搜尋（SQLite FTS5 / PostgreSQL tsvector），新訊息寫入時同步建立索引；搜尋表由 init_db() 建立
+from services.message_search import MessageSearch, BACKFILL_FLAG
+MessageSearch.install(db, app)
+_startup_timings.append(("models", time.perf_counter() - _models_started))
+
+# LOG_DB_LEVEL（預設 ERROR）以上的記錄批次寫入 log_entry
+LogPipeline.attach_database(app)
+
+SCHEMA_FINGERPRINT_KEY = "SCHEMA_FINGERPRINT"
+
+def schema_fingerprint():
+    """Hash of the tables, columns and indexes defined by the models; changes whenever the schema does"""
+    parts = []
+    for table in db.metadata.sorted_tables:
+        columns = ",".join(column.name for column in table.columns)
+        indexes = ",".join(sorted(index.name for index in table.indexes))
+        parts.append(f"{table.name}({columns})[{indexes}]")
+    return hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()
 
-# Create tables and initialize data
-with app.app_context():
+def init_db(backfill_in_background=True):
+    """Create tables, indexes and search tables, seed default data and check critical settings
+
+    可重複執行；部署時執行一次 `flask --app app init-db` 即可，不需在每次啟動時做。
+    """
+    from routes.utils.config_service import ConfigManager
+    
     # Create tables if they don't exist
     db.create_all()
     
+    # create_all() 不會替已存在的資料表補建索引，逐一檢查並建立新增的索引；
+    # SQLite 無法反射運算式索引（例如 lower(display_name)），支援時改用 IF NOT EXISTS
+    if_not_exists = db.engine.dialect.name in ('postgresql', 'sqlite')
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                if if_not_exists:
+                    with db.engine.begin() as connection:
+                        connection.execute(CreateIndex(index, if_not_exists=True))
+                else:
+                    index.create(db.engine, checkfirst=True)
+            except SQLAlchemyError as e:
+                logger.warning(f"無法建立索引 {index.name}: {e}")
+    
+    # 訊息全文搜尋索引，既有訊息分批補建
+    if MessageSearch.create_schema(db) and ConfigManager.get(BACKFILL_FLAG, "False") != "True":
+        if backfill_in_background:
+            MessageSearch.start_backfill(app)
+        else:
+            MessageSearch.backfill()
+    
+    # 文件指紋演算法改變後重新計算已儲存的 SimHash（rag_service 會載入 numpy/faiss，只在初始化時導入）
+    from rag_service import RAGService
+    RAGService.recompute_fingerprints()
+    # 統計功能加入前上傳的文件補上 document_stats，知識庫列表才能只讀取統計表排序
+    RAGService.backfill_document_stats()
+    
     # Create initial admin user if no users exist
     if not User.query.first():
         from werkzeug.security import generate_password_hash
@@ -107,6 +201,34 @@ with app.app_context():
         
         db.session.commit()
         logger.info("Created initial admin user and default settings")
+    
+    ConfigManager.set(SCHEMA_FINGERPRINT_KEY, schema_fingerprint())
+    check_critical_settings()
+
+def ensure_db_initialized():
+    """Run init_db() unless it has already run for the current schema
+
+    已初始化時只需一次查詢（讀取 SCHEMA_FINGERPRINT 與補建索引旗標），不再逐表、逐索引檢查。
+    """
+    try:
+        values = dict(db.session.execute(
+            select(Config.key, Config.value).where(Config.key.in_([SCHEMA_FINGERPRINT_KEY, BACKFILL_FLAG]))
+        ).all())
+    except SQLAlchemyError:
+        # 資料表尚未建立
+        db.session.rollback()
+        values = {}
+    if values.get(SCHEMA_FINGERPRINT_KEY) != schema_fingerprint():
+        init_db()
+    elif values.get(BACKFILL_FLAG) != "True":
+        # 上次補建索引未完成（例如進程在補建途中結束）
+        MessageSearch.start_backfill(app)
+
+@app.cli.command("init-db")
+def init_db_command():
+    """Create tables and indexes, seed default data and index existing messages for search."""
+    init_db(backfill_in_background=False)
+    click.echo("Database initialized")
 
 # Setup login manager
 @login_manager.user_loader
@@ -117,20 +239,15 @@ def load_user(user_id):
 # Register blueprints
 def register_blueprints():
     # 所有藍圖都使用延遲導入，避免循環引用
+    # LINE 事件處理函數在 get_line_webhook_handler() 中註冊
     from routes.webhook import webhook_bp
     from routes.auth import auth_bp
-    # 註冊 LINE Webhook 處理程序
-    from routes.webhook import handle_text_message
-    from linebot.models import MessageEvent, TextMessage
-    
-    # 動態獲取 webhook handler 並註冊事件處理程序
-    from routes.webhook import get_line_webhook_handler
-    webhook_handler = get_line_webhook_handler()
-    webhook_handler.add(MessageEvent, message=TextMessage)(handle_text_message)
+    from routes.metrics import metrics_bp
     
     # 註冊藍圖
     app.register_blueprint(webhook_bp)
     app.register_blueprint(auth_bp)
+    app.register_blueprint(metrics_bp)
     
     # 管理面板藍圖最後註冊，避免循環導入
     try:
@@ -140,7 +257,8 @@ def register_blueprints():
         logger.error(f"無法導入管理面板藍圖: {e}")
 
 # 註冊藍圖
-register_blueprints()
+with startup_phase("blueprints"):
+    register_blueprints()
 
 # Create knowledge_base directory if it doesn't exist
 if not os.path.exists("knowledge_base"):
@@ -181,9 +299,36 @@ def check_critical_settings():
         logger.warning("LINE Messaging API 要求 Webhook URL 必須使用 HTTPS。請確保您的生產環境配置了 SSL/TLS 憑證。")
         logger.info("提示：您可以使用 Let's Encrypt 取得免費的 SSL 憑證，或使用反向代理如 Nginx/Apache 與 Certbot。")
 
-# 在應用程式啟動時執行設定檢查
-with app.app_context():
-    check_critical_settings()
+_first_request_done = False
+_first_request_lock = threading.Lock()
+
+@app.before_request
+def prepare_first_request():
+    """Check the database schema and start per-process background workers on the first request
+
+    匯入 app 時完全不存取資料庫；資料表建立與預設資料由部署時的 `flask --app app init-db` 負責。
+    """
+    global _first_request_done
+    if _first_request_done:
+        return
+    with _first_request_lock:
+        if _first_request_done:
+            return
+        # AUTO_INIT_DB=true 時以一次查詢比對資料表結構指紋，未初始化或結構有變時才執行 init_db()
+        if os.environ.get("AUTO_INIT_DB", "false").lower() == "true":
+            ensure_db_initialized()
+        _start_background_workers()
+        _first_request_done = True
+
+def _start_background_workers():
+    # 以 gunicorn --preload 等方式 fork 出的 worker 在此重新啟動寫入 log_entry 的執行緒
+    LogPipeline.attach_database(app)
+    # 超過保存期限的訊息與日誌定期封存（MESSAGE_RETENTION_DAYS / LOG_RETENTION_DAYS 未設定時不啟動）
+    from services.retention import RetentionService
+    RetentionService.ensure_worker(app)
+    # 重新啟動前排入或中斷的知識庫索引任務（無伺服器環境改在排入任務的請求中執行）
+    from services.index_jobs import IndexJobRunner
+    IndexJobRunner.ensure_worker(app)
 
 # 全局錯誤處理器
 @app.errorhandler(Exception)
@@ -191,22 +336,8 @@ def handle_exception(e):
     """全局異常處理器，捕獲所有未處理的異常"""
     error_id = int(time.time())
     
-    # 打印詳細錯誤信息到日誌
-    logger.error(f"Unhandled exception [{error_id}]: {str(e)}")
-    logger.error(traceback.format_exc())
-    
-    # 記錄錯誤到數據庫
-    try:
-        from models import LogEntry
-        log_entry = LogEntry(
-            level="ERROR",
-            message=f"Unhandled exception: {str(e)}",
-            module=request.path,
-        )
-        db.session.add(log_entry)
-        db.session.commit()
-    except Exception as log_error:
-        logger.error(f"Failed to log error to database: {log_error}")
+    # 打印詳細錯誤信息到日誌，並由 LogPipeline 批次寫入 log_entry（不在失敗的請求中另外提交）
+    logger.error(f"Unhandled exception [{error_id}]: {str(e)}", exc_info=e, extra={"log_module": request.path})
     
     # 根據請求類型返回不同的響應
     if request.path.startswith('/api/') or request.headers.get('Accept') == 'application/json':
@@ -298,3 +429,8 @@ def page_not_found(e):
                           error_id=None), 404
 
 logger.info("Application initialization complete")
+
+if STARTUP_PROFILE:
+    phases = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in _startup_timings)
+    loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+    logger.info(f"Startup profile: {phases}; heavy modules loaded at import: {', '.join(loaded) or 'none'}")
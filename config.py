@@ -2,12 +2,22 @@ import os
 from routes.utils.config_service import (
     ConfigManager, 
     get_openai_api_key, 
+    get_openai_base_url,
     get_line_config, 
     get_active_bot_style, 
     get_llm_settings, 
     is_rag_enabled,
     is_web_search_enabled,
-    get_serpapi_key
+    is_index_job_inline,
+    get_serpapi_key,
+    get_search_cache_settings,
+    get_web_fetch_settings,
+    get_search_provider_settings,
+    get_ingest_settings,
+    get_retention_settings,
+    get_logging_settings,
+    get_metrics_token,
+    get_model_prices
 )
 
 # This file simply forwards the configuration utils
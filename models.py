@@ -1,6 +1,7 @@
 from datetime import datetime
 from flask_login import UserMixin
-from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, Text, Boolean, DateTime, ForeignKey, Index
+from sqlalchemy.orm import declared_attr
 from sqlalchemy.sql import func
 
 # These models will be initialized with the actual db instance in app.py
@@ -24,6 +25,16 @@ class LineUser:
     """Model to store LINE user information"""
     __tablename__ = 'line_user'
     
+    @declared_attr
+    def __table_args__(cls):
+        # 用戶搜尋以 lower(欄位) 做不分大小寫的前綴比對（見 services/user_search.py）；
+        # PostgreSQL 需 pattern_ops 才能在非 C 語系下以索引處理 LIKE 'abc%'
+        return tuple(
+            Index(f'ix_line_user_{name}_lower', func.lower(getattr(cls, name)).label(f'{name}_lower'),
+                  postgresql_ops={f'{name}_lower': 'varchar_pattern_ops'})
+            for name in ('display_name', 'line_user_id')
+        )
+    
     id = Column(Integer, primary_key=True)
     line_user_id = Column(String(64), unique=True, nullable=False)
     display_name = Column(String(64), nullable=True)
@@ -39,6 +50,11 @@ class LineUser:
 class ChatMessage:
     """Model to store chat message history"""
     __tablename__ = 'chat_message'
+    # 訊息記錄以 (timestamp, id) 做 keyset 分頁；id 作為相同時間戳記的排序依據
+    __table_args__ = (
+        Index('ix_chat_message_user_timestamp', 'line_user_id', 'timestamp', 'id'),
+        Index('ix_chat_message_timestamp', 'timestamp', 'id'),
+    )
     
     id = Column(Integer, primary_key=True)
     line_user_id = Column(String(64), nullable=False)
@@ -91,9 +107,39 @@ class Document:
     def __repr__(self):
         return f'<Document {self.title}>'
 
+class DocumentFingerprint:
+    """Content fingerprints of a knowledge base document, used to detect duplicate uploads"""
+    __tablename__ = 'document_fingerprint'
+    
+    document_id = Column(Integer, ForeignKey('document.id', ondelete='CASCADE'), primary_key=True)
+    content_hash = Column(String(64), nullable=False, index=True)  # SHA-256 of normalized content
+    simhash = Column(BigInteger, nullable=True)  # 64-bit SimHash stored signed; NULL for very short texts
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<DocumentFingerprint {self.document_id}>'
+
+class DocumentStats:
+    """Precomputed size and index state of a knowledge base document, so the document list never loads content"""
+    __tablename__ = 'document_stats'
+    
+    document_id = Column(Integer, ForeignKey('document.id', ondelete='CASCADE'), primary_key=True)
+    size_chars = Column(Integer, nullable=False, default=0)
+    chunk_count = Column(Integer, nullable=True)  # 尚未建立索引時為 NULL
+    indexed_chunks = Column(Integer, nullable=False, default=0)  # 在 generation 中有向量的片段數
+    generation = Column(String(64), nullable=True)  # 最後一次納入的索引世代
+    last_embedded_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<DocumentStats {self.document_id}>'
+
 class LogEntry:
     """Model to store system logs"""
     __tablename__ = 'log_entry'
+    __table_args__ = (
+        Index('ix_log_entry_timestamp', 'timestamp'),
+    )
     
     id = Column(Integer, primary_key=True)
     level = Column(String(10), nullable=False)
@@ -102,4 +148,66 @@ class LogEntry:
     timestamp = Column(DateTime, default=datetime.utcnow)
     
     def __repr__(self):
-        return f'<LogEntry {self.id}>'
\ No newline at end of file
+        return f'<LogEntry {self.id}>'
+
+class IndexJob:
+    """Model to track background knowledge base index builds"""
+    __tablename__ = 'index_job'
+    
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(32), nullable=False, default='rebuild')
+    status = Column(String(16), nullable=False, default='pending')  # pending, running, completed, failed, cancelled
+    total = Column(Integer, default=0)
+    processed = Column(Integer, default=0)
+    resumed_from = Column(Integer, default=0)
+    payload = Column(Text, nullable=True)  # JSON 參數（例如增量更新的文件 ID）
+    message = Column(Text, nullable=True)
+    cancel_requested = Column(Boolean, default=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+    
+    def __repr__(self):
+        return f'<IndexJob {self.id} {self.status}>'
+
+class UsageRecord:
+    """Aggregated OpenAI token usage per minute, LINE user, bot style, feature and model"""
+    __tablename__ = 'usage_record'
+    
+    id = Column(Integer, primary_key=True)
+    period_start = Column(DateTime, nullable=False, index=True)  # 以分鐘為單位彙總（UTC）
+    line_user_id = Column(String(64), nullable=True, index=True)
+    bot_style = Column(String(64), nullable=True)
+    feature = Column(String(16), nullable=False)  # chat, rag, search, index
+    model = Column(String(64), nullable=False)
+    requests = Column(Integer, default=0)
+    prompt_tokens = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)
+    embedding_tokens = Column(Integer, default=0)
+    latency_ms = Column(Integer, default=0)  # 所有請求延遲的總和
+    
+    def __repr__(self):
+        return f'<UsageRecord {self.period_start} {self.feature} {self.model}>'
+
+class StatCounter:
+    """Incrementally maintained dashboard counter (e.g. total chat messages)"""
+    __tablename__ = 'stat_counter'
+    
+    key = Column(String(64), primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<StatCounter {self.key}={self.value}>'
+
+class MessageVolume:
+    """Hourly message counts used for dashboard charts"""
+    __tablename__ = 'message_volume'
+    
+    bucket_start = Column(DateTime, primary_key=True)  # 整點（UTC）
+    user_messages = Column(Integer, nullable=False, default=0)
+    bot_messages = Column(Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<MessageVolume {self.bucket_start}>'
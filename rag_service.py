@@ -1,11 +1,22 @@
 import os
+import json
+import time
+import shutil
 import logging
 import numpy as np
 import faiss
 import pickle
+from collections import Counter
+from datetime import datetime
 from flask import current_app
-from config import is_rag_enabled
+from config import is_rag_enabled, get_ingest_settings
 from services.llm_service import LLMService
+from services.keyword_index import KeywordIndex, reciprocal_rank_fusion
+from services.index_store import IndexStore, KNOWLEDGE_BASE_DIR
+from services.document_parser import chunk_text
+from services.fingerprint import Deduplicator, content_hash, simhash, to_signed, to_unsigned, SIMHASH_VERSION
+from services import metrics
+from services.usage_tracker import UsageTracker
 from app import db
 
 # 延遲導入模型函數
@@ -14,185 +25,571 @@ def get_document_model():
     from app import Document
     return Document
 
+def get_fingerprint_model():
+    """獲取 DocumentFingerprint 模型"""
+    from app import DocumentFingerprint
+    return DocumentFingerprint
+
+def get_document_stats_model():
+    """獲取 DocumentStats 模型"""
+    from app import DocumentStats
+    return DocumentStats
+
 logger = logging.getLogger(__name__)
 
+class IndexBuildCancelled(Exception):
+    """Raised when a background index build is cancelled"""
+    pass
+
 class RAGService:
     """Service for Retrieval Augmented Generation (RAG)"""
     
-    # Path for storing the FAISS index
-    INDEX_PATH = "knowledge_base/faiss_index.idx"
-    EMBEDDINGS_PATH = "knowledge_base/embeddings.pkl"
+    # 索引以世代 (generation) 目錄發佈，每個世代包含以下檔案，見 services/index_store.py
+    INDEX_FILE = "faiss_index.idx"
+    EMBEDDINGS_FILE = "embeddings.pkl"
+    KEYWORD_INDEX_FILE = "keyword_index.pkl"
+    # search_many() 每次 Embedding 請求最多送出的查詢數；OpenAI 單次請求上限為 2048 筆輸入
+    QUERY_EMBEDDING_BATCH = 256
+    LEGACY_INDEX_DIR = "knowledge_base"  # 改用世代目錄前的索引位置，僅在尚未發佈任何世代時讀取
+    store = IndexStore(KNOWLEDGE_BASE_DIR)
+    
+    # 已載入世代的進程內快取 (generation, snapshot)；世代內容發佈後不再變動
+    _generation_cache = (None, None)
+    _generation_stats = {"hits": 0, "misses": 0}
     
     @staticmethod
-    def get_embedding(text, client=None):
-        """Get embedding for a text using OpenAI API"""
-        if client is None:
-            client = LLMService.get_client()
-            if not client:
-                logger.error("Failed to initialize OpenAI client for embeddings")
-                return None
+    def get_embeddings(texts, client, batch_size=64, stage="rag.index_embedding", feature="index"):
+        """Get embeddings for several texts, batching them into as few API calls as possible
         
+        Args:
+            stage (str, optional): Metrics stage name for each API call
+            feature (str, optional): Feature the token usage is attributed to
+        
+        Returns:
+            list: One embedding per text, or None if any request failed
+        """
+        embeddings = []
         try:
-            response = client.embeddings.create(
-                model="text-embedding-3-small",
-                input=text
-            )
-            return response.data[0].embedding
+            for start in range(0, len(texts), batch_size):
+                request_started = time.perf_counter()
+                with metrics.timed(stage):
+                    response = client.embeddings.create(
+                        model="text-embedding-3-small",
+                        input=texts[start:start + batch_size]
+                    )
+                metrics.record_tokens("text-embedding-3-small", getattr(response, "usage", None))
+                UsageTracker.record_response("text-embedding-3-small", response,
+                                             time.perf_counter() - request_started, feature=feature)
+                embeddings.extend(item.embedding for item in response.data)
         except Exception as e:
-            logger.error(f"Error getting embedding: {e}")
+            logger.error(f"Error getting embeddings: {e}")
             return None
+        return embeddings
     
     @staticmethod
-    def initialize_index():
-        """Initialize or load the FAISS index"""
-        # Create knowledge_base directory if it doesn't exist
-        os.makedirs("knowledge_base", exist_ok=True)
+    def load_generation():
+        """Load the published index generation, reusing the in-process copy if it hasn't changed
         
-        # Check if index already exists
-        if os.path.exists(RAGService.INDEX_PATH) and os.path.exists(RAGService.EMBEDDINGS_PATH):
-            try:
-                # Load existing index
-                index = faiss.read_index(RAGService.INDEX_PATH)
-                with open(RAGService.EMBEDDINGS_PATH, 'rb') as f:
-                    doc_embeddings = pickle.load(f)
-                logger.info("Loaded existing FAISS index")
-                return index, doc_embeddings
-            except Exception as e:
-                logger.error(f"Error loading FAISS index: {e}")
+        Returns:
+            dict: {"generation", "index", "doc_embeddings", "keyword_index"}. Callers should load
+            the snapshot once per search so every lookup sees the same generation.
+        """
+        generation = RAGService.store.current()
+        cached_generation, snapshot = RAGService._generation_cache
+        if snapshot is not None and cached_generation == generation:
+            RAGService._generation_stats["hits"] += 1
+            return snapshot
+        RAGService._generation_stats["misses"] += 1
+        
+        base_dir = RAGService.store.path(generation) if generation else RAGService.LEGACY_INDEX_DIR
+        snapshot = {"generation": generation, "index": None, "doc_embeddings": {}, "keyword_index": None}
         
-        # Create new index
-        logger.info("Creating new FAISS index")
-        embedding_dim = 1536  # OpenAI's text-embedding-3-small dimension
-        index = faiss.IndexFlatL2(embedding_dim)
-        doc_embeddings = {}
+        index_path = os.path.join(base_dir, RAGService.INDEX_FILE)
+        embeddings_path = os.path.join(base_dir, RAGService.EMBEDDINGS_FILE)
+        if os.path.exists(index_path) and os.path.exists(embeddings_path):
+            snapshot["index"] = faiss.read_index(index_path)
+            with open(embeddings_path, 'rb') as f:
+                snapshot["doc_embeddings"] = pickle.load(f)
         
-        return index, doc_embeddings
+        keyword_index_path = os.path.join(base_dir, RAGService.KEYWORD_INDEX_FILE)
+        if os.path.exists(keyword_index_path):
+            snapshot["keyword_index"] = KeywordIndex.load(keyword_index_path)
+        
+        logger.info(f"Loaded index generation {generation or 'legacy'}")
+        RAGService._generation_cache = (generation, snapshot)
+        return snapshot
+    
+    @staticmethod
+    def get_cache_stats():
+        """Return hit/miss counters of the in-process index generation cache"""
+        return {"generation": dict(RAGService._generation_stats)}
     
     @staticmethod
-    def update_index():
-        """Update the FAISS index with all documents in the database"""
+    def publish_index(index, doc_embeddings, keyword_index):
+        """Write a complete index generation and atomically make it the live one
+        
+        Args:
+            index (faiss.Index, optional): Vector index; omitted when embeddings are unavailable.
+            doc_embeddings (dict): FAISS row -> document summary.
+            keyword_index (KeywordIndex, optional): BM25 index for the same documents.
+        """
+        generation, staging = RAGService.store.begin()
+        try:
+            if index is not None:
+                faiss.write_index(index, os.path.join(staging, RAGService.INDEX_FILE))
+                with open(os.path.join(staging, RAGService.EMBEDDINGS_FILE), 'wb') as f:
+                    pickle.dump(doc_embeddings, f)
+            if keyword_index is not None:
+                keyword_index.save(os.path.join(staging, RAGService.KEYWORD_INDEX_FILE))
+            RAGService.store.publish(generation, staging)
+        except Exception:
+            RAGService.store.abort(staging)
+            raise
+        return generation
+    
+    @staticmethod
+    def chunk_documents(documents):
+        """Split documents into indexable chunks, dropping chunks that duplicate an earlier one
+        
+        Returns:
+            dict: document ID -> list of (chunk number, text); numbers of dropped chunks are skipped
+        """
+        settings = get_ingest_settings()
+        deduplicator = Deduplicator()
+        doc_chunks = {}
+        skipped = 0
+        # 依文件 ID 排序，重複片段一律保留在最早的文件中，增量更新時結果一致
+        for doc in sorted(documents, key=lambda doc: doc.id):
+            doc_chunks[doc.id] = []
+            for n, chunk in enumerate(chunk_text(doc.content, settings["chunk_size"], settings["chunk_overlap"])):
+                if deduplicator.check_and_add(chunk, (doc.id, n)) is not None:
+                    skipped += 1
+                    continue
+                doc_chunks[doc.id].append((n, chunk))
+        if skipped:
+            logger.info(f"Skipped {skipped} duplicate chunks")
+        return doc_chunks
+    
+    @staticmethod
+    def entry_key(entry):
+        """Key identifying one indexed chunk; entries from older indexes have no chunk number"""
+        return (entry["id"], entry.get("chunk", 0))
+    
+    @staticmethod
+    def build_keyword_index(documents, doc_chunks):
+        """Build the BM25 keyword index over document chunks (no API calls)"""
+        keyword_index = KeywordIndex()
+        for doc in documents:
+            for n, chunk in doc_chunks[doc.id]:
+                keyword_index.add((doc.id, n), f"{doc.title}\n{chunk}", {
+                    "id": doc.id,
+                    "chunk": n,
+                    "title": doc.title,
+                    "content": chunk
+                })
+        logger.info(f"Built keyword index with {len(keyword_index)} chunks from {len(documents)} documents")
+        return keyword_index
+    
+    @staticmethod
+    def update_index(progress_callback=None, should_cancel=None, work_dir=None, incremental=False):
+        """Update the FAISS and keyword indexes with all documents in the database
+        
+        Args:
+            progress_callback (callable, optional): Called as progress_callback(processed, total) after each batch.
+            should_cancel (callable, optional): Returning True stops the build and raises IndexBuildCancelled.
+            work_dir (str, optional): Directory for resumable checkpoints. A build started with the same
+                work_dir resumes after the last checkpointed batch.
+            incremental (bool, optional): Reuse embeddings from the published generation and only embed
+                documents missing from it. Falls back to a full rebuild when that isn't possible.
+        """
+        try:
+            # Get all active documents
+            Document = get_document_model()
+            documents = Document.query.filter_by(is_active=True).all()
+        except Exception as e:
+            logger.error(f"Error loading documents for indexing: {e}")
+            return False
+        
+        # 關鍵字索引不需要呼叫 API，先建立，確保 Embedding 無法使用時仍可搜尋
+        try:
+            doc_chunks = RAGService.chunk_documents(documents)
+            keyword_index = RAGService.build_keyword_index(documents, doc_chunks)
+        except Exception as e:
+            logger.error(f"Error building keyword index: {e}")
+            keyword_index = None
+        
         client = LLMService.get_client()
         if not client:
             logger.error("Cannot update index: OpenAI client initialization failed")
+            if keyword_index is not None:
+                if should_cancel and should_cancel():
+                    raise IndexBuildCancelled()
+                # 沒有 Embedding 時向量搜尋本來就無法使用，發佈只含關鍵字索引的世代
+                try:
+                    generation = RAGService.publish_index(None, {}, keyword_index)
+                    RAGService.record_document_stats(documents, doc_chunks, {}, generation)
+                except Exception as e:
+                    logger.error(f"Error publishing keyword index: {e}")
             return False
             
         try:
-            # Initialize index
-            index, doc_embeddings = RAGService.initialize_index()
-            
-            # Get all active documents
-            Document = get_document_model()
-            documents = Document.query.filter_by(is_active=True).all()
-            
-            # Reset index
-            if index.ntotal > 0:
-                index.reset()
-                doc_embeddings = {}
+            # 從檢查點恢復，或從目前世代增量更新，或建立新的索引
+            checkpoint = RAGService._load_checkpoint(work_dir)
+            if checkpoint is None and incremental:
+                checkpoint = RAGService._load_incremental_base(documents)
+            if checkpoint is None:
+                embedding_dim = 1536  # OpenAI's text-embedding-3-small dimension
+                checkpoint = (faiss.IndexFlatL2(embedding_dim), {}, set())
+            index, doc_embeddings, done_ids = checkpoint
+            embedded_ids = set()  # 本次實際呼叫 Embedding API 的文件
             
             # 分批處理文件，避免記憶體溢出
             batch_size = 5  # 每批處理的文件數量
             total_docs = len(documents)
-            processed_docs = 0
+            pending_docs = [doc for doc in documents if doc.id not in done_ids]
             
-            for i in range(0, total_docs, batch_size):
-                batch_docs = documents[i:i+batch_size]
-                # Generate embeddings for documents in this batch
+            if progress_callback:
+                progress_callback(total_docs - len(pending_docs), total_docs)
+            
+            for i in range(0, len(pending_docs), batch_size):
+                if should_cancel and should_cancel():
+                    raise IndexBuildCancelled()
+                
+                batch_docs = pending_docs[i:i+batch_size]
+                # Generate embeddings for the chunks of each document in this batch
                 for doc in batch_docs:
                     try:
+                        chunks = [chunk for _, chunk in doc_chunks[doc.id]]
+                        if not chunks:
+                            done_ids.add(doc.id)
+                            continue
+                        
                         # 設置重試機制
                         max_retries = 3
                         retry_delay = 1
-                        embedding = None
+                        embeddings = None
                         
                         for attempt in range(max_retries):
                             try:
-                                embedding = RAGService.get_embedding(doc.content, client)
-                                if embedding:
+                                embeddings = RAGService.get_embeddings(chunks, client)
+                                if embeddings:
                                     break
                                 
                                 if attempt < max_retries - 1:
-                                    import time
                                     time.sleep(retry_delay)
                                     retry_delay *= 2
                             except Exception as retry_error:
                                 logger.warning(f"Retry {attempt+1}/{max_retries} failed for document {doc.id}: {retry_error}")
                                 if attempt < max_retries - 1:
-                                    import time
                                     time.sleep(retry_delay)
                                     retry_delay *= 2
                         
-                        if embedding:
-                            # Convert to numpy array and reshape
-                            embedding_np = np.array(embedding).astype('float32').reshape(1, -1)
-                            
-                            # Add to index
-                            index.add(embedding_np)
+                        if embeddings:
+                            # Add all chunk vectors of this document to the index at once
+                            first_row = index.ntotal
+                            index.add(np.array(embeddings).astype('float32'))
                             
-                            # 僅保存必要的摘要信息，節省記憶體
-                            content_preview = doc.content[:500] if len(doc.content) > 500 else doc.content
-                            doc_embeddings[index.ntotal - 1] = {
-                                "id": doc.id,
-                                "title": doc.title,
-                                "content": content_preview
-                            }
-                            processed_docs += 1
+                            for row, (n, chunk) in enumerate(doc_chunks[doc.id]):
+                                doc_embeddings[first_row + row] = {
+                                    "id": doc.id,
+                                    "chunk": n,
+                                    "title": doc.title,
+                                    "content": chunk
+                                }
+                            embedded_ids.add(doc.id)
                     except Exception as doc_error:
                         logger.error(f"Error processing document {doc.id}: {doc_error}")
-                        continue
+                    done_ids.add(doc.id)
                 
-                # 每批處理完成后保存一次索引，確保進度不丟失
-                if i + batch_size >= total_docs or (i > 0 and i % (batch_size * 3) == 0):
-                    faiss.write_index(index, RAGService.INDEX_PATH)
-                    with open(RAGService.EMBEDDINGS_PATH, 'wb') as f:
-                        pickle.dump(doc_embeddings, f)
-                    logger.info(f"Interim save: Processed {processed_docs}/{total_docs} documents")
+                # 每批處理完成后保存檢查點，確保進度不丟失
+                if work_dir:
+                    RAGService._save_checkpoint(work_dir, index, doc_embeddings, done_ids)
+                    logger.info(f"Checkpoint: Processed {len(done_ids)}/{total_docs} documents")
+                if progress_callback:
+                    progress_callback(total_docs - len(pending_docs) + i + len(batch_docs), total_docs)
             
-            # 最終保存索引
-            faiss.write_index(index, RAGService.INDEX_PATH)
-            with open(RAGService.EMBEDDINGS_PATH, 'wb') as f:
-                pickle.dump(doc_embeddings, f)
+            # 發佈前最後確認一次（例如任務已被取消，或已由其他 worker 接手）
+            if should_cancel and should_cancel():
+                raise IndexBuildCancelled()
+            # 寫入新的世代並原子性地切換，搜尋中的請求不會讀到寫到一半的索引
+            generation = RAGService.publish_index(index, doc_embeddings, keyword_index)
+            RAGService.record_document_stats(documents, doc_chunks, doc_embeddings, generation, embedded_ids)
+            
+            if work_dir:
+                shutil.rmtree(work_dir, ignore_errors=True)
                 
-            logger.info(f"Updated FAISS index with {processed_docs}/{total_docs} documents")
+            indexed_docs = len({entry["id"] for entry in doc_embeddings.values()})
+            logger.info(f"Updated FAISS index with {index.ntotal} chunks from {indexed_docs}/{total_docs} documents")
             return True
+        except IndexBuildCancelled:
+            logger.info("Index build cancelled")
+            raise
         except Exception as e:
             logger.error(f"Error updating FAISS index: {e}")
             return False
     
+    @staticmethod
+    def record_document_stats(documents, doc_chunks, doc_embeddings, generation, embedded_ids=()):
+        """Store each document's chunk count and index state after a generation is published
+        
+        Args:
+            embedded_ids (set, optional): Documents embedded in this build (their last_embedded_at is updated);
+                documents whose vectors were reused from the previous generation keep the old time
+        """
+        DocumentStats = get_document_stats_model()
+        try:
+            indexed = Counter(entry["id"] for entry in doc_embeddings.values())
+            existing = {stats.document_id: stats for stats in DocumentStats.query.all()}
+            now = datetime.utcnow()
+            for doc in documents:
+                stats = existing.get(doc.id)
+                if stats is None:
+                    stats = DocumentStats(document_id=doc.id)
+                    db.session.add(stats)
+                stats.size_chars = len(doc.content)
+                stats.chunk_count = len(doc_chunks.get(doc.id, []))
+                stats.indexed_chunks = indexed.get(doc.id, 0)
+                stats.generation = generation
+                if doc.id in embedded_ids:
+                    stats.last_embedded_at = now
+            db.session.commit()
+        except Exception as e:
+            logger.error(f"Error recording document stats: {e}")
+            db.session.rollback()
+    
+    @staticmethod
+    def backfill_document_stats():
+        """Create missing document_stats rows with one INSERT ... SELECT; content length is computed in SQL"""
+        from sqlalchemy import func, insert, select
+        Document = get_document_model()
+        DocumentStats = get_document_stats_model()
+        missing = select(Document.id, func.length(Document.content), 0).outerjoin(
+            DocumentStats, DocumentStats.document_id == Document.id
+        ).where(DocumentStats.document_id.is_(None))
+        result = db.session.execute(
+            insert(DocumentStats).from_select(['document_id', 'size_chars', 'indexed_chunks'], missing)
+        )
+        db.session.commit()
+        if result.rowcount:
+            logger.info(f"Created stats for {result.rowcount} existing documents")
+    
+    @staticmethod
+    def recompute_fingerprints(batch_size=50):
+        """Recompute stored SimHash values when the fingerprint algorithm has changed (SIMHASH_VERSION)
+
+        Returns:
+            int: Number of fingerprints recomputed
+        """
+        from config import ConfigManager
+        if ConfigManager.get("DOCUMENT_SIMHASH_VERSION", "") == SIMHASH_VERSION:
+            return 0
+        Document = get_document_model()
+        DocumentFingerprint = get_fingerprint_model()
+        last_id = 0
+        updated = 0
+        while True:
+            # 每批只載入少量文件內容，並各自提交
+            rows = db.session.query(DocumentFingerprint, Document.content).join(
+                Document, Document.id == DocumentFingerprint.document_id
+            ).filter(DocumentFingerprint.document_id > last_id).order_by(
+                DocumentFingerprint.document_id.asc()
+            ).limit(batch_size).all()
+            if not rows:
+                break
+            for fingerprint, content in rows:
+                fingerprint.content_hash = content_hash(content)
+                fingerprint.simhash = to_signed(simhash(content))
+            last_id = rows[-1][0].document_id
+            db.session.commit()
+            db.session.expunge_all()
+            updated += len(rows)
+        ConfigManager.set("DOCUMENT_SIMHASH_VERSION", SIMHASH_VERSION)
+        if updated:
+            logger.info(f"Recomputed {updated} document fingerprints (SimHash version {SIMHASH_VERSION})")
+        return updated
+    
+    @staticmethod
+    def _load_checkpoint(work_dir):
+        """Load (index, doc_embeddings, done_ids) from a build checkpoint, or None if there is none"""
+        checkpoint_path = os.path.join(work_dir, "checkpoint.json") if work_dir else None
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            try:
+                index = faiss.read_index(os.path.join(work_dir, "faiss_index.idx"))
+                with open(os.path.join(work_dir, "embeddings.pkl"), 'rb') as f:
+                    doc_embeddings = pickle.load(f)
+                with open(checkpoint_path, encoding='utf-8') as f:
+                    done_ids = set(json.load(f)["done_ids"])
+                logger.info(f"Resuming index build from checkpoint ({len(done_ids)} documents done)")
+                return index, doc_embeddings, done_ids
+            except Exception as e:
+                logger.error(f"Error loading index build checkpoint, starting over: {e}")
+        return None
+    
+    @staticmethod
+    def _load_incremental_base(documents):
+        """Start from a copy of the published index, or None if a full rebuild is needed"""
+        try:
+            with metrics.timed("rag.load_generation"):
+                snapshot = RAGService.load_generation()
+        except Exception as e:
+            logger.error(f"Error loading index generation for incremental update: {e}")
+            return None
+        if snapshot["index"] is None:
+            return None
+        
+        indexed_ids = {entry["id"] for entry in snapshot["doc_embeddings"].values()}
+        active_ids = {doc.id for doc in documents}
+        # 已刪除或停用的文件仍在索引中時，必須完整重建
+        if indexed_ids - active_ids:
+            logger.info("Published index contains removed documents, doing a full rebuild")
+            return None
+        
+        logger.info(f"Incremental index update: {len(active_ids - indexed_ids)} new documents")
+        # 複製索引，讀取端仍在使用的世代不能被修改
+        return faiss.clone_index(snapshot["index"]), dict(snapshot["doc_embeddings"]), indexed_ids
+    
+    @staticmethod
+    def _save_checkpoint(work_dir, index, doc_embeddings, done_ids):
+        """Save the partial index and the set of processed document IDs"""
+        os.makedirs(work_dir, exist_ok=True)
+        faiss.write_index(index, os.path.join(work_dir, "faiss_index.idx"))
+        with open(os.path.join(work_dir, "embeddings.pkl"), 'wb') as f:
+            pickle.dump(doc_embeddings, f)
+        # 最後寫入檢查點檔案，確保它只指向已完整寫入的索引
+        with open(os.path.join(work_dir, "checkpoint.json"), 'w', encoding='utf-8') as f:
+            json.dump({"done_ids": sorted(done_ids)}, f)
+    
     @staticmethod
     def search(query, top_k=3):
-        """Search the FAISS index for relevant documents"""
+        """Search the knowledge base with hybrid keyword (BM25) and vector (FAISS) retrieval"""
+        results = RAGService.search_many([query], top_k)
+        return results[0] if results and results[0] else None
+    
+    @staticmethod
+    def search_many(queries, top_k=3):
+        """Run hybrid retrieval for several queries with batched embedding requests and one FAISS search
+        
+        Args:
+            queries (list): Query strings
+            top_k (int, optional): Results per query. Defaults to 3.
+        
+        Returns:
+            list: One list per query of result dicts ("id", "chunk", "title", "content") with
+            "score" (fused RRF score), "keyword_score" (BM25 or None) and "distance" (L2 or None);
+            None if RAG is disabled or the index can't be loaded
+        """
         if not is_rag_enabled():
             logger.info("RAG is disabled, skipping search")
             return None
+        
+        # 候選數量多於 top_k，讓融合排序有足夠的選擇
+        candidates = top_k * 4
+        
+        # 整個搜尋過程使用同一個世代，避免索引切換時向量與關鍵字結果不一致
+        try:
+            with metrics.timed("rag.load_generation"):
+                snapshot = RAGService.load_generation()
+        except Exception as e:
+            logger.error(f"Error loading index generation: {e}")
+            return None
+        
+        # 向量搜尋；Embedding API 無法使用時退回純關鍵字搜尋
+        vector_hits = RAGService._vector_search_many(queries, candidates, snapshot)
+        keyword_index = snapshot["keyword_index"]
+        if vector_hits is None and keyword_index is not None:
+            logger.info("Vector search unavailable, using keyword results only")
+        
+        all_results = []
+        for i, query in enumerate(queries):
+            rankings = []
+            entries = {}
+            keyword_scores = {}
+            distances = {}
             
+            # 關鍵字搜尋（本地執行，不需要網路）
+            if keyword_index is not None:
+                ranking = []
+                with metrics.timed("rag.keyword_search"):
+                    keyword_hits = keyword_index.search(query, candidates)
+                for entry_id, score in keyword_hits:
+                    entry = keyword_index.entries[entry_id]
+                    key = RAGService.entry_key(entry)
+                    ranking.append(key)
+                    entries[key] = entry
+                    keyword_scores[key] = score
+                rankings.append(ranking)
+            
+            if vector_hits is not None:
+                ranking = []
+                for entry, distance in vector_hits[i]:
+                    key = RAGService.entry_key(entry)
+                    ranking.append(key)
+                    entries.setdefault(key, entry)
+                    distances[key] = distance
+                rankings.append(ranking)
+            
+            # 舊世代可能仍含重複片段，相同內容只回傳一次
+            results = []
+            seen_hashes = set()
+            for key, score in reciprocal_rank_fusion(rankings, with_scores=True):
+                digest = content_hash(entries[key]["content"])
+                if digest in seen_hashes:
+                    continue
+                seen_hashes.add(digest)
+                # 複製一份再加上分數，快取中的世代資料不可修改
+                results.append(dict(
+                    entries[key],
+                    score=score,
+                    keyword_score=keyword_scores.get(key),
+                    distance=distances.get(key)
+                ))
+                if len(results) == top_k:
+                    break
+            all_results.append(results)
+        
+        return all_results
+    
+    @staticmethod
+    def _vector_search_many(queries, top_k, snapshot):
+        """Search the snapshot's FAISS index for all queries at once
+        
+        Returns:
+            list: Per query, a list of (entry, L2 distance) pairs best first; None if unavailable
+        """
+        index, doc_embeddings = snapshot["index"], snapshot["doc_embeddings"]
+        
+        # If index is empty, no results
+        if index is None or index.ntotal == 0:
+            return None
+        
         client = LLMService.get_client()
         if not client:
-            logger.error("Cannot search: OpenAI client initialization failed")
+            logger.error("Cannot run vector search: OpenAI client initialization failed")
             return None
             
         try:
-            # Get embedding for query
-            query_embedding = RAGService.get_embedding(query, client)
-            if not query_embedding:
+            # 查詢每 QUERY_EMBEDDING_BATCH 筆合併為一次 Embedding 請求，向量合併後仍只搜尋一次
+            query_embeddings = RAGService.get_embeddings(
+                queries, client, batch_size=RAGService.QUERY_EMBEDDING_BATCH,
+                stage="rag.query_embedding", feature="rag"
+            )
+            if not query_embeddings:
                 return None
                 
-            query_np = np.array(query_embedding).astype('float32').reshape(1, -1)
+            query_np = np.array(query_embeddings).astype('float32')
             
-            # Load index
-            index, doc_embeddings = RAGService.initialize_index()
-            
-            # If index is empty, no results
-            if index.ntotal == 0:
-                return None
-                
-            # Search index
-            distances, indices = index.search(query_np, min(top_k, index.ntotal))
+            # 以查詢矩陣進行一次向量化搜尋
+            with metrics.timed("rag.faiss_search"):
+                distances, indices = index.search(query_np, min(top_k, index.ntotal))
             
             # Get results
             results = []
-            for idx in indices[0]:
-                if idx in doc_embeddings:
-                    results.append(doc_embeddings[idx])
+            for row_distances, row_indices in zip(distances, indices):
+                results.append([
+                    (doc_embeddings[int(idx)], float(distance))
+                    for distance, idx in zip(row_distances, row_indices)
+                    if int(idx) in doc_embeddings
+                ])
             
             return results
         except Exception as e:
@@ -205,7 +602,8 @@ class RAGService:
         if not is_rag_enabled():
             return None
             
-        results = RAGService.search(query)
+        with metrics.timed("rag.search"):
+            results = RAGService.search(query)
         if not results:
             return None
             
@@ -216,53 +614,125 @@ class RAGService:
             
         return context
     
+    @staticmethod
+    def schedule_index_update(kind="rebuild", payload=None):
+        """Queue a background index build and return the IndexJob (or None on failure)"""
+        from services.index_jobs import IndexJobRunner
+        try:
+            return IndexJobRunner.enqueue(current_app._get_current_object(), kind, payload)
+        except Exception as e:
+            logger.error(f"Error scheduling index update: {e}")
+            return None
+    
     @staticmethod
     def add_document(title, content, filename=None):
         """Add a document to the database and update the index"""
+        success, result = RAGService.add_documents([{"title": title, "content": content, "filename": filename}])
+        if not success:
+            return False, result
+        if result["duplicates"]:
+            duplicate = result["duplicates"][0]
+            kind = "相同" if duplicate["exact"] else "幾乎相同"
+            return False, f'內容與現有文件「{duplicate["duplicate_of"]}」{kind}，未重複加入'
+        return True, result["doc_ids"][0]
+    
+    @staticmethod
+    def load_document_deduplicator():
+        """Build a Deduplicator over active documents, fingerprinting any that don't have one yet"""
+        Document = get_document_model()
+        DocumentFingerprint = get_fingerprint_model()
+        
+        rows = db.session.query(Document.id, Document.title, DocumentFingerprint).outerjoin(
+            DocumentFingerprint, DocumentFingerprint.document_id == Document.id
+        ).filter(Document.is_active == True).all()
+        
+        deduplicator = Deduplicator()
+        missing = {}
+        for doc_id, title, fingerprint in rows:
+            if fingerprint is None:
+                missing[doc_id] = title
+            else:
+                deduplicator.add(title, fingerprint.content_hash, to_unsigned(fingerprint.simhash))
+        
+        # 補上較早加入、尚無指紋的文件
+        if missing:
+            for doc in Document.query.filter(Document.id.in_(list(missing))).all():
+                digest, value = content_hash(doc.content), simhash(doc.content)
+                db.session.add(DocumentFingerprint(document_id=doc.id, content_hash=digest, simhash=to_signed(value)))
+                deduplicator.add(doc.title, digest, value)
+            logger.info(f"Fingerprinted {len(missing)} existing documents")
+        return deduplicator
+    
+    @staticmethod
+    def add_documents(items):
+        """Add several documents in one transaction and queue a single incremental index update
+        
+        與現有文件或同批其他文件內容相同（雜湊）或幾乎相同（SimHash）的項目會被略過。
+        
+        Args:
+            items (list): dicts with "title", "content" and optional "filename"
+        
+        Returns:
+            tuple: (True, {"doc_ids": [...], "duplicates": [{"title", "duplicate_of", "exact"}]})
+                or (False, error message)
+        """
         try:
-            # Get Document model and add to database
             Document = get_document_model()
-            doc = Document(
-                title=title,
-                content=content,
-                filename=filename,
-                is_active=True
-            )
-
-            db.session.add(doc)
-            db.session.commit()
+            DocumentFingerprint = get_fingerprint_model()
+            deduplicator = RAGService.load_document_deduplicator()
             
-            # Update index
-            RAGService.update_index()
+            docs = []
+            fingerprints = []
+            duplicates = []
+            for item in items:
+                digest, value = content_hash(item["content"]), simhash(item["content"])
+                duplicate_of, exact = deduplicator.check(digest, value)
+                if duplicate_of is not None:
+                    duplicates.append({"title": item["title"], "duplicate_of": duplicate_of, "exact": exact})
+                    continue
+                deduplicator.add(item["title"], digest, value)
+                docs.append(Document(
+                    title=item["title"],
+                    content=item["content"],
+                    filename=item.get("filename"),
+                    is_active=True
+                ))
+                fingerprints.append((digest, value))
             
-            return True, doc.id
+            db.session.add_all(docs)
+            db.session.flush()
+            db.session.add_all([
+                DocumentFingerprint(document_id=doc.id, content_hash=digest, simhash=to_signed(value))
+                for doc, (digest, value) in zip(docs, fingerprints)
+            ])
+            db.session.add_all([
+                get_document_stats_model()(document_id=doc.id, size_chars=len(doc.content))
+                for doc in docs
+            ])
+            db.session.commit()
         except Exception as e:
-            logger.error(f"Error adding document: {e}")
+            logger.error(f"Error adding documents: {e}")
             db.session.rollback()
             return False, str(e)
+        
+        if duplicates:
+            logger.info(f"Skipped {len(duplicates)} duplicate documents")
+        doc_ids = [doc.id for doc in docs]
+        if doc_ids:
+            RAGService.schedule_index_update("incremental", {"doc_ids": doc_ids})
+        return True, {"doc_ids": doc_ids, "duplicates": duplicates}
             
     @staticmethod
-    def export_knowledge_base():
-        """Export all knowledge base documents as a downloadable file"""
-        try:
-            Document = get_document_model()
-            documents = Document.query.all()
-            
-            # Create a formatted text file with all documents
-            export_content = "# FlyPig 知識庫匯出\n\n"
-            
-            for i, doc in enumerate(documents, 1):
-                export_content += f"## {i}. {doc.title}\n"
-                if doc.filename:
-                    export_content += f"來源: {doc.filename}\n"
-                export_content += f"上傳時間: {doc.uploaded_at.strftime('%Y-%m-%d %H:%M:%S')}\n\n"
-                export_content += f"{doc.content}\n\n"
-                export_content += "---\n\n"
-            
-            return export_content
-        except Exception as e:
-            logger.error(f"Error exporting knowledge base: {e}")
-            return None
+    def export_knowledge_base(export_format="markdown"):
+        """Stream all knowledge base documents as Markdown, JSON lines or a zip bundle
+        
+        Returns:
+            tuple: (byte chunk generator, content type, filename); documents are read a few at a time
+            while the response is sent
+        """
+        from services.knowledge_export import iter_documents, export_stream
+        Document = get_document_model()
+        return export_stream(export_format, iter_documents(db.session, Document))
     
     @staticmethod
     def delete_document(doc_id):
@@ -272,12 +742,15 @@ class RAGService:
             doc = Document.query.get(doc_id)
             if not doc:
                 return False, "Document not found"
-                
+            
+            # SQLite 預設不啟用外鍵，明確刪除指紋與統計
+            get_fingerprint_model().query.filter_by(document_id=doc_id).delete()
+            get_document_stats_model().query.filter_by(document_id=doc_id).delete()
             db.session.delete(doc)
             db.session.commit()
             
-            # Update index
-            RAGService.update_index()
+            # 在背景更新索引，不阻塞請求
+            RAGService.schedule_index_update()
             
             return True, "Document deleted successfully"
         except Exception as e:
@@ -63,10 +63,9 @@ def dashboard():
     # 獲取數據庫會話和模型
     BotStyle, LineUser, ChatMessage, _, Document = get_models()
     
-    # Get stats
-    user_count = LineUser.query.count()
-    message_count = ChatMessage.query.count()
-    document_count = Document.query.count()
+    # Get stats（由寫入路徑累加的計數器，定期以 COUNT(*) 校正）
+    from services.stats_service import StatsService
+    counters = StatsService.get_counters()
     
     # Get recent messages
     recent_messages = ChatMessage.query.order_by(ChatMessage.timestamp.desc()).limit(10).all()
@@ -82,17 +81,45 @@ def dashboard():
     # Get RAG status
     rag_enabled = ConfigManager.get("RAG_ENABLED", "True") == "True"
     
+    # 本進程自啟動以來的各階段延遲、Token 用量與重試次數
+    from services import metrics
+    
+    # Token 用量與估計成本（背景執行緒每 10 秒寫入，彙總結果快取 60 秒）
+    from services.usage_tracker import UsageTracker
+    usage = UsageTracker.rollups(days=30)
+    
     return render_template(
         'dashboard.html',
-        user_count=user_count,
-        message_count=message_count,
-        document_count=document_count,
+        user_count=counters["line_users"],
+        message_count=counters["chat_messages"],
+        total_messages=counters["chat_messages"],
+        user_messages=counters["user_messages"],
+        bot_messages=counters["bot_messages"],
+        document_count=counters["documents"],
         recent_messages=recent_messages,
         active_style=active_style,
         api_status=api_status,
-        rag_enabled=rag_enabled
+        rag_enabled=rag_enabled,
+        stage_metrics=metrics.stage_summary(),
+        token_metrics=metrics.token_summary(),
+        retry_metrics=metrics.retry_summary(),
+        usage=usage
     )
 
+@admin_bp.route('/dashboard/stats')
+@admin_required
+def dashboard_stats():
+    """Counters and hourly message volume for the dashboard charts"""
+    from services.stats_service import StatsService
+    try:
+        hours = min(max(int(request.args.get('hours', 24 * 14)), 1), 24 * 90)
+    except ValueError:
+        hours = 24 * 14
+    return jsonify({
+        "counters": StatsService.get_counters(),
+        "hourly": StatsService.get_hourly_volume(hours)
+    })
+
 # LLM Settings
 @admin_bp.route('/llm_settings', methods=['GET', 'POST'])
 @admin_required
@@ -341,109 +368,167 @@ def get_bot_style(style_id):
 @admin_bp.route('/message_history')
 @admin_required
 def message_history():
-    """Message history page"""
+    """Message history page, paged newest first with before/after cursors, or full-text search results for q"""
+    from services.message_query import keyset_page, approximate_count
+    
     # 獲取數據庫會話和模型
+    db = get_db()
     BotStyle, LineUser, ChatMessage, _, _ = get_models()
     
     # Get filter parameters
-    user_id = request.args.get('user_id')
-    page = request.args.get('page', 1, type=int)
+    user_id = request.args.get('user_id') or None
+    before = request.args.get('before')
+    after = request.args.get('after')
+    search_query = request.args.get('q', '').strip()
     per_page = 50
     
+    # 篩選中的用戶（下拉選單改為非同步搜尋，不再載入所有用戶）
+    line_user = LineUser.query.filter_by(line_user_id=user_id).first() if user_id else None
+    
+    # 全文搜尋：依相關度或時間排序，以頁碼分頁
+    if search_query:
+        from services.message_search import MessageSearch
+        order = request.args.get('order', 'relevance')
+        page = request.args.get('page', 1, type=int)
+        results = MessageSearch.search(search_query, user_id=user_id, page=page, per_page=per_page, order=order)
+        return render_template(
+            'message_history.html',
+            messages=results['items'],
+            search_query=search_query,
+            search_order=order,
+            page=page,
+            has_more=results['has_more'],
+            current_user_id=user_id,
+            current_line_user=line_user
+        )
+    
     # Build query
     query = ChatMessage.query
     if user_id:
         query = query.filter_by(line_user_id=user_id)
     
-    # Get paginated messages
-    messages = query.order_by(ChatMessage.timestamp.desc()).paginate(page=page, per_page=per_page)
-    
-    # Get all LINE users for filter dropdown
-    users = LineUser.query.all()
+    # Keyset 分頁：不使用 OFFSET，也不在每頁執行 COUNT(*)
+    try:
+        page = keyset_page(query, ChatMessage, before=before, after=after, per_page=per_page)
+    except ValueError:
+        flash('分頁參數無效，已回到第一頁。', 'warning')
+        return redirect(url_for('admin.message_history', user_id=user_id))
     
-    return render_template('message_history.html', messages=messages, users=users, current_user_id=user_id)
+    return render_template(
+        'message_history.html',
+        messages=page['items'],
+        older_cursor=page['older_cursor'],
+        newer_cursor=page['newer_cursor'],
+        approximate_total=approximate_count(db.session, ChatMessage, user_id),
+        current_user_id=user_id,
+        current_line_user=line_user
+    )
+
+@admin_bp.route('/line_users/search')
+@admin_required
+def search_line_users():
+    """JSON typeahead search over LINE users by display name or LINE user ID"""
+    from services.user_search import SEARCH_LIMIT, search_line_users as search
+    _, LineUser, _, _, _ = get_models()
+    try:
+        limit = int(request.args.get('limit', SEARCH_LIMIT))
+    except ValueError:
+        limit = SEARCH_LIMIT
+    return jsonify({"users": search(LineUser, request.args.get('q', ''), limit)})
 
 @admin_bp.route('/export_messages')
 @admin_required
 def export_messages():
-    """Export message history as CSV or JSON"""
+    """Stream message history as CSV, JSON or JSON lines, optionally gzip-compressed
+    
+    Query parameters: format (csv, json, jsonl), user_id, start_date / end_date (YYYY-MM-DD, inclusive), gzip
+    """
+    from itertools import chain
+    from flask import Response, stream_with_context
+    from config import get_retention_settings
+    from services.message_export import EXPORT_FORMATS, parse_date_range, iter_message_batches, export_stream
+    from services.retention import iter_archived_batches, skip_archived
+    
     export_format = request.args.get('format', 'csv').lower()
+    if export_format not in EXPORT_FORMATS:
+        export_format = 'csv'
     user_id = request.args.get('user_id')
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'on', 'yes')
+    
+    try:
+        start, end = parse_date_range(request.args.get('start_date'), request.args.get('end_date'))
+    except ValueError:
+        flash('日期格式錯誤，請使用 YYYY-MM-DD，且開始日期不可晚於結束日期。', 'danger')
+        return redirect(url_for('admin.message_history', user_id=user_id))
     
     # 獲取數據庫會話和模型
     db = get_db()
-    ChatMessage, _, _, _, _ = get_models()
-    
-    # Build query
-    query = db.session.query(ChatMessage)
-    if user_id:
-        query = query.filter_by(line_user_id=user_id)
+    _, _, ChatMessage, _, _ = get_models()
+    
+    # 分批查詢並邊產生邊傳送，不把整份歷史載入記憶體；已封存的較舊訊息先從封存檔讀出，
+    # 資料表中同時存在於封存檔的資料列（封存在刪除途中中斷）不重複匯出
+    archive_dir = get_retention_settings()["archive_dir"]
+    archived_max_ids = {}
+    batches = chain(
+        iter_archived_batches(archive_dir, user_id=user_id, start=start, end=end, max_ids=archived_max_ids),
+        skip_archived(
+            iter_message_batches(db.session, ChatMessage, user_id=user_id, start=start, end=end),
+            archived_max_ids
+        )
+    )
+    chunks, content_type, filename = export_stream(export_format, batches, compress=compress)
     
-    # Get all messages ordered by timestamp
-    messages = query.order_by(ChatMessage.timestamp.asc()).all()
-    
-    if export_format == 'json':
-        # Convert to JSON
-        data = []
-        for msg in messages:
-            data.append({
-                'id': msg.id,
-                'line_user_id': msg.line_user_id,
-                'is_user_message': msg.is_user_message,
-                'message_text': msg.message_text,
-                'bot_style': msg.bot_style,
-                'timestamp': msg.timestamp.strftime('%Y-%m-%d %H:%M:%S')
-            })
-        
-        # Create response
-        response = make_response(json.dumps(data, ensure_ascii=False, indent=2))
-        response.headers['Content-Type'] = 'application/json'
-        response.headers['Content-Disposition'] = 'attachment; filename=messages_export.json'
-        return response
-    
-    # Default to CSV format
-    import csv
-    import io
-    
-    # Create CSV content in memory
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Write header
-    writer.writerow(['ID', 'LINE用戶ID', '訊息類型', '訊息內容', '機器人風格', '時間戳記'])
-    
-    # Write data rows
-    for msg in messages:
-        writer.writerow([
-            msg.id,
-            msg.line_user_id,
-            '用戶' if msg.is_user_message else '機器人',
-            msg.message_text,
-            msg.bot_style or '',
-            msg.timestamp.strftime('%Y-%m-%d %H:%M:%S')
-        ])
-    
-    # Create response with CSV content
-    response = make_response(output.getvalue())
-    response.headers['Content-Type'] = 'text/csv; charset=utf-8'
-    response.headers['Content-Disposition'] = 'attachment; filename=messages_export.csv'
+    response = Response(stream_with_context(chunks), content_type=content_type)
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
     return response
 
 # Knowledge Base
 @admin_bp.route('/knowledge_base')
 @admin_required
 def knowledge_base():
-    """Knowledge base management page"""
-    # 獲取數據庫會話和模型
+    """Knowledge base management page, paginated and sortable without loading document content"""
+    from sqlalchemy.orm import load_only
+    from app import DocumentStats
+    from services.index_store import IndexStore, KNOWLEDGE_BASE_DIR
+    
+    # 獲取數據庫會話和模型；此頁只讀取，較早加入的文件的統計資料由 flask init-db 補上
     db = get_db()
     _, _, _, _, Document = get_models()
     
-    # 修正查詢方式，從類實例查詢而不是類本身
-    # SQLAlchemy 在使用 ORM 模式時需要實例化的模型對象
-    from sqlalchemy import desc
-    documents = db.session.query(Document).order_by(desc('uploaded_at')).all()
+    sort_columns = {
+        'title': Document.title,
+        'uploaded_at': Document.uploaded_at,
+        'size': DocumentStats.size_chars,
+        'chunks': DocumentStats.chunk_count,
+        'embedded': DocumentStats.last_embedded_at
+    }
+    sort = request.args.get('sort', 'uploaded_at')
+    if sort not in sort_columns:
+        sort = 'uploaded_at'
+    direction = 'asc' if request.args.get('dir') == 'asc' else 'desc'
+    page = request.args.get('page', 1, type=int)
+    per_page = min(max(request.args.get('per_page', 20, type=int), 10), 100)
+    
+    # 只查詢列表需要的欄位（不含 content），統計資料來自 document_stats
+    column = sort_columns[sort]
+    query = db.session.query(Document, DocumentStats).outerjoin(
+        DocumentStats, DocumentStats.document_id == Document.id
+    ).options(
+        load_only(Document.id, Document.title, Document.filename, Document.uploaded_at, Document.is_active)
+    ).order_by(column.asc() if direction == 'asc' else column.desc(), Document.id.desc())
+    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    
     form = DocumentForm()
-    return render_template('knowledge_base.html', documents=documents, form=form)
+    return render_template(
+        'knowledge_base.html',
+        documents=pagination.items,
+        pagination=pagination,
+        sort=sort,
+        direction=direction,
+        per_page=per_page,
+        current_generation=IndexStore(KNOWLEDGE_BASE_DIR).current(),
+        form=form
+    )
 
 @admin_bp.route('/knowledge_base/add', methods=['POST'])
 @admin_required
@@ -462,12 +547,20 @@ def add_document():
             file = form.file.data
             filename = secure_filename(file.filename)
             
-            # Read file content
-            file_content = file.read().decode('utf-8', errors='replace')
+            # 依檔案格式擷取文字（PDF 逐頁、DOCX 逐段落）
+            from config import get_ingest_settings
+            from services.document_parser import parse_document, TEXT_EXTENSIONS, get_extension
+            max_chars = get_ingest_settings()["max_chars"]
+            result = parse_document(file.filename, file.read(), max_chars)
+            if result["error"]:
+                flash(f'處理檔案 {filename} 時發生錯誤: {result["error"]}', 'danger')
+                return redirect(url_for('admin.knowledge_base'))
+            if result["truncated"]:
+                flash(f'檔案 {filename} 過大，僅保留前 {max_chars} 個字元', 'warning')
             
-            # If no content was provided in the form, use file content
-            if not content:
-                content = file_content
+            # 文字檔的內容已預先載入表單並可編輯；PDF/DOCX 一律使用擷取出的文字
+            if not content or get_extension(file.filename) not in TEXT_EXTENSIONS:
+                content = result["content"]
         
         # Ensure we have content
         if not content:
@@ -512,6 +605,8 @@ def bulk_upload():
     
     success_count = 0
     error_count = 0
+    uploads = []
+    titles = []
     
     for file in files:
         # Check if file extension is allowed
@@ -519,34 +614,43 @@ def bulk_upload():
             flash(f'不支援的檔案格式: {file.filename}', 'warning')
             error_count += 1
             continue
-            
-        try:
-            # Create a title from the filename (without extension)
-            raw_title = file.filename.rsplit('.', 1)[0]
-            # Format title: replace underscore and dash with space, capitalize words
-            formatted_title = ' '.join(word.capitalize() for word in raw_title.replace('_', ' ').replace('-', ' ').split())
-            title = f"{title_prefix}{formatted_title}" if title_prefix else formatted_title
-            
-            # Read file content
-            content = file.read().decode('utf-8', errors='replace')
-            
-            if not content.strip():
-                flash(f'檔案 {file.filename} 是空的', 'warning')
-                error_count += 1
-                continue
-                
-            # Add to database
-            success, result = RAGService.add_document(title, content, file.filename)
-            
-            if success:
-                success_count += 1
-            else:
-                flash(f'添加文件 {file.filename} 錯誤: {result}', 'danger')
-                error_count += 1
-                
-        except Exception as e:
-            flash(f'處理檔案 {file.filename} 時發生錯誤: {str(e)}', 'danger')
+        
+        # Create a title from the filename (without extension)
+        raw_title = file.filename.rsplit('.', 1)[0]
+        # Format title: replace underscore and dash with space, capitalize words
+        formatted_title = ' '.join(word.capitalize() for word in raw_title.replace('_', ' ').replace('-', ' ').split())
+        titles.append(f"{title_prefix}{formatted_title}" if title_prefix else formatted_title)
+        uploads.append((file.filename, file.read()))
+    
+    # 在進程池中平行解析所有檔案，再以單一交易寫入並只排入一次增量索引更新
+    from config import get_ingest_settings
+    from services.document_parser import parse_documents
+    ingest_settings = get_ingest_settings()
+    parsed = parse_documents(uploads, ingest_settings["parse_workers"], ingest_settings["max_chars"])
+    
+    items = []
+    for title, result in zip(titles, parsed):
+        if result["error"]:
+            flash(f'處理檔案 {result["filename"]} 時發生錯誤: {result["error"]}', 'danger')
             error_count += 1
+        elif not result["content"].strip():
+            flash(f'檔案 {result["filename"]} 是空的', 'warning')
+            error_count += 1
+        else:
+            if result["truncated"]:
+                flash(f'檔案 {result["filename"]} 過大，僅保留前 {ingest_settings["max_chars"]} 個字元', 'warning')
+            items.append({"title": title, "content": result["content"], "filename": result["filename"]})
+    
+    if items:
+        success, result = RAGService.add_documents(items)
+        if success:
+            success_count = len(result["doc_ids"])
+            for duplicate in result["duplicates"]:
+                kind = "相同" if duplicate["exact"] else "幾乎相同"
+                flash(f'「{duplicate["title"]}」與「{duplicate["duplicate_of"]}」內容{kind}，已略過', 'info')
+        else:
+            flash(f'添加文件錯誤: {result}', 'danger')
+            error_count += len(items)
     
     # Show summary
     if success_count > 0:
@@ -555,10 +659,6 @@ def bulk_upload():
     if error_count > 0:
         flash(f'{error_count} 個文件處理失敗', 'warning')
     
-    # Rebuild index if any document was added successfully
-    if success_count > 0:
-        RAGService.update_index()
-        
     return redirect(url_for('admin.knowledge_base'))
 
 @admin_bp.route('/knowledge_base/delete/<int:doc_id>', methods=['POST'])
@@ -616,42 +716,74 @@ def download_document(doc_id):
 @admin_bp.route('/knowledge_base/rebuild_index', methods=['POST'])
 @admin_required
 def rebuild_index():
-    """Rebuild the FAISS index"""
+    """Queue a background rebuild of the FAISS index"""
     # 獲取 RAG 服務
     RAGService = get_rag_service()
     
-    success = RAGService.update_index()
+    job = RAGService.schedule_index_update()
     
-    if success:
-        flash('Knowledge base index rebuilt successfully.', 'success')
+    if job:
+        flash('已排入背景重建索引，可在本頁查看進度。', 'success')
     else:
         flash('Error rebuilding knowledge base index.', 'danger')
     
     return redirect(url_for('admin.knowledge_base'))
 
+@admin_bp.route('/knowledge_base/jobs/latest')
+@admin_required
+def latest_index_job():
+    """Get progress of the most recent index build job as JSON"""
+    from app import IndexJob
+    from services.index_jobs import IndexJobRunner
+    
+    job = IndexJob.query.order_by(IndexJob.id.desc()).first()
+    if job is None:
+        return jsonify({'job': None})
+    
+    # 頁面輪詢時確保本進程有 worker，讓重新啟動後未完成的任務能繼續
+    if job.status in ('pending', 'running'):
+        IndexJobRunner.ensure_worker(current_app._get_current_object())
+    
+    return jsonify({'job': IndexJobRunner.to_dict(job)})
+
+@admin_bp.route('/knowledge_base/jobs/<int:job_id>')
+@admin_required
+def index_job_status(job_id):
+    """Get progress and ETA of an index build job as JSON"""
+    from app import IndexJob
+    from services.index_jobs import IndexJobRunner
+    
+    job = IndexJob.query.get_or_404(job_id)
+    return jsonify({'job': IndexJobRunner.to_dict(job)})
+
+@admin_bp.route('/knowledge_base/jobs/<int:job_id>/cancel', methods=['POST'])
+@admin_required
+def cancel_index_job(job_id):
+    """Cancel a pending or running index build job"""
+    from services.index_jobs import IndexJobRunner
+    
+    if IndexJobRunner.cancel(job_id):
+        return jsonify({'success': True})
+    return jsonify({'success': False, 'message': '任務已結束或不存在'}), 400
+
 @admin_bp.route('/knowledge_base/export')
 @admin_required
 def export_knowledge_base():
-    """Export all knowledge base documents as a downloadable file"""
-    from flask import Response
+    """Stream all knowledge base documents as Markdown (default), JSON lines or a zip bundle"""
+    from flask import Response, stream_with_context
+    from services.knowledge_export import KB_EXPORT_FORMATS
     
     # 獲取 RAG 服務
     RAGService = get_rag_service()
     
-    # Get exported content
-    content = RAGService.export_knowledge_base()
-    
-    if not content:
-        flash('Error exporting knowledge base.', 'danger')
-        return redirect(url_for('admin.knowledge_base'))
-    
-    # Create a response with the document content
-    response = Response(content)
-    
-    # Set the appropriate headers for file download
-    response.headers['Content-Type'] = 'text/markdown'
-    response.headers['Content-Disposition'] = f'attachment; filename="flypig_knowledge_base_export.md"'
+    export_format = request.args.get('format', 'markdown').lower()
+    if export_format not in KB_EXPORT_FORMATS:
+        export_format = 'markdown'
     
+    # 邊讀取邊傳送，不把整個知識庫組成一個字串
+    chunks, content_type, filename = RAGService.export_knowledge_base(export_format)
+    response = Response(stream_with_context(chunks), content_type=content_type)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
     return response
 
 # User Management
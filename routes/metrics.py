@@ -0,0 +1,25 @@
+import hmac
+import logging
+from flask import Blueprint, Response, request
+from flask_login import current_user
+from routes.utils.config_service import get_metrics_token
+from services import metrics
+
+# 創建藍圖
+metrics_bp = Blueprint('metrics', __name__)
+logger = logging.getLogger(__name__)
+
+@metrics_bp.route('/metrics')
+def expose_metrics():
+    """Expose stage latency, token usage and retry metrics in the Prometheus text format"""
+    # 已登入的管理員可直接存取；其他請求需設定 METRICS_TOKEN 並以 Authorization: Bearer <token> 存取，
+    # 未設定時一律拒絕
+    if not (current_user.is_authenticated and current_user.is_admin):
+        token = get_metrics_token()
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        if not token or not hmac.compare_digest(supplied.encode(), token.encode()):
+            # 全局 Exception 處理器也會攔截 abort() 的 HTTPException，因此直接回傳 401
+            return Response('Unauthorized\n', status=401, mimetype='text/plain',
+                            headers={'WWW-Authenticate': 'Bearer'})
+    
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,4 +1,8 @@
 import os
+import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 class ConfigManager:
     """Configuration manager for the application"""
@@ -99,12 +103,17 @@ class ConfigManager:
 def get_openai_api_key():
     return ConfigManager.get("OPENAI_API_KEY", "")
 
+# Helper function to get an alternative OpenAI-compatible API base URL (e.g. a local stub)
+def get_openai_base_url():
+    return ConfigManager.get("OPENAI_BASE_URL", "") or None
+
 # Helper function to get LINE channel configuration
 def get_line_config():
     return {
         "channel_id": ConfigManager.get("LINE_CHANNEL_ID", ""),
         "channel_secret": ConfigManager.get("LINE_CHANNEL_SECRET", ""),
-        "channel_access_token": ConfigManager.get("LINE_CHANNEL_ACCESS_TOKEN", "")
+        "channel_access_token": ConfigManager.get("LINE_CHANNEL_ACCESS_TOKEN", ""),
+        "api_endpoint": ConfigManager.get("LINE_API_ENDPOINT", "") or "https://api.line.me"
     }
 
 # Helper function to get the active bot style
@@ -132,6 +141,106 @@ def is_web_search_enabled():
         return False
     return web_search_enabled.lower() == "true"
 
+# Helper function to check if index builds must run inside the request instead of a background thread.
+# Serverless platforms (Vercel sets VERCEL=1) freeze or kill threads once the response is sent
+def is_index_job_inline():
+    default = "True" if os.environ.get("VERCEL") else "False"
+    return (ConfigManager.get("INDEX_JOBS_INLINE", default) or default).lower() == "true"
+
 # Helper function to get the SerpAPI key
 def get_serpapi_key():
-    return ConfigManager.get("SERPAPI_KEY", "")
\ No newline at end of file
+    return ConfigManager.get("SERPAPI_KEY", "")
+
+# Helper function to get web search cache settings
+def get_search_cache_settings():
+    return {
+        "query_ttl": int(ConfigManager.get("SEARCH_CACHE_TTL", "3600")),
+        "page_ttl": int(ConfigManager.get("PAGE_CACHE_TTL", "86400")),
+        "max_entries": int(ConfigManager.get("SEARCH_CACHE_MAX_ENTRIES", "500")),
+        "store_path": ConfigManager.get("SEARCH_CACHE_PATH", "") or os.path.join("instance", "search_cache.db")
+    }
+
+
+# Helper function to get the parallel page fetch settings for web search
+def get_web_fetch_settings():
+    return {
+        "max_pages": int(ConfigManager.get("WEB_SEARCH_FETCH_PAGES", "3")),
+        "deadline": float(ConfigManager.get("WEB_SEARCH_FETCH_DEADLINE", "6"))
+    }
+
+# Helper function to get the web search provider settings
+def get_search_provider_settings():
+    return {
+        "provider": (ConfigManager.get("SEARCH_PROVIDER", "serpapi") or "serpapi").lower(),
+        "base_url": ConfigManager.get("SEARCH_API_BASE_URL", "") or None,
+        "corpus_path": ConfigManager.get("SEARCH_LOCAL_CORPUS", "") or None,
+        "record_path": ConfigManager.get("SEARCH_RECORD_PATH", "") or None
+    }
+
+# Helper function to get knowledge base ingestion settings
+def get_ingest_settings():
+    return {
+        "parse_workers": int(ConfigManager.get("KB_PARSE_WORKERS", "0")) or min(4, os.cpu_count() or 1),
+        "max_chars": int(ConfigManager.get("KB_MAX_DOCUMENT_CHARS", "2000000")),
+        "chunk_size": int(ConfigManager.get("KB_CHUNK_SIZE", "1000")),
+        "chunk_overlap": int(ConfigManager.get("KB_CHUNK_OVERLAP", "150"))
+    }
+
+# Helper function to get chat history / log retention settings (0 days keeps everything)
+def get_retention_settings():
+    from services.retention import MIN_RETENTION_DAYS
+    days = {}
+    for key, name in (("message_days", "MESSAGE_RETENTION_DAYS"), ("log_days", "LOG_RETENTION_DAYS")):
+        days[key] = int(ConfigManager.get(name, "0"))
+        # 0 表示永久保存；其他小於下限的值改用下限，並提示設定未如預期生效
+        if 0 < days[key] < MIN_RETENTION_DAYS:
+            logger.warning(f"{name}={days[key]} is below the minimum of {MIN_RETENTION_DAYS} days, "
+                           f"using {MIN_RETENTION_DAYS}")
+            days[key] = MIN_RETENTION_DAYS
+    return {
+        "message_days": days["message_days"],
+        "log_days": days["log_days"],
+        "archive_dir": ConfigManager.get("ARCHIVE_DIR", "") or os.path.join("instance", "archive"),
+        "interval": int(ConfigManager.get("RETENTION_INTERVAL", "21600"))
+    }
+
+# Helper function to get the bearer token for scraping /metrics (empty means only logged-in admins can read it).
+# Metrics live in each process's memory, so every gunicorn worker reports only its own counts
+def get_metrics_token():
+    return ConfigManager.get("METRICS_TOKEN", "")
+
+# 每百萬 Token 的美元價格，可用 MODEL_PRICES（JSON）覆寫或新增模型
+DEFAULT_MODEL_PRICES = {
+    "gpt-4o": {"prompt": 2.50, "completion": 10.00},
+    "text-embedding-3-small": {"embedding": 0.02},
+}
+
+# Helper function to get per-model token prices (USD per 1M tokens)
+def get_model_prices():
+    prices = {model: dict(price) for model, price in DEFAULT_MODEL_PRICES.items()}
+    try:
+        overrides = json.loads(ConfigManager.get("MODEL_PRICES", "") or "{}")
+    except ValueError:
+        overrides = {}
+    for model, price in overrides.items():
+        if isinstance(price, dict):
+            prices.setdefault(model, {}).update(price)
+    return prices
+
+# Helper function to get logging settings; logging is configured before the database is available, so only
+# environment variables are read
+def get_logging_settings():
+    levels = {}
+    for item in os.environ.get("LOG_LEVELS", "").split(","):
+        name, _, level = item.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return {
+        "level": os.environ.get("LOG_LEVEL", "INFO").upper(),
+        "module_levels": levels,
+        "db_level": os.environ.get("LOG_DB_LEVEL", "ERROR").upper(),
+        "queue_size": int(os.environ.get("LOG_QUEUE_SIZE", "10000")),
+        "sample_burst": int(os.environ.get("LOG_SAMPLE_BURST", "20")),
+        "sample_every": int(os.environ.get("LOG_SAMPLE_EVERY", "100")),
+        "sample_window": float(os.environ.get("LOG_SAMPLE_WINDOW", "60"))
+    }
@@ -1,18 +1,13 @@
 import json
 import logging
 import os
+import time
 from flask import Blueprint, request, abort, jsonify
-from linebot import LineBotApi, WebhookHandler
-from linebot.exceptions import InvalidSignatureError
-from linebot.models import (
-    MessageEvent, TextMessage, TextSendMessage,
-)
-# 避免循環導入，使用函數延遲導入
-from services.llm_service import LLMService
-# 避免循環導入
-from rag_service import RAGService
-from web_search_service import WebSearchService
+# LINE SDK、OpenAI、RAG（numpy/faiss）與網路搜尋模組載入較慢，在第一次處理訊息時才導入，
+# 讓 import app 的冷啟動不需負擔這些時間
 from routes.utils.config_service import get_line_config
+from services import metrics
+from services.usage_tracker import usage_context
 
 # 創建藍圖
 webhook_bp = Blueprint('webhook', __name__)
@@ -29,21 +24,39 @@ def get_models():
     from app import BotStyle, LineUser, ChatMessage, User, Document
     return BotStyle, LineUser, ChatMessage, User, Document
 
+def get_llm_service():
+    """延遲導入LLM服務（openai）"""
+    from services.llm_service import LLMService
+    return LLMService
+
+def get_web_search_service():
+    """延遲導入網路搜尋服務"""
+    from web_search_service import WebSearchService
+    return WebSearchService
+
 # Initialize the LINE Bot API and handler
 def get_line_bot_api():
     """Get a LINE Bot API instance with current config"""
+    from linebot import LineBotApi
     config = get_line_config()
-    return LineBotApi(config['channel_access_token'])
+    return LineBotApi(config['channel_access_token'], endpoint=config['api_endpoint'])
 
 def get_line_webhook_handler():
     """Get a LINE Webhook handler with current config"""
+    from linebot import WebhookHandler
+    from linebot.models import MessageEvent, TextMessage
     config = get_line_config()
-    return WebhookHandler(config['channel_secret'])
+    handler = WebhookHandler(config['channel_secret'])
+    # 每次都建立新的處理程序，必須在此註冊事件處理函數，否則文字訊息不會被處理
+    handler.add(MessageEvent, message=TextMessage)(handle_text_message)
+    return handler
 
 # LINE Bot webhook route
 @webhook_bp.route('/webhook', methods=['POST'])
 def line_webhook():
     """Handle LINE webhook events"""
+    from linebot.exceptions import InvalidSignatureError
+    
     # Get X-Line-Signature header value
     signature = request.headers['X-Line-Signature']
     
@@ -51,14 +64,15 @@ def line_webhook():
     body = request.get_data(as_text=True)
     
     # Log the request
-    logger.info("Request body: %s", body)
+    logger.debug("Request body: %s", body)
     
     # Initialize the webhook handler
     handler = get_line_webhook_handler()
     
     try:
-        # Handle the webhook
-        handler.handle(body, signature)
+        # Handle the webhook（事件在此同步處理，包含回覆 LINE 的時間）
+        with metrics.timed("webhook.request"):
+            handler.handle(body, signature)
     except InvalidSignatureError:
         logger.error("Invalid signature. Check your channel secret.")
         abort(400)
@@ -68,6 +82,12 @@ def line_webhook():
 # 預先定義處理函數，稍後再註冊到處理程序
 def handle_text_message(event):
     """Handle text messages from LINE users"""
+    # 此訊息觸發的 OpenAI 用量都歸屬到這位 LINE 用戶
+    with usage_context(line_user_id=getattr(event.source, 'user_id', None)):
+        _handle_text_message(event)
+
+def _handle_text_message(event):
+    from linebot.models import TextSendMessage
     # 設置重試機制參數
     max_db_retries = 3
     db_retry_delay = 0.5  # 初始延遲秒數
@@ -81,6 +101,7 @@ def handle_text_message(event):
         # 使用重試機制處理數據庫操作
         for db_attempt in range(max_db_retries):
             try:
+                stage_started = time.perf_counter()
                 # 獲取模型
                 _, LineUser, ChatMessage, _, _ = get_models()
                 
@@ -92,7 +113,8 @@ def handle_text_message(event):
                     
                     try:
                         # 從 LINE 獲取用戶資料
-                        profile = line_bot_api.get_profile(user_id)
+                        with metrics.timed("line.profile"):
+                            profile = line_bot_api.get_profile(user_id)
                         line_user = LineUser(
                             line_user_id=user_id,
                             display_name=profile.display_name,
@@ -119,6 +141,7 @@ def handle_text_message(event):
                 db = get_db()
                 db.session.add(chat_message)
                 db.session.commit()
+                metrics.STAGE_SECONDS.observe(time.perf_counter() - stage_started, stage="db.save_user_message")
                 break  # 成功後退出重試循環
             except Exception as db_error:
                 logger.error(f"Database error (attempt {db_attempt+1}/{max_db_retries}): {db_error}")
@@ -128,11 +151,12 @@ def handle_text_message(event):
                 
                 if db_attempt < max_db_retries - 1:
                     # 如果還有重試機會，等待後重試
-                    import time
+                    metrics.record_retry("db.save_user_message")
                     time.sleep(db_retry_delay)
                     db_retry_delay *= 2  # 指數退避
                 else:
                     # 所有數據庫重試都失敗，記錄錯誤但繼續嘗試回覆
+                    metrics.record_failure("db.save_user_message")
                     logger.error(f"All database retries failed for user {user_id}")
         
         # 檢查風格命令
@@ -190,7 +214,8 @@ def handle_text_message(event):
                 else:
                     logger.info(f"Web search requested: {search_query}")
                     # 使用網絡搜尋服務
-                    search_response = WebSearchService.answer_with_web_search(search_query)
+                    with metrics.timed("web_search.answer"), usage_context(feature="search"):
+                        search_response = get_web_search_service().answer_with_web_search(search_query)
                     if search_response:
                         response_text = search_response
                     else:
@@ -215,8 +240,9 @@ def handle_text_message(event):
                 if hasattr(line_user, 'active_style') and line_user.active_style:
                     bot_style = line_user.active_style
                 
-                # 使用 OpenAI 生成回應
-                response_text = LLMService.generate_response(user_message, bot_style, rag_context)
+                # 使用 OpenAI 生成回應（包含重試）
+                with metrics.timed("llm.generate"), usage_context(feature="rag" if rag_context else "chat"):
+                    response_text = get_llm_service().generate_response(user_message, bot_style, rag_context)
             except Exception as llm_error:
                 logger.error(f"Error generating response: {llm_error}")
                 response_text = "很抱歉，生成回應時出現問題，請稍後再試。"
@@ -233,8 +259,9 @@ def handle_text_message(event):
             )
             # 獲取數據庫會話（如果尚未獲取）
             db = get_db()
-            db.session.add(bot_message)
-            db.session.commit()
+            with metrics.timed("db.save_bot_message"):
+                db.session.add(bot_message)
+                db.session.commit()
         except Exception as db_save_error:
             logger.error(f"Error saving bot response to database: {db_save_error}")
             # 獲取數據庫會話並回滾
@@ -245,10 +272,11 @@ def handle_text_message(event):
         # 發送回應
         try:
             line_bot_api = get_line_bot_api()
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text=response_text)
-            )
+            with metrics.timed("line.reply"):
+                line_bot_api.reply_message(
+                    event.reply_token,
+                    TextSendMessage(text=response_text)
+                )
             logger.info(f"Successfully sent response to {user_id}")
         except Exception as reply_error:
             logger.error(f"Error sending response: {reply_error}")
@@ -256,6 +284,7 @@ def handle_text_message(event):
             
     except Exception as e:
         logger.error(f"Unexpected error in webhook handler: {e}")
+        metrics.record_failure("webhook.handle_message")
         # 嘗試發送錯誤訊息
         try:
             line_bot_api = get_line_bot_api()
@@ -0,0 +1,147 @@
+import io
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# 上傳總大小超過此值才使用進程池，小檔案直接在請求中解析較快
+PARALLEL_THRESHOLD_BYTES = 256 * 1024
+# 每個檔案最多擷取的字元數，避免單一大型 PDF 佔用過多記憶體
+DEFAULT_MAX_CHARS = 2_000_000
+
+TEXT_EXTENSIONS = ('txt', 'md')
+SUPPORTED_EXTENSIONS = TEXT_EXTENSIONS + ('pdf', 'docx')
+
+
+def get_extension(filename):
+    return filename.rsplit('.', 1)[1].lower() if filename and '.' in filename else ''
+
+
+def iter_pdf_blocks(data):
+    """Yield the text of each PDF page"""
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(io.BytesIO(data))
+    for page in reader.pages:
+        yield page.extract_text() or ''
+
+
+def iter_docx_blocks(data):
+    """Yield DOCX paragraphs, then table rows with cells joined by tabs"""
+    import docx
+
+    document = docx.Document(io.BytesIO(data))
+    for paragraph in document.paragraphs:
+        yield paragraph.text
+    for table in document.tables:
+        for row in table.rows:
+            yield '\t'.join(cell.text for cell in row.cells)
+
+
+def iter_text_blocks(filename, data):
+    """Yield text blocks (pages, paragraphs or the whole text file) from an upload"""
+    extension = get_extension(filename)
+    if extension == 'pdf':
+        yield from iter_pdf_blocks(data)
+    elif extension == 'docx':
+        yield from iter_docx_blocks(data)
+    else:
+        yield data.decode('utf-8', errors='replace')
+
+
+def parse_document(filename, data, max_chars=DEFAULT_MAX_CHARS):
+    """Extract text from an uploaded file's bytes, stopping after max_chars
+
+    Returns:
+        dict: {"filename", "content", "truncated", "error"}; error is None on success
+    """
+    parts = []
+    length = 0
+    truncated = False
+    try:
+        for block in iter_text_blocks(filename, data):
+            block = block.strip()
+            if not block:
+                continue
+            if length + len(block) > max_chars:
+                parts.append(block[:max_chars - length])
+                truncated = True
+                break
+            parts.append(block)
+            length += len(block) + 1
+    except Exception as e:
+        logger.error(f"Error extracting text from {filename}: {e}")
+        return {"filename": filename, "content": "", "truncated": False, "error": str(e)}
+
+    if truncated:
+        logger.warning(f"{filename} truncated to {max_chars} characters")
+    separator = '\n\n' if get_extension(filename) == 'pdf' else '\n'
+    return {"filename": filename, "content": separator.join(parts), "truncated": truncated, "error": None}
+
+
+def parse_documents(uploads, max_workers=4, max_chars=DEFAULT_MAX_CHARS):
+    """Parse several uploads, in a process pool when the batch is large enough
+
+    大型檔案在子進程中解析，解析 PDF 的暫存記憶體會隨子進程結束而釋放。子進程以 spawn 啟動：
+    在請求中 fork 會複製其他執行緒（日誌、統計、索引任務等）當時持有的鎖與資料庫連線池，可能卡死子進程。
+
+    Args:
+        uploads (list): (filename, bytes) pairs
+        max_workers (int, optional): Process pool size. Defaults to 4.
+        max_chars (int, optional): Per-file cap on extracted characters.
+
+    Returns:
+        list: parse_document() results in the same order as uploads
+    """
+    total_bytes = sum(len(data) for _, data in uploads)
+    if not uploads or total_bytes < PARALLEL_THRESHOLD_BYTES:
+        return [parse_document(filename, data, max_chars) for filename, data in uploads]
+
+    workers = max(1, min(max_workers, len(uploads)))
+    logger.info(f"Parsing {len(uploads)} uploads ({total_bytes} bytes) with {workers} processes")
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            return list(executor.map(
+                parse_document,
+                [filename for filename, _ in uploads],
+                [data for _, data in uploads],
+                [max_chars] * len(uploads)
+            ))
+    except Exception as e:
+        # 無法建立進程池時（例如受限的執行環境）退回逐一解析
+        logger.error(f"Parallel parsing failed, falling back to serial: {e}")
+        return [parse_document(filename, data, max_chars) for filename, data in uploads]
+
+
+def chunk_text(text, chunk_size=1000, overlap=150):
+    """Split text into chunks of about chunk_size characters for embedding
+
+    優先在段落或句子邊界切分，相鄰片段保留 overlap 個字元的重疊以維持上下文。
+
+    Returns:
+        list: Non-empty text chunks in document order
+    """
+    text = text.strip()
+    if len(text) <= chunk_size:
+        return [text] if text else []
+
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            window = text[start:end]
+            # 在後半段尋找最後一個段落、換行或句末標點作為切點
+            for separator in ('\n\n', '\n', '。', '！', '？', '. ', '! ', '? '):
+                cut = window.rfind(separator, chunk_size // 2)
+                if cut != -1:
+                    end = start + cut + len(separator)
+                    break
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
@@ -0,0 +1,120 @@
+import hashlib
+import unicodedata
+import numpy as np
+from collections import defaultdict
+from services.text_tokenizer import tokenize
+
+# SimHash 漢明距離不超過此值視為近似重複（64 位元）
+NEAR_DUPLICATE_DISTANCE = 6
+SIMHASH_BITS = 64
+# 詞元太少時 SimHash 不可靠（只差一個數字的短文也會被判為近似），只做完全比對
+MIN_SIMHASH_TOKENS = 24
+# 以連續 3 個詞元為特徵；只用單一詞元時，用字相近但內容不同的文件（例如同系列手冊）會被誤判為重複
+SHINGLE_SIZE = 3
+# 演算法或參數改變時遞增；flask init-db 依此重新計算已儲存的 SimHash，避免新舊指紋互相比較
+SIMHASH_VERSION = "2"
+
+
+def normalize_text(text):
+    """Normalize text so formatting-only differences hash the same"""
+    return " ".join(unicodedata.normalize("NFKC", text).lower().split())
+
+
+def content_hash(text):
+    """SHA-256 hex digest of the normalized text, for exact duplicate detection"""
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def simhash(text):
+    """64-bit SimHash over shingles of the tokenizer's CJK bigrams and words, or None for very short texts"""
+    tokens = tokenize(text)
+    if len(tokens) < MIN_SIMHASH_TOKENS:
+        return None
+    # 每種特徵只計一次，避免大量重複的段落（例如共用條款）主導整份文件的指紋
+    shingles = {" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)}
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big") for shingle in shingles],
+        dtype=np.uint64
+    )
+    # 每個特徵的 64 個位元展開成 ±1 後逐位元加總
+    bits = (hashes[:, None] >> np.arange(SIMHASH_BITS, dtype=np.uint64)) & np.uint64(1)
+    weights = (bits.astype(np.int64) * 2 - 1).sum(axis=0)
+    return sum(1 << bit for bit in range(SIMHASH_BITS) if weights[bit] > 0)
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def to_signed(value):
+    """Convert an unsigned 64-bit SimHash to the signed range of a BigInteger column"""
+    if value is None:
+        return None
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def to_unsigned(value):
+    if value is None:
+        return None
+    return value + (1 << 64) if value < 0 else value
+
+
+class SimHashIndex:
+    """Finds near-duplicate SimHashes without comparing against every stored value
+
+    將 64 位元切成 (max_distance + 1) 段；依鴿籠原理，距離不超過 max_distance 的兩個值
+    至少有一段完全相同，因此只需比對共享某一段的候選。
+    """
+
+    def __init__(self, max_distance=NEAR_DUPLICATE_DISTANCE):
+        self.max_distance = max_distance
+        self.bands = max_distance + 1
+        self.band_bits = SIMHASH_BITS // self.bands
+        self.buckets = defaultdict(list)  # (band, band value) -> [(simhash, key)]
+
+    def _band_keys(self, value):
+        mask = (1 << self.band_bits) - 1
+        return [(band, value >> (band * self.band_bits) & mask) for band in range(self.bands)]
+
+    def add(self, value, key):
+        if value is None:
+            return
+        for band_key in self._band_keys(value):
+            self.buckets[band_key].append((value, key))
+
+    def find(self, value):
+        """Return the key of a stored near-duplicate of value, or None"""
+        if value is None:
+            return None
+        for band_key in self._band_keys(value):
+            for candidate, key in self.buckets.get(band_key, ()):
+                if hamming_distance(candidate, value) <= self.max_distance:
+                    return key
+        return None
+
+
+class Deduplicator:
+    """Tracks exact (hash) and near (SimHash) duplicates among texts seen so far"""
+
+    def __init__(self, max_distance=NEAR_DUPLICATE_DISTANCE):
+        self.hashes = {}
+        self.simhashes = SimHashIndex(max_distance)
+
+    def add(self, key, digest, fingerprint):
+        """Remember a text's content_hash() and simhash() under key"""
+        self.hashes.setdefault(digest, key)
+        self.simhashes.add(fingerprint, key)
+
+    def check(self, digest, fingerprint):
+        """Return (key, is_exact) of a previously added duplicate, or (None, False)"""
+        if digest in self.hashes:
+            return self.hashes[digest], True
+        return self.simhashes.find(fingerprint), False
+
+    def check_and_add(self, text, key):
+        """Return the key of an earlier duplicate of text, otherwise remember text under key"""
+        digest, fingerprint = content_hash(text), simhash(text)
+        duplicate_of, _ = self.check(digest, fingerprint)
+        if duplicate_of is None:
+            self.add(key, digest, fingerprint)
+        return duplicate_of
@@ -0,0 +1,156 @@
+import re
+import codecs
+import logging
+from html.parser import HTMLParser
+
+logger = logging.getLogger(__name__)
+
+# 在前幾 KB 內尋找 <meta charset> 宣告
+_META_CHARSET_RE = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([a-zA-Z0-9_\-]+)', re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def detect_encoding(content_type, head):
+    """Detect the page encoding from the Content-Type header, BOM or a <meta charset> tag
+
+    Args:
+        content_type (str): The Content-Type response header (may be empty)
+        head (bytes): The first bytes of the response body
+
+    Returns:
+        str: A codec name usable with codecs.getincrementaldecoder
+    """
+    candidates = []
+    if content_type and "charset=" in content_type.lower():
+        candidates.append(content_type.lower().split("charset=", 1)[1].split(";")[0].strip(' "\''))
+    if head.startswith(codecs.BOM_UTF8):
+        candidates.append("utf-8-sig")
+    elif head.startswith(codecs.BOM_UTF16_LE) or head.startswith(codecs.BOM_UTF16_BE):
+        candidates.append("utf-16")
+    match = _META_CHARSET_RE.search(head[:4096])
+    if match:
+        candidates.append(match.group(1).decode("ascii", errors="ignore"))
+    candidates.append("utf-8")
+
+    for candidate in candidates:
+        try:
+            codecs.lookup(candidate)
+            return candidate
+        except LookupError:
+            continue
+    return "utf-8"
+
+
+class StreamingHTMLExtractor(HTMLParser):
+    """Incremental HTML-to-text extractor fed with raw response chunks
+
+    script/style 等標籤的內容會被略過；<main>/<article> 內的文字優先作為主要內容，
+    找不到時才回退為整頁文字。累積的文字有上限，達到上限後 done 會變成 True。
+    """
+
+    SKIP_TAGS = {"script", "style", "noscript", "template", "svg", "iframe"}
+    BOILERPLATE_TAGS = {"nav", "footer", "aside", "form"}
+    MAIN_TAGS = {"main", "article"}
+    VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input",
+                 "link", "meta", "param", "source", "track", "wbr"}
+
+    def __init__(self, max_chars=1500, content_type=None):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.content_type = content_type
+        self._decoder = None
+        self._skip_depth = 0
+        self._boilerplate_depth = 0
+        self._main_depth = 0
+        self._main_parts = []
+        self._main_len = 0
+        self._page_parts = []
+        self._page_len = 0
+        self.bytes_read = 0
+
+    @property
+    def done(self):
+        """True when enough main-content text has been collected"""
+        return self._main_len >= self.max_chars
+
+    def feed_bytes(self, chunk):
+        """Decode a raw chunk and feed it to the parser"""
+        if self._decoder is None:
+            encoding = detect_encoding(self.content_type, chunk)
+            self._decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        self.bytes_read += len(chunk)
+        self.feed(self._decoder.decode(chunk))
+
+    def get_text(self):
+        """Return the extracted main-content text (or whole-page text as a fallback)"""
+        if self._decoder is not None:
+            self.feed(self._decoder.decode(b"", final=True))
+        self.close()
+        parts = self._main_parts if self._main_len else self._page_parts
+        text = " ".join(parts).strip()
+        if len(text) > self.max_chars:
+            text = text[:self.max_chars] + "..."
+        return text
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.VOID_TAGS:
+            return
+        if tag in self.SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in self.BOILERPLATE_TAGS:
+            self._boilerplate_depth += 1
+        elif tag in self.MAIN_TAGS:
+            self._main_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in self.BOILERPLATE_TAGS:
+            self._boilerplate_depth = max(0, self._boilerplate_depth - 1)
+        elif tag in self.MAIN_TAGS:
+            self._main_depth = max(0, self._main_depth - 1)
+
+    def handle_data(self, data):
+        if self._skip_depth or self._boilerplate_depth:
+            return
+        text = _WHITESPACE_RE.sub(" ", data).strip()
+        if not text:
+            return
+        if self._main_depth and self._main_len < self.max_chars:
+            self._main_parts.append(text)
+            self._main_len += len(text) + 1
+        # 整頁文字只保留到上限為止，控制記憶體用量
+        if self._page_len < self.max_chars:
+            self._page_parts.append(text)
+            self._page_len += len(text) + 1
+
+
+def extract_text_from_response(response, max_bytes=200 * 1024, max_chars=1500, chunk_size=8192):
+    """Stream a requests response through the extractor, reading at most max_bytes
+
+    Args:
+        response: A requests.Response opened with stream=True
+        max_bytes (int, optional): Byte budget for the body. Defaults to 200 KB.
+        max_chars (int, optional): Maximum characters of text to return. Defaults to 1500.
+        chunk_size (int, optional): Read size for iter_content. Defaults to 8 KB.
+
+    Returns:
+        str: The extracted text, or None if the response is not HTML/text
+    """
+    content_type = response.headers.get("Content-Type", "")
+    if content_type and not any(t in content_type.lower() for t in ("html", "text", "xml")):
+        logger.info(f"Skipping non-HTML content ({content_type}) from {response.url}")
+        response.close()
+        return None
+
+    extractor = StreamingHTMLExtractor(max_chars=max_chars, content_type=content_type)
+    try:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            if not chunk:
+                continue
+            extractor.feed_bytes(chunk[:max_bytes - extractor.bytes_read])
+            if extractor.done or extractor.bytes_read >= max_bytes:
+                break
+    finally:
+        response.close()
+    return extractor.get_text()
@@ -0,0 +1,305 @@
+import os
+import json
+import time
+import shutil
+import logging
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+# 背景建立索引時的檢查點目錄
+JOBS_DIR = "knowledge_base/jobs"
+
+
+def get_job_model():
+    """延遲導入模型以避免循環引用"""
+    from app import IndexJob
+    return IndexJob
+
+
+def get_db():
+    from app import db
+    return db
+
+
+class IndexJobRunner:
+    """Runs knowledge base index builds on a background thread
+
+    任務記錄在 index_job 資料表中，因此可在重新啟動後繼續執行；
+    每個進程最多一個背景執行緒，透過條件式 UPDATE 領取任務，避免多個 worker 重複執行。
+    """
+
+    # 執行中任務超過此時間未更新，視為原本的 worker 已終止，可被重新領取
+    STALE_AFTER = timedelta(minutes=5)
+    # 執行中任務由獨立的執行緒定期更新 updated_at，單次 Embedding 請求或 FAISS 建立耗時再久也不會被視為逾時
+    HEARTBEAT_INTERVAL = 30
+    POLL_INTERVAL = 5
+
+    _thread = None
+    _app = None
+    _wakeup = threading.Event()
+    _lock = threading.Lock()
+
+    @staticmethod
+    def ensure_worker(app):
+        """Start the background worker thread for this process if it isn't running
+
+        不在無伺服器環境啟動（見 is_index_job_inline()）；任務改由 enqueue() 在請求中直接執行。
+        """
+        from config import is_index_job_inline
+        if is_index_job_inline():
+            return
+        with IndexJobRunner._lock:
+            if IndexJobRunner._thread is not None and IndexJobRunner._thread.is_alive():
+                return
+            IndexJobRunner._app = app
+            IndexJobRunner._thread = threading.Thread(
+                target=IndexJobRunner._run_forever,
+                name="index-job-worker",
+                daemon=True
+            )
+            IndexJobRunner._thread.start()
+            logger.info("Started background index job worker")
+
+    @staticmethod
+    def enqueue(app, kind="rebuild", payload=None):
+        """Queue an index build and return the job
+
+        已有等待中的相同類型任務時直接沿用，避免連續上傳時重複重建。
+        """
+        IndexJob = get_job_model()
+        db = get_db()
+
+        # 等待中的完整重建會涵蓋所有文件，不需再排入增量更新
+        if kind == "incremental":
+            job = IndexJob.query.filter_by(status="pending", kind="rebuild").first()
+            if job is not None:
+                IndexJobRunner._dispatch(app)
+                return job
+
+        job = IndexJob.query.filter_by(status="pending", kind=kind).first()
+        if job is None:
+            job = IndexJob(kind=kind, status="pending", payload=json.dumps(payload) if payload else None)
+            db.session.add(job)
+        elif payload:
+            merged = json.loads(job.payload) if job.payload else {}
+            for key, value in payload.items():
+                if isinstance(value, list):
+                    merged[key] = sorted(set(merged.get(key, [])) | set(value))
+                else:
+                    merged[key] = value
+            job.payload = json.dumps(merged)
+        db.session.commit()
+
+        IndexJobRunner._dispatch(app)
+        return job
+
+    @staticmethod
+    def _dispatch(app):
+        """Wake the background worker, or run queued jobs now when there is no persistent worker"""
+        from config import is_index_job_inline
+        if is_index_job_inline():
+            while IndexJobRunner._run_next():
+                pass
+            return
+        IndexJobRunner.ensure_worker(app)
+        IndexJobRunner._wakeup.set()
+
+    @staticmethod
+    def cancel(job_id):
+        """Request cancellation of a job; pending jobs are cancelled immediately"""
+        IndexJob = get_job_model()
+        db = get_db()
+
+        job = IndexJob.query.get(job_id)
+        if job is None or job.status not in ("pending", "running"):
+            return False
+        job.cancel_requested = True
+        if job.status == "pending":
+            job.status = "cancelled"
+            job.finished_at = datetime.utcnow()
+        db.session.commit()
+        return True
+
+    @staticmethod
+    def to_dict(job):
+        """Serialize a job with progress percentage and ETA for the admin page"""
+        percent = round(job.processed * 100.0 / job.total, 1) if job.total else 0.0
+        eta_seconds = None
+        if job.status == "running" and job.started_at and job.total:
+            done_this_run = job.processed - (job.resumed_from or 0)
+            elapsed = (datetime.utcnow() - job.started_at).total_seconds()
+            if done_this_run > 0 and elapsed > 0:
+                eta_seconds = int(elapsed / done_this_run * (job.total - job.processed))
+        return {
+            "id": job.id,
+            "kind": job.kind,
+            "status": job.status,
+            "total": job.total,
+            "processed": job.processed,
+            "percent": percent,
+            "eta_seconds": eta_seconds,
+            "message": job.message,
+            "created_at": job.created_at.strftime('%Y-%m-%d %H:%M:%S') if job.created_at else None,
+            "finished_at": job.finished_at.strftime('%Y-%m-%d %H:%M:%S') if job.finished_at else None
+        }
+
+    @staticmethod
+    def _run_forever():
+        while True:
+            try:
+                with IndexJobRunner._app.app_context():
+                    while IndexJobRunner._run_next():
+                        pass
+            except Exception as e:
+                logger.error(f"Index job worker error: {e}")
+            IndexJobRunner._wakeup.wait(IndexJobRunner.POLL_INTERVAL)
+            IndexJobRunner._wakeup.clear()
+
+    @staticmethod
+    def _claim_next():
+        """Atomically claim the oldest pending (or stale running) job"""
+        IndexJob = get_job_model()
+        db = get_db()
+        now = datetime.utcnow()
+
+        # 同一時間只執行一個建立索引任務
+        running = IndexJob.query.filter(
+            IndexJob.status == "running",
+            IndexJob.updated_at >= now - IndexJobRunner.STALE_AFTER
+        ).first()
+        if running:
+            return None
+
+        candidates = IndexJob.query.filter(
+            (IndexJob.status == "pending") |
+            ((IndexJob.status == "running") & (IndexJob.updated_at < now - IndexJobRunner.STALE_AFTER))
+        ).order_by(IndexJob.created_at.asc()).all()
+
+        for job in candidates:
+            claimed = IndexJob.query.filter(
+                IndexJob.id == job.id,
+                IndexJob.status == job.status,
+                IndexJob.updated_at == job.updated_at
+            ).update({
+                "status": "running",
+                "started_at": now,
+                "updated_at": now,
+                "resumed_from": job.processed or 0
+            }, synchronize_session=False)
+            db.session.commit()
+            if claimed:
+                db.session.refresh(job)
+                return job
+        return None
+
+    @staticmethod
+    def _run_next():
+        """Run one job; returns False when there was nothing to do"""
+        from rag_service import RAGService, IndexBuildCancelled
+
+        job = IndexJobRunner._claim_next()
+        if job is None:
+            return False
+
+        IndexJob = get_job_model()
+        db = get_db()
+        job_id = job.id
+        # 領取時寫入的 started_at 作為租約：任務被其他 worker 重新領取後即不相符，所有更新都以此為條件
+        lease = job.started_at
+        incremental = job.kind == "incremental"
+        work_dir = os.path.join(JOBS_DIR, str(job_id))
+        logger.info(f"Running index job {job_id} ({job.kind})")
+
+        def owned():
+            return IndexJob.query.filter(
+                IndexJob.id == job_id, IndexJob.status == "running", IndexJob.started_at == lease
+            )
+
+        lease_lost = threading.Event()
+        stop_heartbeat = threading.Event()
+        heartbeat = threading.Thread(
+            target=IndexJobRunner._heartbeat,
+            args=(current_app._get_current_object(), job_id, lease, stop_heartbeat, lease_lost),
+            name=f"index-job-heartbeat-{job_id}",
+            daemon=True
+        )
+        heartbeat.start()
+
+        def progress_callback(processed, total):
+            updated = owned().update({
+                "processed": processed,
+                "total": total,
+                "updated_at": datetime.utcnow()
+            }, synchronize_session=False)
+            db.session.commit()
+            if not updated:
+                lease_lost.set()
+
+        def should_cancel():
+            if lease_lost.is_set():
+                return True
+            return bool(db.session.query(IndexJob.cancel_requested).filter_by(id=job_id).scalar())
+
+        started = time.time()
+        try:
+            success = RAGService.update_index(
+                progress_callback=progress_callback,
+                should_cancel=should_cancel,
+                work_dir=work_dir,
+                incremental=incremental
+            )
+            status = "completed" if success else "failed"
+            message = f"完成，耗時 {time.time() - started:.1f} 秒" if success else "建立索引失敗，請查看系統日誌"
+        except IndexBuildCancelled:
+            status, message = "cancelled", "已取消"
+        except Exception as e:
+            logger.error(f"Index job {job_id} failed: {e}")
+            db.session.rollback()
+            status, message = "failed", str(e)
+        finally:
+            stop_heartbeat.set()
+            heartbeat.join()
+
+        if lease_lost.is_set():
+            # 任務已由其他 worker 接手：不發佈、不清除其檢查點，也不覆寫其狀態
+            logger.warning(f"Index job {job_id} was taken over by another worker, stopped without publishing")
+            return True
+
+        if status != "completed":
+            # 取消或失敗的任務不會再被恢復，清除檢查點
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        owned().update({
+            "status": status,
+            "message": message,
+            "updated_at": datetime.utcnow(),
+            "finished_at": datetime.utcnow()
+        }, synchronize_session=False)
+        db.session.commit()
+        logger.info(f"Index job {job_id} {status}")
+        return True
+
+    @staticmethod
+    def _heartbeat(app, job_id, lease, stop, lease_lost):
+        """Refresh updated_at of a running job until stop is set; sets lease_lost if the job was reclaimed"""
+        IndexJob = get_job_model()
+        while not stop.wait(IndexJobRunner.HEARTBEAT_INTERVAL):
+            try:
+                with app.app_context():
+                    # 使用獨立連線，不影響建立索引所用的 session
+                    with get_db().engine.begin() as connection:
+                        result = connection.execute(
+                            IndexJob.__table__.update().where(
+                                IndexJob.id == job_id,
+                                IndexJob.status == "running",
+                                IndexJob.started_at == lease
+                            ).values(updated_at=datetime.utcnow())
+                        )
+                if result.rowcount == 0:
+                    lease_lost.set()
+                    return
+            except Exception as e:
+                logger.warning(f"Index job {job_id} heartbeat failed: {e}")
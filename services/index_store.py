@@ -0,0 +1,116 @@
+import os
+import time
+import shutil
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# 知識庫索引世代的位置；RAGService 與只需讀取目前世代的頁面共用
+KNOWLEDGE_BASE_DIR = "knowledge_base"
+
+
+def fsync_dir(path):
+    """fsync a directory so renames inside it survive a crash (no-op where unsupported)"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class IndexStore:
+    """Versioned on-disk index generations published through an atomic pointer file
+
+    每次建立索引都寫入新的 generations/<id> 目錄，完整寫入並 fsync 後才以 os.replace
+    更新 CURRENT 指標；讀取端只會看到完整的世代，舊世代保留數個後才清除，
+    讓其他 worker 在切換期間仍可讀取原本釘選的世代。
+    """
+
+    POINTER_NAME = "CURRENT"
+    STAGING_SUFFIX = ".tmp"
+    # 超過此時間的暫存目錄視為中斷的建立過程留下的殘骸
+    STALE_STAGING_SECONDS = 6 * 3600
+
+    def __init__(self, base_dir="knowledge_base", keep=3):
+        self.base_dir = base_dir
+        self.generations_dir = os.path.join(base_dir, "generations")
+        self.pointer_path = os.path.join(base_dir, self.POINTER_NAME)
+        self.keep = keep
+
+    def current(self):
+        """Return the name of the published generation, or None if nothing is published"""
+        try:
+            with open(self.pointer_path, encoding="utf-8") as f:
+                generation = f.read().strip()
+        except OSError:
+            return None
+        return generation or None
+
+    def path(self, generation):
+        return os.path.join(self.generations_dir, generation)
+
+    def begin(self):
+        """Create an empty staging directory for a new generation and return (generation, path)"""
+        os.makedirs(self.generations_dir, exist_ok=True)
+        generation = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}-{os.getpid()}"
+        staging = self.path(generation) + self.STAGING_SUFFIX
+        os.makedirs(staging)
+        return generation, staging
+
+    def publish(self, generation, staging):
+        """fsync the staged files, move them into place and atomically switch CURRENT to them"""
+        for name in os.listdir(staging):
+            with open(os.path.join(staging, name), "rb") as f:
+                os.fsync(f.fileno())
+        fsync_dir(staging)
+
+        final_path = self.path(generation)
+        os.rename(staging, final_path)
+        fsync_dir(self.generations_dir)
+
+        tmp_pointer = f"{self.pointer_path}.{os.getpid()}{self.STAGING_SUFFIX}"
+        with open(tmp_pointer, "w", encoding="utf-8") as f:
+            f.write(generation)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_pointer, self.pointer_path)
+        fsync_dir(self.base_dir)
+
+        logger.info(f"Published index generation {generation}")
+        self.collect_garbage()
+        return final_path
+
+    def abort(self, staging):
+        """Discard a staging directory that will not be published"""
+        shutil.rmtree(staging, ignore_errors=True)
+
+    def collect_garbage(self):
+        """Remove all but the newest `keep` generations (never the current one) and stale staging dirs"""
+        try:
+            names = sorted(os.listdir(self.generations_dir))
+        except OSError:
+            return
+        current = self.current()
+        generations = [name for name in names if not name.endswith(self.STAGING_SUFFIX)]
+
+        for name in names:
+            if not name.endswith(self.STAGING_SUFFIX):
+                continue
+            staging = os.path.join(self.generations_dir, name)
+            try:
+                if time.time() - os.path.getmtime(staging) > self.STALE_STAGING_SECONDS:
+                    shutil.rmtree(staging, ignore_errors=True)
+            except OSError:
+                pass
+
+        for name in generations[:-self.keep] if self.keep else generations:
+            if name == current:
+                continue
+            shutil.rmtree(self.path(name), ignore_errors=True)
+            logger.info(f"Removed old index generation {name}")
@@ -0,0 +1,113 @@
+import math
+import pickle
+import logging
+from collections import Counter, defaultdict
+from services.text_tokenizer import tokenize
+
+logger = logging.getLogger(__name__)
+
+
+class KeywordIndex:
+    """In-memory BM25 inverted index over CJK-bigram / word tokens
+
+    用於補足向量搜尋在產品名稱、電話號碼與精確中文詞彙上的不足，
+    也可在無法呼叫 Embedding API 時單獨使用。
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)  # token -> {entry_id: term frequency}
+        self.doc_lengths = {}  # entry_id -> token count
+        self.entries = {}  # entry_id -> metadata
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def add(self, entry_id, text, metadata=None):
+        """Index text under entry_id, replacing any previous text for that id"""
+        if entry_id in self.doc_lengths:
+            self.remove(entry_id)
+        tokens = tokenize(text)
+        for token, tf in Counter(tokens).items():
+            self.postings[token][entry_id] = tf
+        self.doc_lengths[entry_id] = max(len(tokens), 1)
+        self._total_length += self.doc_lengths[entry_id]
+        if metadata is not None:
+            self.entries[entry_id] = metadata
+
+    def remove(self, entry_id):
+        """Remove an entry from the index"""
+        if entry_id not in self.doc_lengths:
+            return
+        for token in list(self.postings):
+            postings = self.postings[token]
+            if postings.pop(entry_id, None) is not None and not postings:
+                del self.postings[token]
+        self._total_length -= self.doc_lengths.pop(entry_id)
+        self.entries.pop(entry_id, None)
+
+    def search(self, query, top_k=10):
+        """Return up to top_k (entry_id, score) pairs ranked by BM25"""
+        query_tokens = set(tokenize(query))
+        total_docs = len(self.doc_lengths)
+        if not query_tokens or not total_docs:
+            return []
+
+        avg_length = self._total_length / total_docs
+        scores = defaultdict(float)
+        for token in query_tokens:
+            postings = self.postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for entry_id, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[entry_id] / avg_length)
+                scores[entry_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+    def save(self, path):
+        """Pickle the index to path"""
+        with open(path, 'wb') as f:
+            pickle.dump({
+                "k1": self.k1,
+                "b": self.b,
+                "postings": dict(self.postings),
+                "doc_lengths": self.doc_lengths,
+                "entries": self.entries
+            }, f)
+
+    @staticmethod
+    def load(path):
+        """Load an index previously written with save()"""
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+        index = KeywordIndex(k1=data["k1"], b=data["b"])
+        index.postings = defaultdict(dict, data["postings"])
+        index.doc_lengths = data["doc_lengths"]
+        index.entries = data["entries"]
+        index._total_length = sum(index.doc_lengths.values())
+        return index
+
+
+def reciprocal_rank_fusion(rankings, k=60, top_k=None, with_scores=False):
+    """Fuse several ranked lists of keys with reciprocal rank fusion
+
+    Args:
+        rankings (list): Ranked lists of hashable keys, best first
+        k (int, optional): RRF damping constant. Defaults to 60.
+        top_k (int, optional): Number of fused keys to return. Defaults to all.
+        with_scores (bool, optional): Return (key, score) pairs instead of keys.
+
+    Returns:
+        list: Keys (or (key, score) pairs) ordered by fused score
+    """
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            scores[key] += 1.0 / (k + rank + 1)
+    fused = sorted(scores, key=lambda key: scores[key], reverse=True)
+    fused = fused[:top_k] if top_k else fused
+    return [(key, scores[key]) for key in fused] if with_scores else fused
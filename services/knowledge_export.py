@@ -0,0 +1,106 @@
+import json
+import zipfile
+from services.message_export import encode_chunks
+
+KB_EXPORT_FORMATS = ("markdown", "jsonl", "zip")
+BATCH_SIZE = 10  # 文件可能很大，每批只讀取少量文件
+
+
+def iter_documents(session, Document, batch_size=BATCH_SIZE):
+    """Yield documents one at a time in id order, loading a few per query
+
+    與訊息匯出相同，以 id 做 keyset 分頁並在各批之間結束交易，下載速度慢時不會長時間
+    持有讀取交易；每批的文件在傳送後即可被回收，記憶體用量與知識庫大小無關。
+    """
+    last_id = 0
+    while True:
+        batch = session.query(Document).filter(Document.id > last_id).order_by(Document.id.asc()).limit(batch_size).all()
+        if not batch:
+            return
+        for doc in batch:
+            yield doc
+        last_id = batch[-1].id
+        session.commit()
+        session.expunge_all()
+
+
+def _doc_dict(doc):
+    return {
+        'id': doc.id,
+        'title': doc.title,
+        'filename': doc.filename,
+        'uploaded_at': doc.uploaded_at.strftime('%Y-%m-%d %H:%M:%S') if doc.uploaded_at else None,
+        'is_active': doc.is_active,
+        'content': doc.content
+    }
+
+
+def markdown_chunks(documents):
+    """Encode documents as one Markdown file, one chunk per document"""
+    yield "# FlyPig 知識庫匯出\n\n"
+    for i, doc in enumerate(documents, 1):
+        header = f"## {i}. {doc.title}\n"
+        if doc.filename:
+            header += f"來源: {doc.filename}\n"
+        if doc.uploaded_at:
+            header += f"上傳時間: {doc.uploaded_at.strftime('%Y-%m-%d %H:%M:%S')}\n"
+        yield f"{header}\n{doc.content}\n\n---\n\n"
+
+
+def jsonl_chunks(documents):
+    """Encode documents as JSON lines, one chunk per document"""
+    for doc in documents:
+        yield json.dumps(_doc_dict(doc), ensure_ascii=False) + "\n"
+
+
+class _StreamBuffer:
+    """Write-only file object for zipfile that hands written bytes back to a generator
+
+    沒有 seek()，zipfile 會改用資料描述區 (data descriptor) 的串流格式寫入。
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def zip_chunks(documents):
+    """Encode documents as a zip archive with one Markdown file per document and a manifest.jsonl"""
+    buffer = _StreamBuffer()
+    manifest = []
+    with zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for doc in documents:
+            name = f"documents/{doc.id:05d}.md"
+            archive.writestr(name, f"# {doc.title}\n\n{doc.content}")
+            metadata = _doc_dict(doc)
+            del metadata['content']
+            metadata['path'] = name
+            manifest.append(json.dumps(metadata, ensure_ascii=False))
+            yield buffer.drain()
+        archive.writestr("manifest.jsonl", "\n".join(manifest) + "\n")
+    yield buffer.drain()
+
+
+def export_stream(export_format, documents):
+    """Return (byte chunk generator, content type, filename) for a knowledge base export format"""
+    if export_format == 'zip':
+        return zip_chunks(documents), 'application/zip', 'flypig_knowledge_base_export.zip'
+    if export_format == 'jsonl':
+        return encode_chunks(jsonl_chunks(documents)), 'application/x-ndjson', 'flypig_knowledge_base_export.jsonl'
+    return encode_chunks(markdown_chunks(documents)), 'text/markdown; charset=utf-8', 'flypig_knowledge_base_export.md'
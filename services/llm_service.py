@@ -1,9 +1,11 @@
 import os
 import json
+import time
 import logging
-from openai import OpenAI
 from datetime import datetime, timezone, timedelta
-from routes.utils.config_service import ConfigManager, get_openai_api_key, get_llm_settings
+from routes.utils.config_service import ConfigManager, get_openai_api_key, get_openai_base_url, get_llm_settings
+from services import metrics
+from services.usage_tracker import UsageTracker
 
 logger = logging.getLogger(__name__)
 
@@ -18,7 +20,9 @@ class LLMService:
             logger.error("OpenAI API key not configured")
             return None
         
-        return OpenAI(api_key=api_key)
+        # openai 套件載入需時較久，第一次呼叫時才導入
+        from openai import OpenAI
+        return OpenAI(api_key=api_key, base_url=get_openai_base_url())
     
     @staticmethod
     def get_bot_style(style_name=None):
@@ -86,9 +90,11 @@ class LLMService:
                 if system_prompt:
                     # 使用提供的自定義系統提示
                     prompt_content = f"{system_prompt} 真實即時日期是 {current_date}。"
+                    used_style = None
                 else:
                     # 獲取機器人風格
                     style = LLMService.get_bot_style(style_name)
+                    used_style = style.name
                     prompt_content = f"{style.prompt} 真實即時日期是 {current_date}。"
                 
                 # 構建訊息
@@ -109,13 +115,18 @@ class LLMService:
                 # 設置 timeout 為 30 秒
                 # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
                 # do not change this unless explicitly requested by the user
-                response = client.chat.completions.create(
-                    model="gpt-4o",
-                    messages=messages,
-                    temperature=settings["temperature"],
-                    max_tokens=settings["max_tokens"],
-                    timeout=30.0
-                )
+                request_started = time.perf_counter()
+                with metrics.timed("llm.chat"):
+                    response = client.chat.completions.create(
+                        model="gpt-4o",
+                        messages=messages,
+                        temperature=settings["temperature"],
+                        max_tokens=settings["max_tokens"],
+                        timeout=30.0
+                    )
+                metrics.record_tokens("gpt-4o", response.usage)
+                UsageTracker.record_response("gpt-4o", response, time.perf_counter() - request_started,
+                                             bot_style=used_style)
                 
                 # 成功接收回應
                 return response.choices[0].message.content
@@ -125,11 +136,12 @@ class LLMService:
                 
                 if attempt < max_retries - 1:
                     # 如果還有重試機會，等待後重試
-                    import time
+                    metrics.record_retry("llm.chat")
                     time.sleep(retry_delay)
                     retry_delay *= 2  # 指數退避
                 else:
                     # 所有重試都失敗
+                    metrics.record_failure("llm.generate")
                     return f"抱歉，生成回應時發生錯誤，已嘗試 {max_retries} 次：{str(e)}"
     
     @staticmethod
@@ -139,6 +151,7 @@ class LLMService:
             if not api_key:
                 return False
                 
+            from openai import OpenAI
             client = OpenAI(api_key=api_key)
             # Make a small request to validate the key
             response = client.chat.completions.create(
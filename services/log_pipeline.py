@@ -0,0 +1,252 @@
+import os
+import sys
+import time
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from sqlalchemy.exc import SQLAlchemyError
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+def get_db():
+    from app import db
+    return db
+
+
+def get_log_model():
+    """延遲導入模型以避免循環引用"""
+    from app import LogEntry
+    return LogEntry
+
+
+class SamplingFilter(logging.Filter):
+    """Samples high-volume INFO/DEBUG records per call site
+
+    每個呼叫位置（檔案、行號）在每個時間窗內先全部記錄 burst 筆，之後每 every 筆只記錄一筆並標註取樣；
+    WARNING 以上不取樣。以呼叫位置而非訊息內容分組，f-string 產生的不同訊息也會歸在同一組。
+    """
+
+    def __init__(self, burst, every, window):
+        super().__init__()
+        self.burst = burst
+        self.every = every
+        self.window = window
+        self._counts = {}  # (pathname, lineno) -> [window start, count]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.every <= 1:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            counter = self._counts.get(key)
+            if counter is None or now - counter[0] >= self.window:
+                counter = self._counts[key] = [now, 0]
+            counter[1] += 1
+            count = counter[1]
+        if count <= self.burst:
+            return True
+        if (count - self.burst) % self.every:
+            metrics.LOG_RECORDS_DROPPED.inc(reason="sampled")
+            return False
+        record.msg = f"{record.getMessage()} (sampled 1/{self.every})"
+        record.args = None
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that never blocks the caller; records are dropped (and counted) when the queue is full"""
+
+    def prepare(self, record):
+        # 同一進程內的佇列不需序列化：只先組出訊息字串，traceback 留給背景執行緒格式化
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.LOG_RECORDS_DROPPED.inc(reason="queue_full")
+
+
+class LogEntrySink(logging.Handler):
+    """Buffers log records and writes them to log_entry in bulk
+
+    由 QueueListener 執行緒呼叫 emit()，只放入記憶體緩衝區；背景執行緒每 FLUSH_INTERVAL 秒或累積
+    BATCH_SIZE 筆時以單一 INSERT 寫入。資料庫無法寫入時保留在緩衝區，超過 MAX_PENDING 筆時捨棄新的記錄。
+    """
+
+    FLUSH_INTERVAL = 5  # 秒
+    BATCH_SIZE = 100
+    MAX_PENDING = 5000
+
+    def __init__(self, level=logging.ERROR):
+        super().__init__(level)
+        self.app = None
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._formatter = logging.Formatter()
+
+    def emit(self, record):
+        # 寫入失敗時本模組的警告不再寫回資料庫，避免循環
+        if record.name == __name__ or record.name.startswith("sqlalchemy"):
+            return
+        message = record.getMessage()
+        if record.exc_info:
+            message = f"{message}\n{record.exc_text or self._formatter.formatException(record.exc_info)}"
+        row = {
+            "level": record.levelname[:10],
+            "message": message,
+            "module": str(getattr(record, "log_module", None) or record.name)[:64],
+            "timestamp": datetime.utcfromtimestamp(record.created)
+        }
+        with self._pending_lock:
+            if len(self._pending) >= self.MAX_PENDING:
+                metrics.LOG_RECORDS_DROPPED.inc(reason="db_buffer_full")
+                return
+            self._pending.append(row)
+            full = len(self._pending) >= self.BATCH_SIZE
+        if full:
+            self._wakeup.set()
+
+    def start(self, app):
+        """Start writing buffered records to the database of this app"""
+        self.app = app
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run_forever, name="log-flush-worker", daemon=True)
+        self._thread.start()
+
+    def _run_forever(self):
+        while True:
+            self._wakeup.wait(self.FLUSH_INTERVAL)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Write the buffered records to log_entry; returns the number of rows written"""
+        if self.app is None:
+            return 0
+        with self._flush_lock:
+            with self._pending_lock:
+                rows = self._pending
+                self._pending = []
+            if not rows:
+                return 0
+            try:
+                with self.app.app_context():
+                    with get_db().engine.begin() as connection:
+                        connection.execute(get_log_model().__table__.insert(), rows)
+            except SQLAlchemyError as e:
+                logger.warning(f"Error writing {len(rows)} log entries, will retry: {e}")
+                with self._pending_lock:
+                    self._pending = (rows + self._pending)[:self.MAX_PENDING]
+                return 0
+            return len(rows)
+
+
+class LogPipeline:
+    """Queue-based logging: callers only enqueue records, a listener thread writes them out
+
+    根 logger 只掛 NonBlockingQueueHandler（含取樣過濾），輸出到 console 與寫入 log_entry 都在
+    QueueListener 的背景執行緒進行，請求不需等待 I/O。
+    """
+
+    _queue = None
+    _handler = None
+    _listener = None
+    _sink = None
+
+    @staticmethod
+    def configure():
+        """Replace logging.basicConfig(): set levels and route the root logger through the queue"""
+        if LogPipeline._handler is not None:
+            return
+        from routes.utils.config_service import get_logging_settings
+        settings = get_logging_settings()
+        root = logging.getLogger()
+
+        handlers = []
+        root.setLevel(settings["level"])
+        # 與 logging.basicConfig() 相同：根 logger 已有 handler（例如 gunicorn 或工具程式自行設定）時不再加上 console 輸出
+        if not root.handlers:
+            console = logging.StreamHandler()
+            console.setFormatter(logging.Formatter(LOG_FORMAT))
+            handlers.append(console)
+        for name, level in settings["module_levels"].items():
+            logging.getLogger(name).setLevel(level)
+
+        LogPipeline._sink = LogEntrySink(settings["db_level"])
+        handlers.append(LogPipeline._sink)
+
+        LogPipeline._queue = queue.Queue(settings["queue_size"])
+        LogPipeline._handler = NonBlockingQueueHandler(LogPipeline._queue)
+        LogPipeline._handler.addFilter(SamplingFilter(
+            settings["sample_burst"], settings["sample_every"], settings["sample_window"]
+        ))
+        LogPipeline._listener = QueueListener(LogPipeline._queue, *handlers, respect_handler_level=True)
+        LogPipeline._listener.start()
+        root.addHandler(LogPipeline._handler)
+
+        atexit.register(LogPipeline.stop)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=LogPipeline._after_fork)
+
+    @staticmethod
+    def attach_database(app):
+        """Start persisting records at or above LOG_DB_LEVEL to log_entry"""
+        if LogPipeline._sink is not None:
+            LogPipeline._sink.start(app)
+
+    @staticmethod
+    def stop():
+        """Write out everything still queued or buffered; called at exit"""
+        if LogPipeline._listener is None:
+            return
+        try:
+            LogPipeline._listener.stop()
+        except Exception:
+            pass
+        LogPipeline._listener = None
+        try:
+            LogPipeline._sink.flush()
+        except Exception as e:
+            sys.stderr.write(f"Error writing log entries at exit: {e}\n")
+
+    @staticmethod
+    def _after_fork():
+        # fork 後子進程沒有父進程的執行緒，重新建立佇列與 console 輸出的執行緒。寫入 log_entry 的執行緒
+        # 不在此啟動：所有 fork（包括短暫的子進程）都會執行此函式，只有實際處理請求的 worker
+        # 會在第一個請求時呼叫 attach_database() 重新啟動（例如 gunicorn --preload）
+        if LogPipeline._handler is None or LogPipeline._listener is None:
+            return
+        LogPipeline._queue = queue.Queue(LogPipeline._queue.maxsize)
+        LogPipeline._handler.queue = LogPipeline._queue
+        LogPipeline._listener = QueueListener(
+            LogPipeline._queue, *LogPipeline._listener.handlers, respect_handler_level=True
+        )
+        LogPipeline._listener.start()
+        sink = LogPipeline._sink
+        sink._pending_lock = threading.Lock()
+        sink._flush_lock = threading.Lock()
+        sink._pending = []
+        sink._thread = None
+        if sink.app is not None:
+            # 不沿用父進程連線池中的連線（與父進程共用同一個 socket）；close=False 不影響父進程的連線
+            try:
+                with sink.app.app_context():
+                    get_db().engine.dispose(close=False)
+            except Exception as e:
+                sys.stderr.write(f"Error resetting the database pool after fork: {e}\n")
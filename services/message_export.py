@@ -0,0 +1,139 @@
+import io
+import csv
+import json
+import zlib
+from datetime import datetime, timedelta
+
+EXPORT_FORMATS = ("csv", "json", "jsonl")
+CSV_HEADER = ['ID', 'LINE用戶ID', '訊息類型', '訊息內容', '機器人風格', '時間戳記']
+BATCH_SIZE = 1000
+
+
+def parse_date_range(start_date=None, end_date=None):
+    """Parse YYYY-MM-DD strings into a [start, end) datetime range; the end date is inclusive
+
+    Raises:
+        ValueError: If a date is malformed or the range is reversed
+    """
+    start = datetime.strptime(start_date, '%Y-%m-%d') if start_date else None
+    end = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1) if end_date else None
+    if start and end and start >= end:
+        raise ValueError("start date is after end date")
+    return start, end
+
+
+def iter_message_batches(session, ChatMessage, user_id=None, start=None, end=None, batch_size=BATCH_SIZE):
+    """Yield lists of message rows in id order, one bounded query per batch
+
+    以 id 做 keyset 分頁（WHERE id > 上一批最後一筆），只查詢需要的欄位，
+    不建立 ORM 物件也不依賴伺服器端游標，記憶體用量與歷史資料量無關，且各批之間不佔用連線。
+    """
+    columns = (
+        ChatMessage.id,
+        ChatMessage.line_user_id,
+        ChatMessage.is_user_message,
+        ChatMessage.message_text,
+        ChatMessage.bot_style,
+        ChatMessage.timestamp
+    )
+    query = session.query(*columns)
+    if user_id:
+        query = query.filter(ChatMessage.line_user_id == user_id)
+    if start:
+        query = query.filter(ChatMessage.timestamp >= start)
+    if end:
+        query = query.filter(ChatMessage.timestamp < end)
+
+    last_id = 0
+    while True:
+        batch = query.filter(ChatMessage.id > last_id).order_by(ChatMessage.id.asc()).limit(batch_size).all()
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1].id
+        # 結束目前的交易，長時間匯出時不持有讀取鎖或舊快照
+        session.commit()
+
+
+def _format_timestamp(timestamp):
+    return timestamp.strftime('%Y-%m-%d %H:%M:%S') if timestamp else ''
+
+
+def _row_dict(row):
+    return {
+        'id': row.id,
+        'line_user_id': row.line_user_id,
+        'is_user_message': row.is_user_message,
+        'message_text': row.message_text,
+        'bot_style': row.bot_style,
+        'timestamp': _format_timestamp(row.timestamp)
+    }
+
+
+def csv_chunks(batches):
+    """Encode batches of rows as CSV text, one chunk per batch"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_HEADER)
+    for batch in batches:
+        for row in batch:
+            writer.writerow([
+                row.id,
+                row.line_user_id,
+                '用戶' if row.is_user_message else '機器人',
+                row.message_text,
+                row.bot_style or '',
+                _format_timestamp(row.timestamp)
+            ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def jsonl_chunks(batches):
+    """Encode batches of rows as JSON lines, one chunk per batch"""
+    for batch in batches:
+        yield "".join(json.dumps(_row_dict(row), ensure_ascii=False) + "\n" for row in batch)
+
+
+def json_array_chunks(batches):
+    """Encode batches of rows as one JSON array, written incrementally"""
+    yield "["
+    first = True
+    for batch in batches:
+        parts = []
+        for row in batch:
+            parts.append(("\n" if first else ",\n") + json.dumps(_row_dict(row), ensure_ascii=False))
+            first = False
+        yield "".join(parts)
+    yield "\n]\n"
+
+
+def encode_chunks(chunks, compress=False):
+    """UTF-8 encode text chunks, optionally gzip-compressing the stream as it is produced"""
+    if not compress:
+        for chunk in chunks:
+            yield chunk.encode('utf-8')
+        return
+    # wbits=31 產生含 gzip 標頭的串流
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(export_format, batches, compress=False):
+    """Return (byte chunk generator, content type, filename) for an export format"""
+    if export_format == 'json':
+        chunks, content_type, filename = json_array_chunks(batches), 'application/json', 'messages_export.json'
+    elif export_format == 'jsonl':
+        chunks, content_type, filename = jsonl_chunks(batches), 'application/x-ndjson', 'messages_export.jsonl'
+    else:
+        chunks, content_type, filename = csv_chunks(batches), 'text/csv; charset=utf-8', 'messages_export.csv'
+    if compress:
+        return encode_chunks(chunks, compress=True), 'application/gzip', filename + '.gz'
+    return encode_chunks(chunks), content_type, filename
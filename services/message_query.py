@@ -0,0 +1,104 @@
+import time
+import base64
+import threading
+from datetime import datetime
+from sqlalchemy import text, tuple_
+
+# 訊息總數只用於顯示，快取一段時間，避免每次換頁都執行 COUNT(*)
+COUNT_CACHE_TTL = 60
+_count_cache = {}  # user_id -> (expires_at, count)
+_count_lock = threading.Lock()
+
+
+def encode_cursor(timestamp, message_id):
+    """Opaque page cursor for a message's (timestamp, id) position"""
+    raw = f"{timestamp.isoformat()}|{message_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (timestamp, id) from encode_cursor()
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        timestamp, message_id = raw.split('|')
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except ValueError as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def keyset_page(query, ChatMessage, before=None, after=None, per_page=50):
+    """Fetch one page of messages, newest first, positioned by cursor instead of OFFSET
+
+    Args:
+        query: Base ChatMessage query (filters already applied)
+        before (str, optional): Cursor of the last row of the previous page; returns older messages
+        after (str, optional): Cursor of the first row of the next page; returns newer messages
+
+    Returns:
+        dict: {"items", "older_cursor", "newer_cursor"}; a cursor is None when there is no such page
+
+    Raises:
+        ValueError: If a cursor is malformed
+    """
+    # 以 (timestamp, id) 列值比較定位，配合 (line_user_id, timestamp, id) / (timestamp, id) 索引，
+    # 每頁只讀取 per_page + 1 筆，與頁數深度無關
+    position = tuple_(ChatMessage.timestamp, ChatMessage.id)
+    newest_first = (ChatMessage.timestamp.desc(), ChatMessage.id.desc())
+    if after:
+        timestamp, message_id = decode_cursor(after)
+        query = query.filter(position > (timestamp, message_id)).order_by(ChatMessage.timestamp.asc(), ChatMessage.id.asc())
+    else:
+        if before:
+            timestamp, message_id = decode_cursor(before)
+            query = query.filter(position < (timestamp, message_id))
+        query = query.order_by(*newest_first)
+
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if after:
+        rows.reverse()
+
+    # 往舊的方向翻頁時，「更新」的一側一定還有資料（除非是第一頁）；反之亦然
+    has_older = has_more if not after else True
+    has_newer = bool(before) if not after else has_more
+    return {
+        "items": rows,
+        "older_cursor": encode_cursor(rows[-1].timestamp, rows[-1].id) if rows and has_older else None,
+        "newer_cursor": encode_cursor(rows[0].timestamp, rows[0].id) if rows and has_newer else None,
+    }
+
+
+def approximate_count(session, ChatMessage, user_id=None):
+    """Approximate number of messages (optionally for one user) without a COUNT(*) per page
+
+    PostgreSQL 未篩選時使用統計資訊 (pg_class.reltuples)；其餘情況使用快取的 COUNT(*)。
+    """
+    now = time.time()
+    with _count_lock:
+        cached = _count_cache.get(user_id)
+        if cached and cached[0] > now:
+            return cached[1]
+
+    count = None
+    if user_id is None and session.get_bind().dialect.name == 'postgresql':
+        estimate = session.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE relname = :table"),
+            {"table": ChatMessage.__tablename__}
+        ).scalar()
+        # 尚未 ANALYZE 的資料表回傳 -1 或 0
+        if estimate and estimate > 0:
+            count = int(estimate)
+    if count is None:
+        query = session.query(ChatMessage.id)
+        if user_id:
+            query = query.filter(ChatMessage.line_user_id == user_id)
+        count = query.count()
+
+    with _count_lock:
+        _count_cache[user_id] = (now + COUNT_CACHE_TTL, count)
+    return count
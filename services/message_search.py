@@ -0,0 +1,281 @@
+import re
+import logging
+import threading
+from sqlalchemy import event, inspect, text
+from sqlalchemy.exc import SQLAlchemyError
+
+logger = logging.getLogger(__name__)
+
+SEARCH_TABLE = 'chat_message_search'
+FTS_TABLE = 'chat_message_fts'
+BACKFILL_BATCH_SIZE = 1000
+BACKFILL_FLAG = "MESSAGE_SEARCH_BACKFILLED"
+
+# 假名、中日韓漢字、諺文：沒有空白分詞，以單字與相鄰雙字 (bigram) 建立索引
+_CJK = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af'
+_TOKEN_RE = re.compile(f'[{_CJK}]+|[^\\W_{_CJK}]+')
+
+
+def get_db():
+    from app import db
+    return db
+
+
+def get_message_model():
+    """延遲導入模型以避免循環引用"""
+    from app import ChatMessage
+    return ChatMessage
+
+
+def tokenize(message_text):
+    """Index tokens for a message: lowercase words, plus every CJK character and CJK bigram"""
+    tokens = []
+    for run in _TOKEN_RE.findall((message_text or '').lower()):
+        if re.match(f'[{_CJK}]', run):
+            tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def query_tokens(query_text):
+    """Tokens that must all match for a search: words, and the bigrams of each CJK run (or the single character)"""
+    tokens = []
+    for run in _TOKEN_RE.findall((query_text or '').lower()):
+        if re.match(f'[{_CJK}]', run) and len(run) > 1:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return list(dict.fromkeys(tokens))
+
+
+class MessageSearch:
+    """Full-text search over chat_message.message_text
+
+    SQLite 使用 FTS5 (bm25 排序)，PostgreSQL 使用 tsvector + GIN 索引 (ts_rank 排序)；
+    兩者都以 tokenize() 的結果建立索引，中文不需斷詞器即可搜尋。其他資料庫退回 LIKE 查詢。
+    新訊息在同一個交易中寫入索引；既有訊息由背景執行緒分批補建。
+    """
+
+    _backend = None  # 'fts5'、'tsvector' 或 None（LIKE）
+    _resolved = False
+    _backfill_thread = None
+    _installed = False
+
+    @staticmethod
+    def install(db, app):
+        """Index new messages on insert; called once from app.py after the models are set up
+
+        只註冊 ORM 事件，不存取資料庫；搜尋表由 create_schema()（flask init-db）建立，
+        第一次寫入或搜尋時才檢查搜尋表是否存在並決定使用的後端。
+        """
+        if MessageSearch._installed:
+            return
+        MessageSearch._installed = True
+        ChatMessage = get_message_model()
+        event.listen(ChatMessage, "after_insert", MessageSearch._after_insert)
+        event.listen(ChatMessage, "after_update", MessageSearch._after_update)
+
+    @staticmethod
+    def create_schema(db):
+        """Create the search tables if needed; must be called after db.create_all()
+
+        Returns:
+            bool: True if a full-text backend is available, False when search falls back to LIKE
+        """
+        dialect = db.engine.dialect.name
+        backend = None
+        try:
+            with db.engine.begin() as connection:
+                if dialect == 'sqlite':
+                    MessageSearch._create_sqlite(connection)
+                    backend = 'fts5'
+                elif dialect == 'postgresql':
+                    MessageSearch._create_postgresql(connection)
+                    backend = 'tsvector'
+        except SQLAlchemyError as e:
+            logger.warning(f"Full-text search index unavailable, falling back to LIKE: {e}")
+            backend = None
+        MessageSearch._backend = backend
+        MessageSearch._resolved = True
+        return backend is not None
+
+    @staticmethod
+    def _resolve_backend(connection):
+        if MessageSearch._resolved:
+            return MessageSearch._backend
+        backend = {'sqlite': 'fts5', 'postgresql': 'tsvector'}.get(connection.dialect.name)
+        if backend and not inspect(connection).has_table(SEARCH_TABLE):
+            logger.warning("Full-text search tables not found, run `flask init-db`; falling back to LIKE")
+            backend = None
+        MessageSearch._backend = backend
+        MessageSearch._resolved = True
+        return backend
+
+    @staticmethod
+    def start_backfill(app):
+        """Backfill existing messages in a background thread"""
+        if MessageSearch._backfill_thread is not None and MessageSearch._backfill_thread.is_alive():
+            return
+        MessageSearch._backfill_thread = threading.Thread(
+            target=MessageSearch._backfill_in_background,
+            args=(app,),
+            name="message-search-backfill",
+            daemon=True
+        )
+        MessageSearch._backfill_thread.start()
+
+    @staticmethod
+    def _create_sqlite(connection):
+        # 外部內容 (external content) 的 FTS5 表：token 只存一份在 chat_message_search
+        connection.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} (message_id INTEGER PRIMARY KEY, tokens TEXT NOT NULL)"
+        ))
+        connection.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            f"tokens, content='{SEARCH_TABLE}', content_rowid='message_id', tokenize='unicode61')"
+        ))
+        connection.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_ai AFTER INSERT ON {SEARCH_TABLE} BEGIN "
+            f"INSERT INTO {FTS_TABLE}(rowid, tokens) VALUES (new.message_id, new.tokens); END"
+        ))
+        connection.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_ad AFTER DELETE ON {SEARCH_TABLE} BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, tokens) VALUES ('delete', old.message_id, old.tokens); END"
+        ))
+        # 訊息被刪除（包含直接以 SQL 批次刪除）時一併移除索引
+        connection.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS chat_message_search_cleanup AFTER DELETE ON chat_message BEGIN "
+            f"DELETE FROM {SEARCH_TABLE} WHERE message_id = old.id; END"
+        ))
+
+    @staticmethod
+    def _create_postgresql(connection):
+        connection.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+            f"message_id integer PRIMARY KEY REFERENCES chat_message(id) ON DELETE CASCADE, "
+            f"document tsvector NOT NULL)"
+        ))
+        connection.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_{SEARCH_TABLE}_document ON {SEARCH_TABLE} USING gin(document)"
+        ))
+
+    @staticmethod
+    def _index_rows(connection, rows):
+        """Insert search entries for (message id, message text) rows; already indexed ids are skipped"""
+        if MessageSearch._backend == 'fts5':
+            statement = text(f"INSERT OR IGNORE INTO {SEARCH_TABLE} (message_id, tokens) VALUES (:id, :tokens)")
+            params = [{"id": message_id, "tokens": " ".join(tokenize(message_text))} for message_id, message_text in rows]
+        else:
+            # 直接以 token 陣列建立 tsvector，不經過 PostgreSQL 的分詞器
+            statement = text(
+                f"INSERT INTO {SEARCH_TABLE} (message_id, document) "
+                f"VALUES (:id, array_to_tsvector(CAST(:tokens AS text[]))) ON CONFLICT DO NOTHING"
+            )
+            params = [{"id": message_id, "tokens": list(dict.fromkeys(tokenize(message_text)))}
+                      for message_id, message_text in rows]
+        if params:
+            connection.execute(statement, params)
+
+    @staticmethod
+    def _after_insert(mapper, connection, target):
+        if MessageSearch._resolve_backend(connection) is None:
+            return
+        MessageSearch._index_rows(connection, [(target.id, target.message_text)])
+
+    @staticmethod
+    def _after_update(mapper, connection, target):
+        if MessageSearch._resolve_backend(connection) is None:
+            return
+        if not inspect(target).attrs.message_text.history.has_changes():
+            return
+        connection.execute(text(f"DELETE FROM {SEARCH_TABLE} WHERE message_id = :id"), {"id": target.id})
+        MessageSearch._index_rows(connection, [(target.id, target.message_text)])
+
+    @staticmethod
+    def _backfill_in_background(app):
+        try:
+            with app.app_context():
+                MessageSearch.backfill()
+        except Exception as e:
+            logger.error(f"Message search backfill failed: {e}")
+
+    @staticmethod
+    def backfill(batch_size=BACKFILL_BATCH_SIZE):
+        """Index existing messages that have no search entry, one batch per transaction
+
+        Returns:
+            int: Number of messages indexed
+        """
+        from routes.utils.config_service import ConfigManager
+        db = get_db()
+        if MessageSearch._resolve_backend(db.session.connection()) is None:
+            return 0
+        last_id = 0
+        indexed = 0
+        while True:
+            rows = db.session.execute(text(
+                f"SELECT m.id, m.message_text FROM chat_message m "
+                f"LEFT JOIN {SEARCH_TABLE} s ON s.message_id = m.id "
+                f"WHERE s.message_id IS NULL AND m.id > :last_id ORDER BY m.id LIMIT :limit"
+            ), {"last_id": last_id, "limit": batch_size}).fetchall()
+            if not rows:
+                break
+            MessageSearch._index_rows(db.session.connection(), rows)
+            db.session.commit()
+            last_id = rows[-1][0]
+            indexed += len(rows)
+        ConfigManager.set(BACKFILL_FLAG, "True")
+        logger.info(f"Message search backfill complete, indexed {indexed} messages")
+        return indexed
+
+    @staticmethod
+    def search(query_text, user_id=None, page=1, per_page=50, order='relevance'):
+        """Search message text; all query tokens must match
+
+        Args:
+            order (str): 'relevance' (ranked) or 'recent' (newest first)
+
+        Returns:
+            dict: {"items": ChatMessage list, "has_more": bool}
+        """
+        ChatMessage = get_message_model()
+        db = get_db()
+        tokens = query_tokens(query_text)
+        if not tokens:
+            return {"items": [], "has_more": False}
+        offset = (max(page, 1) - 1) * per_page
+        params = {"limit": per_page + 1, "offset": offset, "user_id": user_id}
+        user_filter = "AND m.line_user_id = :user_id " if user_id else ""
+        backend = MessageSearch._resolve_backend(db.session.connection())
+
+        if backend == 'fts5':
+            params["query"] = " ".join(f'"{token}"' for token in tokens)
+            ordering = f"bm25({FTS_TABLE}), m.id DESC" if order == 'relevance' else "m.id DESC"
+            sql = (
+                f"SELECT m.id FROM {FTS_TABLE} JOIN chat_message m ON m.id = {FTS_TABLE}.rowid "
+                f"WHERE {FTS_TABLE} MATCH :query {user_filter}"
+                f"ORDER BY {ordering} LIMIT :limit OFFSET :offset"
+            )
+        elif backend == 'tsvector':
+            params["query"] = " & ".join(f"'{token}'" for token in tokens)
+            ordering = "ts_rank(s.document, q) DESC, m.id DESC" if order == 'relevance' else "m.id DESC"
+            sql = (
+                f"SELECT m.id FROM {SEARCH_TABLE} s JOIN chat_message m ON m.id = s.message_id, "
+                f"CAST(:query AS tsquery) q "
+                f"WHERE s.document @@ q {user_filter}"
+                f"ORDER BY {ordering} LIMIT :limit OFFSET :offset"
+            )
+        else:
+            query = ChatMessage.query.filter(*[ChatMessage.message_text.ilike(f"%{token}%") for token in tokens])
+            if user_id:
+                query = query.filter(ChatMessage.line_user_id == user_id)
+            rows = query.order_by(ChatMessage.id.desc()).offset(offset).limit(per_page + 1).all()
+            return {"items": rows[:per_page], "has_more": len(rows) > per_page}
+
+        ids = [row[0] for row in db.session.execute(text(sql), params)]
+        has_more = len(ids) > per_page
+        ids = ids[:per_page]
+        by_id = {message.id: message for message in ChatMessage.query.filter(ChatMessage.id.in_(ids))} if ids else {}
+        return {"items": [by_id[message_id] for message_id in ids if message_id in by_id], "has_more": has_more}
@@ -0,0 +1,233 @@
+import re
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# 延遲分桶（秒），涵蓋本地資料庫查詢到 GPT-4o 回應
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    def expose(self):
+        for key, value in sorted(self.values().items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels, as in the Prometheus text format"""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values = {}  # label values -> [per-bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def values(self):
+        """Return {label values: (per-bucket counts, sum, count)}"""
+        with self._lock:
+            return {key: (list(counts), total, count) for key, (counts, total, count) in self._values.items()}
+
+    def quantile(self, q, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        state = self.values().get(key)
+        return estimate_quantile(self.buckets, state[0], q) if state else None
+
+    def expose(self):
+        for key, (counts, total, count) in sorted(self.values().items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(float(bound))))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(float(total))}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+def estimate_quantile(buckets, counts, q):
+    """Estimate a quantile from per-bucket counts by interpolating linearly within the bucket"""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    cumulative = 0
+    lower = 0.0
+    for bound, count in zip(buckets, counts):
+        if count and cumulative + count >= rank:
+            if bound == float("inf"):
+                return lower
+            return lower + (bound - lower) * (rank - cumulative) / count
+        cumulative += count
+        lower = bound
+    return lower
+
+
+class Registry:
+    """Named collection of metrics rendered together at /metrics"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, documentation, **kwargs):
+        if not re.fullmatch(r"[a-zA-Z_:][a-zA-Z0-9_:]*", name):
+            raise ValueError(f"Invalid metric name: {name}")
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} already registered as a {metric.type}")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames=labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames=labelnames, buckets=buckets)
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+# 指標只存在於目前進程；以 gunicorn 多 worker 執行時每個 worker 各自計數
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "flypig_stage_duration_seconds", "Time spent in each stage of handling a message", ("stage",))
+STAGE_FAILURES = REGISTRY.counter(
+    "flypig_stage_failures_total", "Stages that raised or returned an error", ("stage",))
+RETRIES = REGISTRY.counter(
+    "flypig_retries_total", "Retried attempts of external calls and database writes", ("operation",))
+LOG_RECORDS_DROPPED = REGISTRY.counter(
+    "flypig_log_records_dropped_total", "Log records not written: sampled out, queue full or database buffer full",
+    ("reason",))
+TOKENS = REGISTRY.histogram(
+    "flypig_llm_tokens", "Tokens per OpenAI request", ("model", "kind"), buckets=TOKEN_BUCKETS)
+
+
+@contextmanager
+def timed(stage):
+    """Time a block as one stage; an exception escaping the block also counts as a failure"""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_FAILURES.inc(stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage)
+
+
+def record_failure(stage):
+    """Count a failure that was handled without raising (e.g. a fallback reply)"""
+    STAGE_FAILURES.inc(stage=stage)
+
+
+def record_retry(operation):
+    RETRIES.inc(operation=operation)
+
+
+def record_tokens(model, usage):
+    """Record prompt/completion token counts from an OpenAI response's usage object"""
+    if usage is None:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        value = getattr(usage, kind, None)
+        if value is not None:
+            TOKENS.observe(value, model=model, kind=kind.split("_")[0])
+
+
+def render():
+    return REGISTRY.render()
+
+
+def stage_summary():
+    """Per-stage count, mean and estimated p50/p95/p99 in milliseconds, for the admin dashboard"""
+    durations = {stage: state for (stage,), state in STAGE_SECONDS.values().items()}
+    failures = {stage: count for (stage,), count in STAGE_FAILURES.values().items()}
+    summary = []
+    for stage in sorted(durations.keys() | failures.keys()):
+        counts, total, count = durations.get(stage, ([], 0.0, 0))
+        quantiles = {q: estimate_quantile(STAGE_SECONDS.buckets, counts, q / 100) or 0.0 for q in (50, 95, 99)}
+        summary.append({
+            "stage": stage,
+            "count": count,
+            "mean_ms": total / count * 1000 if count else 0.0,
+            "p50_ms": quantiles[50] * 1000,
+            "p95_ms": quantiles[95] * 1000,
+            "p99_ms": quantiles[99] * 1000,
+            "failures": failures.get(stage, 0),
+        })
+    return summary
+
+
+def token_summary():
+    """Total requests and tokens per (model, kind)"""
+    return [
+        {"model": model, "kind": kind, "requests": count, "tokens": int(total)}
+        for (model, kind), (_, total, count) in sorted(TOKENS.values().items())
+    ]
+
+
+def retry_summary():
+    return {operation: count for (operation,), count in sorted(RETRIES.values().items())}
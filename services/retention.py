@@ -0,0 +1,312 @@
+import os
+import glob
+import gzip
+import json
+import logging
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import func, select
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 封存的資料表與欄位；封存檔為每天一個（或數個）JSONL.gz 分割檔：<table>/<YYYY>/<MM>/<YYYY-MM-DD>[.n].jsonl.gz
+ARCHIVE_COLUMNS = {
+    'chat_message': ('id', 'line_user_id', 'is_user_message', 'message_text', 'bot_style', 'timestamp'),
+    'log_entry': ('id', 'level', 'message', 'module', 'timestamp'),
+}
+BATCH_SIZE = 1000
+# 至少保留的天數；儀表板每次校正會重算最近 48 小時的訊息量，不能早於此封存
+MIN_RETENTION_DAYS = 3
+
+ArchivedMessage = namedtuple('ArchivedMessage', ARCHIVE_COLUMNS['chat_message'])
+
+
+def get_db():
+    from app import db
+    return db
+
+
+def _partition_dir(archive_dir, table, day):
+    return os.path.join(archive_dir, table, f"{day:%Y}", f"{day:%m}")
+
+
+def partition_files(archive_dir, table, day=None):
+    """Archive files for one day (or every day when day is None), sorted by name"""
+    pattern = f"{day:%Y-%m-%d}*.jsonl.gz" if day else "*.jsonl.gz"
+    root = _partition_dir(archive_dir, table, day) if day else os.path.join(archive_dir, table, "*", "*")
+    return sorted(glob.glob(os.path.join(root, pattern)))
+
+
+def _partition_day(path):
+    return datetime.strptime(os.path.basename(path)[:10], '%Y-%m-%d')
+
+
+def _new_partition_path(archive_dir, table, day):
+    directory = _partition_dir(archive_dir, table, day)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{day:%Y-%m-%d}.jsonl.gz")
+    part = 1
+    while os.path.exists(path):
+        path = os.path.join(directory, f"{day:%Y-%m-%d}.{part}.jsonl.gz")
+        part += 1
+    return path
+
+
+def _write_partition(path, records):
+    """Write JSON records to a gzip file atomically (temporary file, fsync, rename)"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb') as archive:
+            for record in records:
+                archive.write((json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8'))
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp_path, path)
+
+
+def _read_partition(paths):
+    """Yield records from a day's archive files, skipping ids repeated across parts"""
+    seen = set()
+    for path in paths:
+        with gzip.open(path, 'rt', encoding='utf-8') as archive:
+            for line in archive:
+                record = json.loads(line)
+                if record['id'] in seen:
+                    continue
+                seen.add(record['id'])
+                yield record
+
+
+def _record(row, columns):
+    record = dict(zip(columns, row))
+    if record.get('timestamp'):
+        record['timestamp'] = record['timestamp'].isoformat()
+    return record
+
+
+def iter_archived_batches(archive_dir, user_id=None, start=None, end=None, batch_size=BATCH_SIZE, max_ids=None):
+    """Yield batches of archived messages in the [start, end) range, oldest day first
+
+    每批為與 iter_message_batches() 相同欄位的 ArchivedMessage，可直接交給匯出編碼器。
+
+    Args:
+        max_ids (dict, optional): Filled with {day: largest archived id} for every day read, see skip_archived()
+    """
+    columns = ARCHIVE_COLUMNS['chat_message']
+    days = {}
+    for path in partition_files(archive_dir, 'chat_message'):
+        day = _partition_day(path)
+        if (start and day + timedelta(days=1) <= start) or (end and day >= end):
+            continue
+        days.setdefault(day, []).append(path)
+
+    batch = []
+    for day in sorted(days):
+        for record in _read_partition(days[day]):
+            if max_ids is not None:
+                max_ids[day] = max(max_ids.get(day, 0), record['id'])
+            if user_id and record['line_user_id'] != user_id:
+                continue
+            timestamp = datetime.fromisoformat(record['timestamp']) if record['timestamp'] else None
+            if timestamp and ((start and timestamp < start) or (end and timestamp >= end)):
+                continue
+            record['timestamp'] = timestamp
+            batch.append(ArchivedMessage(*(record.get(column) for column in columns)))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def skip_archived(batches, max_ids):
+    """Drop rows that are also in the archive from batches of live rows
+
+    封存後在刪除途中中斷時，當天部分資料列會同時存在於封存檔與資料表；封存時讀取了當天的所有資料列，
+    因此資料表中 id 不大於當天已封存最大 id 的資料列都已在封存檔中。max_ids 由 iter_archived_batches() 填入，
+    須先讀完封存檔。
+    """
+    for batch in batches:
+        if max_ids:
+            batch = [
+                row for row in batch
+                if row.timestamp is None
+                or row.id > max_ids.get(row.timestamp.replace(hour=0, minute=0, second=0, microsecond=0), 0)
+            ]
+        if batch:
+            yield batch
+
+
+class RetentionService:
+    """Moves chat messages and logs older than the retention period into compressed archive files
+
+    每次處理一天：先把當天資料分批讀出寫入暫存檔並 fsync 後改名，確認封存檔完整後才
+    以每批 BATCH_SIZE 筆、各自提交的小交易刪除，不長時間鎖住資料表。若在刪除途中中斷，
+    下次執行只把尚未封存的資料列寫入同一天的新分割檔，已封存的只刪除；讀取與壓縮時也依 id 去除重複。
+    """
+
+    _thread = None
+    _app = None
+    _wakeup = threading.Event()
+    _worker_lock = threading.Lock()
+
+    @staticmethod
+    def ensure_worker(app):
+        """Start the periodic retention thread if a retention period is configured"""
+        from config import get_retention_settings
+        settings = get_retention_settings()
+        if settings["message_days"] <= 0 and settings["log_days"] <= 0:
+            return
+        if RetentionService._thread is not None and RetentionService._thread.is_alive():
+            return
+        with RetentionService._worker_lock:
+            if RetentionService._thread is not None and RetentionService._thread.is_alive():
+                return
+            RetentionService._app = app
+            RetentionService._thread = threading.Thread(
+                target=RetentionService._run_forever,
+                name="retention-worker",
+                daemon=True
+            )
+            RetentionService._thread.start()
+
+    @staticmethod
+    def _run_forever():
+        # 啟動後稍候再執行，避免與啟動時的初始化搶資源
+        RetentionService._wakeup.wait(60)
+        while True:
+            RetentionService._wakeup.clear()
+            try:
+                with RetentionService._app.app_context():
+                    from config import get_retention_settings
+                    RetentionService.run()
+                    interval = get_retention_settings()["interval"]
+            except Exception as e:
+                logger.error(f"Retention worker error: {e}")
+                interval = 3600
+            RetentionService._wakeup.wait(interval)
+
+    @staticmethod
+    def run(now=None):
+        """Archive and delete everything past its retention period
+
+        Returns:
+            dict: {table: number of rows archived}, or None when another process holds the archive lock
+        """
+        from config import get_retention_settings
+        settings = get_retention_settings()
+        archive_dir = settings["archive_dir"]
+        now = now or datetime.utcnow()
+        os.makedirs(archive_dir, exist_ok=True)
+
+        # 多個 worker 進程時只讓一個執行
+        with open(os.path.join(archive_dir, '.lock'), 'w') as lock_file:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    logger.info("Retention job already running in another process")
+                    return None
+
+            archived = {}
+            for table, days in (('chat_message', settings["message_days"]), ('log_entry', settings["log_days"])):
+                if days <= 0:
+                    continue
+                cutoff = (now - timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0)
+                archived[table] = RetentionService.archive_table(table, cutoff, archive_dir)
+
+        if archived.get('chat_message'):
+            # 直接以 SQL 刪除不會觸發 ORM 事件，重新校正儀表板計數器
+            from services.stats_service import StatsService
+            StatsService.reconcile()
+        return archived
+
+    @staticmethod
+    def archive_table(table_name, cutoff, archive_dir):
+        """Archive and delete all rows of a table with timestamp < cutoff, one day at a time"""
+        db = get_db()
+        table = db.metadata.tables[table_name]
+        total = 0
+        while True:
+            oldest = db.session.execute(
+                select(func.min(table.c.timestamp)).where(table.c.timestamp < cutoff)
+            ).scalar()
+            db.session.commit()
+            if oldest is None:
+                break
+            if isinstance(oldest, str):
+                oldest = datetime.fromisoformat(oldest)
+            day = oldest.replace(hour=0, minute=0, second=0, microsecond=0)
+            total += RetentionService.archive_day(table_name, day, min(day + timedelta(days=1), cutoff), archive_dir)
+        if total:
+            logger.info(f"Archived {total} rows from {table_name} older than {cutoff:%Y-%m-%d}")
+        return total
+
+    @staticmethod
+    def archive_day(table_name, day, end, archive_dir):
+        """Archive rows of one day (timestamp in [day, end)) to a new partition file, then delete them
+
+        Returns:
+            int: Number of rows deleted, including rows already archived by an interrupted earlier run
+        """
+        db = get_db()
+        table = db.metadata.tables[table_name]
+        columns = ARCHIVE_COLUMNS[table_name]
+        query = select(*(table.c[column] for column in columns)).where(
+            table.c.timestamp >= day, table.c.timestamp < end
+        )
+        # 上次執行在刪除途中中斷時留下的資料列已在封存檔中，不再重複寫入
+        archived = {record['id'] for record in _read_partition(partition_files(archive_dir, table_name, day))}
+        ids = []
+        written = []
+
+        def records():
+            last_id = 0
+            while True:
+                rows = db.session.execute(
+                    query.where(table.c.id > last_id).order_by(table.c.id).limit(BATCH_SIZE)
+                ).fetchall()
+                db.session.commit()
+                if not rows:
+                    return
+                for row in rows:
+                    ids.append(row[0])
+                    if row[0] not in archived:
+                        written.append(row[0])
+                        yield _record(row, columns)
+                last_id = rows[-1][0]
+
+        path = _new_partition_path(archive_dir, table_name, day)
+        _write_partition(path, records())
+        if not written:
+            os.remove(path)
+        if not ids:
+            return 0
+
+        # 封存檔已寫入磁碟，分批刪除；每批一個短交易
+        for i in range(0, len(ids), BATCH_SIZE):
+            db.session.execute(table.delete().where(table.c.id.in_(ids[i:i + BATCH_SIZE])))
+            db.session.commit()
+
+        if written:
+            RetentionService.compact_day(table_name, day, archive_dir)
+        return len(ids)
+
+    @staticmethod
+    def compact_day(table_name, day, archive_dir):
+        """Merge a day's partition files into one, dropping duplicate ids"""
+        paths = partition_files(archive_dir, table_name, day)
+        if len(paths) < 2:
+            return
+        merged_path = os.path.join(os.path.dirname(paths[0]), f"{day:%Y-%m-%d}.merged.jsonl.gz")
+        # 一天的資料量有限，排序後寫回單一檔案
+        _write_partition(merged_path, sorted(_read_partition(paths), key=lambda record: record['id']))
+        for path in paths:
+            os.remove(path)
+        os.replace(merged_path, paths[0])
@@ -0,0 +1,256 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import closing, contextmanager
+
+logger = logging.getLogger(__name__)
+
+# 預設的本地快取儲存位置（與 Flask instance 資料夾放在一起）
+DEFAULT_STORE_PATH = os.path.join("instance", "search_cache.db")
+
+
+class SearchCache:
+    """LRU cache with TTL, backed by a local SQLite store so entries survive restarts
+
+    每個快取實例對應儲存檔中的一個 namespace（例如搜尋查詢、網頁內容），
+    記憶體中保留最近使用的項目，未命中時再回退到本地儲存。命中次數與最近使用時間先記在記憶體中，
+    於寫入新項目時或累積一批後才一起寫回本地儲存，讀取路徑不需每次寫入磁碟。
+    """
+
+    # 每寫入多少次才清理一次本地儲存，避免每次寫入都執行刪除
+    PRUNE_INTERVAL = 50
+    # 命中紀錄累積此數量，或距上次寫回超過 TOUCH_FLUSH_INTERVAL 秒時才寫回本地儲存
+    TOUCH_BATCH = 100
+    TOUCH_FLUSH_INTERVAL = 60
+
+    def __init__(self, namespace, ttl, max_entries=500, store_path=DEFAULT_STORE_PATH):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.store_path = store_path
+        self._entries = OrderedDict()  # key -> [value, expires_at, hits]
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._touches = {}  # key -> [hits not yet persisted, last access]
+        self._last_touch_flush = time.time()
+        self.hits = 0
+        self.misses = 0
+        self._init_store()
+
+    def _connect(self):
+        return sqlite3.connect(self.store_path, timeout=5)
+
+    @contextmanager
+    def _transaction(self):
+        """Open a store connection, commit (or roll back) the transaction and always close it"""
+        with closing(self._connect()) as conn:
+            with conn:
+                yield conn
+
+    def _init_store(self):
+        """Create the backing table if it doesn't exist"""
+        if not self.store_path:
+            return
+        try:
+            directory = os.path.dirname(self.store_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self._transaction() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS cache_entry ("
+                    " namespace TEXT NOT NULL,"
+                    " key TEXT NOT NULL,"
+                    " value TEXT NOT NULL,"
+                    " expires_at REAL NOT NULL,"
+                    " hits INTEGER NOT NULL DEFAULT 0,"
+                    " last_access REAL NOT NULL,"
+                    " PRIMARY KEY (namespace, key))"
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Search cache store unavailable, using memory only: {e}")
+            self.store_path = None
+
+    def get(self, key):
+        """Return the cached value for key, or None if missing or expired"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= now:
+                del self._entries[key]
+                entry = None
+            elif entry is not None:
+                entry[2] += 1
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self._touch(key, now)
+
+        if entry is not None:
+            self._maybe_flush_touches(now)
+            return entry[0]
+
+        entry = self._load_from_store(key, now)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self._remember(key, entry)
+            self.hits += 1
+            self._touch(key, now)
+        self._maybe_flush_touches(now)
+        return entry[0]
+
+    def set(self, key, value):
+        """Store value under key with the configured TTL"""
+        now = time.time()
+        expires_at = now + self.ttl
+        with self._lock:
+            self._remember(key, [value, expires_at, 0])
+            self._writes += 1
+            should_prune = self._writes % self.PRUNE_INTERVAL == 0
+
+        if not self.store_path:
+            return
+        with self._lock:
+            self._touches.pop(key, None)
+        try:
+            with self._transaction() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache_entry (namespace, key, value, expires_at, hits, last_access) "
+                    "VALUES (?, ?, ?, ?, 0, ?)",
+                    (self.namespace, key, json.dumps(value, ensure_ascii=False), expires_at, now)
+                )
+                # 已在同一個交易中，順便寫回累積的命中紀錄（清理依 last_access 判斷，須先寫回）
+                self._flush_touches(conn, now)
+                if should_prune:
+                    self._prune_store(conn, now)
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to persist search cache entry: {e}")
+
+    def stats(self):
+        """Return cache statistics including the most frequently hit entries"""
+        with self._lock:
+            top_entries = sorted(
+                ((key, entry[2]) for key, entry in self._entries.items()),
+                key=lambda item: item[1],
+                reverse=True
+            )[:10]
+            return {
+                "namespace": self.namespace,
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "top_entries": top_entries
+            }
+
+    def iter_store(self):
+        """Yield (key, value) for every persisted entry, including expired ones"""
+        if not self.store_path:
+            with self._lock:
+                items = [(key, entry[0]) for key, entry in self._entries.items()]
+            yield from items
+            return
+        try:
+            with self._transaction() as conn:
+                rows = conn.execute(
+                    "SELECT key, value FROM cache_entry WHERE namespace = ?",
+                    (self.namespace,)
+                ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to read search cache store: {e}")
+            return
+        for key, value in rows:
+            try:
+                yield key, json.loads(value)
+            except ValueError:
+                continue
+
+    def clear(self):
+        """Remove all entries from memory and the local store"""
+        with self._lock:
+            self._entries.clear()
+            self._touches.clear()
+        if not self.store_path:
+            return
+        try:
+            with self._transaction() as conn:
+                conn.execute("DELETE FROM cache_entry WHERE namespace = ?", (self.namespace,))
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to clear search cache store: {e}")
+
+    def _remember(self, key, entry):
+        """Insert into the in-memory LRU, evicting the least recently used entries"""
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _load_from_store(self, key, now):
+        if not self.store_path:
+            return None
+        try:
+            with self._transaction() as conn:
+                row = conn.execute(
+                    "SELECT value, expires_at, hits FROM cache_entry WHERE namespace = ? AND key = ?",
+                    (self.namespace, key)
+                ).fetchone()
+                if not row:
+                    return None
+                if row[1] <= now:
+                    conn.execute(
+                        "DELETE FROM cache_entry WHERE namespace = ? AND key = ?",
+                        (self.namespace, key)
+                    )
+                    return None
+                return [json.loads(row[0]), row[1], row[2] + 1]
+        except (sqlite3.Error, ValueError) as e:
+            logger.warning(f"Failed to read search cache store: {e}")
+            return None
+
+    def _touch(self, key, now):
+        """Record a hit in memory; called with the lock held"""
+        if not self.store_path:
+            return
+        touch = self._touches.setdefault(key, [0, now])
+        touch[0] += 1
+        touch[1] = now
+
+    def _maybe_flush_touches(self, now):
+        """Persist recorded hits once enough have accumulated or the flush interval has passed"""
+        if not self._touches:
+            return
+        if len(self._touches) < self.TOUCH_BATCH and now - self._last_touch_flush < self.TOUCH_FLUSH_INTERVAL:
+            return
+        try:
+            with self._transaction() as conn:
+                self._flush_touches(conn, now)
+        except sqlite3.Error as e:
+            logger.debug(f"Failed to update search cache hit counters: {e}")
+
+    def _flush_touches(self, conn, now):
+        """Write the hits recorded in memory to the store in one batch"""
+        with self._lock:
+            touches = self._touches
+            self._touches = {}
+            self._last_touch_flush = now
+        if touches:
+            conn.executemany(
+                "UPDATE cache_entry SET hits = hits + ?, last_access = MAX(last_access, ?) "
+                "WHERE namespace = ? AND key = ?",
+                [(hits, last_access, self.namespace, key) for key, (hits, last_access) in touches.items()]
+            )
+
+    def _prune_store(self, conn, now):
+        """Drop expired rows and keep the store bounded to max_entries per namespace"""
+        conn.execute(
+            "DELETE FROM cache_entry WHERE namespace = ? AND expires_at <= ?",
+            (self.namespace, now)
+        )
+        conn.execute(
+            "DELETE FROM cache_entry WHERE namespace = ? AND key NOT IN ("
+            " SELECT key FROM cache_entry WHERE namespace = ? ORDER BY last_access DESC LIMIT ?)",
+            (self.namespace, self.namespace, self.max_entries)
+        )
@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import logging
+import threading
+from urllib.parse import urlencode
+import requests
+from services import metrics
+from services.keyword_index import KeywordIndex
+
+logger = logging.getLogger(__name__)
+
+SERPAPI_URL = "https://serpapi.com/search.json"
+
+
+class SerpApiProvider:
+    """Search provider for SerpAPI or any SerpAPI-compatible endpoint (e.g. tools/mock_serpapi.py)"""
+
+    name = "serpapi"
+
+    def __init__(self, api_key, base_url=SERPAPI_URL, session=None, record_path=None):
+        self.api_key = api_key
+        self.base_url = base_url or SERPAPI_URL
+        self.session = session or requests.Session()
+        self.record_path = record_path
+
+    def search(self, query, num_results=3):
+        """Search and return a list of {title, link, snippet} dicts, or None on failure"""
+        if not self.api_key:
+            logger.error("SERPAPI_KEY not configured")
+            return None
+
+        # 重試機制設置
+        max_retries = 3
+        retry_delay = 1
+
+        for attempt in range(max_retries):
+            try:
+                params = urlencode({"q": query, "api_key": self.api_key, "num": num_results})
+                url = f"{self.base_url}?{params}"
+
+                # 設置請求超時時間
+                response = self.session.get(url, timeout=15)
+
+                # Check response
+                if response.status_code != 200:
+                    error_msg = f"Error searching Google: Status {response.status_code}"
+                    if response.status_code == 429:
+                        error_msg = "Rate limit exceeded for SerpAPI. Try again later."
+                    elif response.status_code == 401:
+                        error_msg = "Invalid SerpAPI key. Please check your configuration."
+
+                    logger.error(error_msg)
+
+                    # 只有在達到請求限制或暫時性錯誤時重試
+                    if response.status_code in [429, 500, 502, 503, 504] and attempt < max_retries - 1:
+                        metrics.record_retry("web_search.serpapi")
+                        time.sleep(retry_delay)
+                        retry_delay *= 2
+                        continue
+
+                    return None
+
+                # Parse results
+                data = response.json()
+                self._record(query, num_results, data)
+
+                # Extract organic results
+                if "organic_results" not in data:
+                    logger.warning("No organic results found in search response")
+                    return None
+
+                results = []
+                for result in data["organic_results"][:num_results]:
+                    results.append({
+                        "title": result.get("title", ""),
+                        "link": result.get("link", ""),
+                        "snippet": result.get("snippet", "")
+                    })
+
+                return results
+
+            except requests.exceptions.Timeout:
+                logger.warning(f"SerpAPI request timed out (attempt {attempt+1}/{max_retries})")
+                if attempt < max_retries - 1:
+                    metrics.record_retry("web_search.serpapi")
+                    time.sleep(retry_delay)
+                    retry_delay *= 2
+                else:
+                    logger.error("All SerpAPI request attempts timed out")
+                    return None
+
+            except requests.exceptions.RequestException as req_err:
+                logger.error(f"Request error in web search: {req_err}")
+                # 網絡連接錯誤時重試
+                if attempt < max_retries - 1:
+                    metrics.record_retry("web_search.serpapi")
+                    time.sleep(retry_delay)
+                    retry_delay *= 2
+                else:
+                    return None
+
+            except json.JSONDecodeError as json_err:
+                logger.error(f"JSON parsing error in search response: {json_err}")
+                return None
+
+            except Exception as e:
+                logger.error(f"Unexpected error in web search: {e}")
+                return None
+
+    def _record(self, query, num_results, data):
+        """Append the raw response to the recording file for later replay"""
+        if not self.record_path:
+            return
+        try:
+            with open(self.record_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"q": query, "num": num_results, "response": data}, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.warning(f"Failed to record search response: {e}")
+
+
+class LocalCorpusProvider:
+    """Offline full-text search over previously cached search results and pages
+
+    語料來源為搜尋快取中的結果與網頁內容，以及選用的 JSONL 語料檔
+    （每行一筆 {"title", "link", "snippet", "content"}）。
+    """
+
+    name = "local"
+
+    # 語料索引的重建間隔（秒），讓新快取的頁面能被搜尋到
+    REFRESH_INTERVAL = 300
+
+    def __init__(self, query_cache=None, page_cache=None, corpus_path=None):
+        self.query_cache = query_cache
+        self.page_cache = page_cache
+        self.corpus_path = corpus_path
+        self._lock = threading.Lock()
+        self._built_at = 0
+        self._index = KeywordIndex()
+
+    def search(self, query, num_results=3):
+        """Search the local corpus and return a list of {title, link, snippet} dicts"""
+        self._ensure_index()
+        hits = self._index.search(query, num_results)
+        if not hits:
+            return None
+        return [
+            {
+                "title": self._index.entries[link]["title"],
+                "link": link,
+                "snippet": self._index.entries[link]["snippet"]
+            }
+            for link, _ in hits
+        ]
+
+    def _ensure_index(self):
+        # 依建立時間而非索引大小判斷，語料為空時也不會每次搜尋都重新掃描
+        with self._lock:
+            if self._built_at and time.time() - self._built_at < self.REFRESH_INTERVAL:
+                return
+            self._build_index()
+
+    def _build_index(self):
+        """Collect the corpus and build an in-memory inverted index"""
+        docs = {}
+        if self.query_cache is not None:
+            for _, results in self.query_cache.iter_store():
+                for result in results or []:
+                    if result.get("link"):
+                        docs.setdefault(result["link"], {
+                            "title": result.get("title", ""),
+                            "link": result["link"],
+                            "snippet": result.get("snippet", ""),
+                            "content": ""
+                        })
+        if self.page_cache is not None:
+            for url, content in self.page_cache.iter_store():
+                doc = docs.setdefault(url, {"title": url, "link": url, "snippet": (content or "")[:200], "content": ""})
+                doc["content"] = content or ""
+        if self.corpus_path and os.path.exists(self.corpus_path):
+            with open(self.corpus_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry.get("link"):
+                        docs[entry["link"]] = {
+                            "title": entry.get("title", ""),
+                            "link": entry["link"],
+                            "snippet": entry.get("snippet", ""),
+                            "content": entry.get("content", "")
+                        }
+
+        index = KeywordIndex()
+        for doc in docs.values():
+            index.add(
+                doc["link"],
+                f"{doc['title']} {doc['snippet']} {doc['content']}",
+                {"title": doc["title"], "snippet": doc["snippet"]}
+            )
+
+        self._index = index
+        self._built_at = time.time()
+        logger.info(f"Built local search corpus index with {len(index)} documents")
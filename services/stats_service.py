@@ -0,0 +1,366 @@
+import atexit
+import time
+import logging
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from flask import current_app, has_app_context
+from sqlalchemy import event, func
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import object_session
+
+logger = logging.getLogger(__name__)
+
+COUNTER_KEYS = ("line_users", "chat_messages", "user_messages", "bot_messages", "documents")
+# 記錄最近一次校正的資料列：updated_at 為校正取得 COUNT(*) 的時間，value 為校正次數
+RECONCILE_MARKER = "reconciled"
+
+
+def get_db():
+    from app import db
+    return db
+
+
+def get_models():
+    """延遲導入模型以避免循環引用"""
+    from app import StatCounter, MessageVolume, ChatMessage, LineUser, Document
+    return StatCounter, MessageVolume, ChatMessage, LineUser, Document
+
+
+def hour_bucket(timestamp):
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def hour_expression(column, dialect):
+    """SQL expression truncating a timestamp column to the hour"""
+    if dialect == 'postgresql':
+        return func.date_trunc('hour', column)
+    if dialect in ('mysql', 'mariadb'):
+        return func.date_format(column, '%Y-%m-%d %H:00:00')
+    return func.strftime('%Y-%m-%d %H:00:00', column)
+
+
+class StatsService:
+    """Dashboard counters and hourly message volume, maintained incrementally
+
+    ORM 事件在交易提交後記錄計數變化（回滾的交易不計）與提交時間，累積在記憶體中，
+    由背景執行緒定期以 UPDATE value = value + delta 寫入；另定期以 COUNT(*) 校正，
+    修正直接以 SQL 寫入（例如封存、批次匯入）造成的誤差。
+
+    校正會更新 RECONCILE_MARKER 資料列的時間（高水位），各進程寫入時略過在此之前提交的變化，
+    因為這些變化已包含在 COUNT(*) 中，其他進程尚未寫入的部分因此不會重複計入。
+    寫入與校正都先鎖定該資料列，兩者不會交錯；多台主機時依賴主機間的時鐘同步。
+    """
+
+    FLUSH_INTERVAL = 10  # 秒
+    RECONCILE_INTERVAL = 3600  # 秒
+    RECONCILE_HOURS = 48  # 每次校正最近幾小時的訊息量
+    CACHE_TTL = 15  # 秒
+
+    # [(committed_at, {counter key: delta}, {hour bucket: [user_messages, bot_messages]})]
+    _changes = []
+    _lock = threading.Lock()
+    _worker_lock = threading.Lock()
+    _reconcile_lock = threading.RLock()
+    _wakeup = threading.Event()
+    _thread = None
+    _app = None
+    _last_reconcile = 0
+    _cache = {}  # name -> (expires_at, value)
+    _installed = False
+
+    @staticmethod
+    def install(db):
+        """Register the ORM event listeners; called once from app.py after the models are set up"""
+        if StatsService._installed:
+            return
+        StatsService._installed = True
+        _, _, ChatMessage, LineUser, Document = get_models()
+
+        def track(sign):
+            def listener(mapper, connection, target):
+                session = object_session(target)
+                if session is None:
+                    return
+                # 提交後屬性會過期，在此先取出需要的值
+                if target.__tablename__ == "chat_message":
+                    change = (sign, "chat_message", target.is_user_message, target.timestamp or datetime.utcnow())
+                else:
+                    change = (sign, target.__tablename__, None, None)
+                session.info.setdefault("stats_pending", []).append(change)
+            return listener
+
+        for model in (ChatMessage, LineUser, Document):
+            event.listen(model, "after_insert", track(1))
+            event.listen(model, "after_delete", track(-1))
+        event.listen(db.session, "after_commit", StatsService._after_commit)
+        event.listen(db.session, "after_rollback", lambda session: session.info.pop("stats_pending", None))
+
+    @staticmethod
+    def _after_commit(session):
+        pending = session.info.pop("stats_pending", None)
+        if not pending:
+            return
+        deltas = Counter()
+        volume_deltas = {}
+        for sign, table, is_user_message, timestamp in pending:
+            if table == "chat_message":
+                deltas["chat_messages"] += sign
+                deltas["user_messages" if is_user_message else "bot_messages"] += sign
+                bucket = volume_deltas.setdefault(hour_bucket(timestamp), [0, 0])
+                bucket[0 if is_user_message else 1] += sign
+            elif table == "line_user":
+                deltas["line_users"] += sign
+            elif table == "document":
+                deltas["documents"] += sign
+        with StatsService._lock:
+            StatsService._changes.append((datetime.utcnow(), deltas, volume_deltas))
+        if has_app_context():
+            StatsService.ensure_worker(current_app._get_current_object())
+
+    @staticmethod
+    def ensure_worker(app):
+        """Start the background flush/reconcile thread for this process if it isn't running"""
+        if StatsService._thread is not None and StatsService._thread.is_alive():
+            return
+        with StatsService._worker_lock:
+            if StatsService._thread is not None and StatsService._thread.is_alive():
+                return
+            StatsService._app = app
+            StatsService._thread = threading.Thread(
+                target=StatsService._run_forever,
+                name="stats-worker",
+                daemon=True
+            )
+            StatsService._thread.start()
+
+    @staticmethod
+    def _run_forever():
+        while True:
+            StatsService._wakeup.wait(StatsService.FLUSH_INTERVAL)
+            StatsService._wakeup.clear()
+            try:
+                with StatsService._app.app_context():
+                    if time.time() - StatsService._last_reconcile >= StatsService.RECONCILE_INTERVAL:
+                        StatsService.reconcile()
+                    else:
+                        StatsService.flush()
+            except Exception as e:
+                logger.error(f"Stats worker error: {e}")
+
+    @staticmethod
+    def _merge(changes, reconciled_at):
+        """Sum the changes committed after the last reconcile
+
+        Returns:
+            tuple: ({counter key: delta}, {hour bucket: [user_messages, bot_messages]}), zero entries removed
+        """
+        deltas = Counter()
+        volume_deltas = {}
+        # 校正只重新計算最近 RECONCILE_HOURS 小時的訊息量，更早的小時仍需套用變化
+        since = hour_bucket(reconciled_at - timedelta(hours=StatsService.RECONCILE_HOURS)) if reconciled_at else None
+        for committed_at, change_deltas, change_volume in changes:
+            reconciled = reconciled_at is not None and committed_at <= reconciled_at
+            if not reconciled:
+                deltas.update(change_deltas)
+            for bucket, (user_delta, bot_delta) in change_volume.items():
+                if reconciled and bucket >= since:
+                    continue
+                counts = volume_deltas.setdefault(bucket, [0, 0])
+                counts[0] += user_delta
+                counts[1] += bot_delta
+        return (
+            {key: delta for key, delta in deltas.items() if delta},
+            {bucket: counts for bucket, counts in volume_deltas.items() if any(counts)}
+        )
+
+    @staticmethod
+    def flush():
+        """Apply the pending in-memory changes to stat_counter and message_volume"""
+        with StatsService._lock:
+            changes = StatsService._changes
+            StatsService._changes = []
+        if not changes:
+            return
+
+        StatCounter, MessageVolume, _, _, _ = get_models()
+        db = get_db()
+        now = datetime.utcnow()
+        missing_counter = False
+        try:
+            # 鎖定校正標記：等待進行中的校正完成，並略過已包含在其 COUNT(*) 中的變化
+            marker = StatCounter.query.filter_by(key=RECONCILE_MARKER).with_for_update().first()
+            deltas, volume_deltas = StatsService._merge(changes, marker.updated_at if marker else None)
+            for key, delta in deltas.items():
+                updated = StatCounter.query.filter_by(key=key).update(
+                    {"value": StatCounter.value + delta, "updated_at": now}, synchronize_session=False)
+                missing_counter = missing_counter or not updated
+            for bucket, (user_delta, bot_delta) in volume_deltas.items():
+                updated = MessageVolume.query.filter_by(bucket_start=bucket).update({
+                    "user_messages": MessageVolume.user_messages + user_delta,
+                    "bot_messages": MessageVolume.bot_messages + bot_delta
+                }, synchronize_session=False)
+                if not updated:
+                    db.session.add(MessageVolume(bucket_start=bucket, user_messages=user_delta, bot_messages=bot_delta))
+            db.session.commit()
+        except SQLAlchemyError as e:
+            # 例如其他進程同時建立了同一小時的資料列；放回緩衝區下次再寫入
+            db.session.rollback()
+            logger.warning(f"Error flushing dashboard stats, will retry: {e}")
+            with StatsService._lock:
+                StatsService._changes = changes + StatsService._changes
+            return
+        StatsService._cache.clear()
+
+        # 計數器資料列尚未建立（首次部署），以 COUNT(*) 初始化
+        if missing_counter:
+            StatsService.reconcile()
+
+    @staticmethod
+    def reconcile(full=None):
+        """Reset counters from COUNT(*) and recompute recent hourly volume from chat_message
+
+        Args:
+            full (bool, optional): Recompute the volume of the whole history; defaults to True
+                only when the counters have never been initialized
+        """
+        db = get_db()
+        with StatsService._reconcile_lock:
+            # 先寫入本進程累積的變化（校正開始後提交的變化留待下次寫入）
+            StatsService.flush()
+            try:
+                return StatsService._reconcile(full)
+            except IntegrityError:
+                # 其他進程同時建立了計數器資料列；改以更新的方式重試一次
+                db.session.rollback()
+                return StatsService._reconcile(full)
+
+    @staticmethod
+    def _reconcile(full):
+        StatCounter, MessageVolume, ChatMessage, LineUser, Document = get_models()
+        db = get_db()
+        if full is None:
+            full = StatCounter.query.filter(StatCounter.key.in_(COUNTER_KEYS)).count() < len(COUNTER_KEYS)
+
+        started = time.time()
+        # 先更新校正標記（取得資料列鎖，各進程的寫入會等待本次校正提交），再取得 COUNT(*)；
+        # 此時間之前提交的變化都包含在計數中，之後各進程寫入時會略過
+        marker = StatCounter.query.filter_by(key=RECONCILE_MARKER).with_for_update().first()
+        now = datetime.utcnow()
+        if marker is None:
+            db.session.add(StatCounter(key=RECONCILE_MARKER, value=1, updated_at=now))
+        else:
+            marker.value += 1
+            marker.updated_at = now
+        db.session.flush()
+
+        counts = {
+            "line_users": LineUser.query.count(),
+            "documents": Document.query.count(),
+        }
+        by_type = dict(db.session.query(ChatMessage.is_user_message, func.count(ChatMessage.id))
+                       .group_by(ChatMessage.is_user_message).all())
+        counts["user_messages"] = by_type.get(True, 0)
+        counts["bot_messages"] = sum(count for is_user, count in by_type.items() if not is_user)
+        counts["chat_messages"] = counts["user_messages"] + counts["bot_messages"]
+
+        for key, value in counts.items():
+            counter = StatCounter.query.get(key)
+            if counter is None:
+                db.session.add(StatCounter(key=key, value=value, updated_at=now))
+            else:
+                counter.value = value
+                counter.updated_at = now
+
+        # 依小時重新計算訊息量（只讀取時間範圍內的訊息，使用 timestamp 索引）
+        since = None if full else hour_bucket(now - timedelta(hours=StatsService.RECONCILE_HOURS))
+        hour = hour_expression(ChatMessage.timestamp, db.engine.dialect.name)
+        query = db.session.query(hour, ChatMessage.is_user_message, func.count(ChatMessage.id))
+        if since is not None:
+            query = query.filter(ChatMessage.timestamp >= since)
+        volumes = {}
+        for bucket, is_user, count in query.group_by(hour, ChatMessage.is_user_message):
+            if bucket is None:
+                continue
+            if isinstance(bucket, str):
+                bucket = datetime.strptime(bucket, '%Y-%m-%d %H:%M:%S')
+            volumes.setdefault(bucket, [0, 0])[0 if is_user else 1] += count
+
+        stale = MessageVolume.query
+        if since is not None:
+            stale = stale.filter(MessageVolume.bucket_start >= since)
+        stale.delete(synchronize_session=False)
+        db.session.add_all([
+            MessageVolume(bucket_start=bucket, user_messages=user_count, bot_messages=bot_count)
+            for bucket, (user_count, bot_count) in volumes.items()
+        ])
+        db.session.commit()
+
+        StatsService._last_reconcile = time.time()
+        StatsService._cache.clear()
+        logger.info(f"Reconciled dashboard stats in {time.time() - started:.2f}s ({'full' if full else 'recent'})")
+        return counts
+
+    @staticmethod
+    def _cached(name, loader):
+        cached = StatsService._cache.get(name)
+        if cached and cached[0] > time.time():
+            return cached[1]
+        value = loader()
+        StatsService._cache[name] = (time.time() + StatsService.CACHE_TTL, value)
+        return value
+
+    @staticmethod
+    def get_counters():
+        """Return {counter key: value}, including this process's not yet flushed changes"""
+        StatCounter = get_models()[0]
+
+        def load():
+            values = dict.fromkeys(COUNTER_KEYS, 0)
+            rows = StatCounter.query.filter(StatCounter.key.in_(COUNTER_KEYS)).all()
+            if len(rows) < len(COUNTER_KEYS):
+                return StatsService.reconcile()
+            values.update({row.key: row.value for row in rows})
+            return values
+
+        if has_app_context():
+            StatsService.ensure_worker(current_app._get_current_object())
+        values = dict(StatsService._cached("counters", load))
+        with StatsService._lock:
+            for _, deltas, _ in StatsService._changes:
+                for key, delta in deltas.items():
+                    values[key] = values.get(key, 0) + delta
+        return values
+
+    @staticmethod
+    def get_hourly_volume(hours=24 * 14):
+        """Return [{"hour": ISO UTC timestamp, "user_messages", "bot_messages"}] for the last hours, oldest first"""
+        _, MessageVolume, _, _, _ = get_models()
+
+        def load():
+            since = hour_bucket(datetime.utcnow() - timedelta(hours=hours - 1))
+            rows = MessageVolume.query.filter(MessageVolume.bucket_start >= since).all()
+            by_hour = {row.bucket_start: (row.user_messages, row.bot_messages) for row in rows}
+            # 沒有訊息的小時補 0，圖表的時間軸才連續
+            return [
+                {
+                    "hour": (since + timedelta(hours=i)).isoformat() + "Z",
+                    "user_messages": by_hour.get(since + timedelta(hours=i), (0, 0))[0],
+                    "bot_messages": by_hour.get(since + timedelta(hours=i), (0, 0))[1]
+                }
+                for i in range(hours)
+            ]
+
+        return StatsService._cached(f"volume:{hours}", load)
+
+
+# 進程結束時寫入尚未 flush 的計數變化
+@atexit.register
+def _flush_on_exit():
+    if StatsService._app is None:
+        return
+    try:
+        with StatsService._app.app_context():
+            StatsService.flush()
+    except Exception as e:
+        logger.error(f"Error flushing dashboard stats at exit: {e}")
@@ -0,0 +1,43 @@
+import re
+import unicodedata
+
+# CJK 連續字元、或英數字詞（允許中間夾 . 與 -，例如版本號、電話號碼）
+_TOKEN_RE = re.compile(
+    r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af]+'
+    r'|[a-z0-9]+(?:[.\-_/][a-z0-9]+)*'
+)
+_CJK_RE = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af]')
+_SEPARATOR_RE = re.compile(r'[.\-_/]')
+
+
+def tokenize(text):
+    """Split text into index tokens
+
+    CJK 文字使用重疊的二字詞（bigram），不需要斷詞字典；英數字以完整詞為單位，
+    含分隔符號的詞（如 02-1234-5678）另外產生去除分隔符號的版本與各段，方便比對電話號碼與型號。
+
+    Args:
+        text (str): The text to tokenize
+
+    Returns:
+        list: Tokens in document order (duplicates preserved)
+    """
+    if not text:
+        return []
+    # NFKC 正規化：全形英數字轉為半形
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = []
+    for match in _TOKEN_RE.finditer(text):
+        word = match.group(0)
+        if _CJK_RE.match(word):
+            if len(word) == 1:
+                tokens.append(word)
+            else:
+                tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word)
+            if _SEPARATOR_RE.search(word):
+                parts = _SEPARATOR_RE.split(word)
+                tokens.append("".join(parts))
+                tokens.extend(part for part in parts if part)
+    return tokens
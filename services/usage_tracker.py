@@ -0,0 +1,269 @@
+import time
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from flask import current_app, has_app_context
+
+logger = logging.getLogger(__name__)
+
+# 目前請求的歸屬資訊（LINE 用戶、功能），由 webhook 設定，LLMService / RAGService 記錄用量時讀取
+_usage_context = ContextVar("usage_context", default={})
+
+
+def get_usage_model():
+    """延遲導入模型以避免循環引用"""
+    from app import UsageRecord
+    return UsageRecord
+
+
+def get_db():
+    from app import db
+    return db
+
+
+@contextmanager
+def usage_context(**attributes):
+    """Attribute usage recorded inside the block to line_user_id / bot_style / feature"""
+    token = _usage_context.set({**_usage_context.get(), **attributes})
+    try:
+        yield
+    finally:
+        _usage_context.reset(token)
+
+
+class UsageTracker:
+    """Aggregates token usage in memory and flushes it to usage_record in batches
+
+    每次 OpenAI 請求只更新記憶體中的計數，依（分鐘、用戶、風格、功能、模型）彙總；
+    背景執行緒定期或累積足夠的請求後一次寫入，webhook 不需等待資料庫。
+    """
+
+    FLUSH_INTERVAL = 10  # 秒
+    FLUSH_REQUESTS = 200  # 累積此數量的請求時提早寫入
+    MAX_PENDING_KEYS = 10000  # 資料庫長時間無法寫入時的上限，超過時捨棄新的用量
+    ROLLUP_CACHE_TTL = 60  # 秒；儀表板的彙總不需即時，避免每次載入都掃描 30 天的用量
+
+    _pending = {}  # (period_start, line_user_id, bot_style, feature, model) -> [requests, prompt, completion, embedding, latency_ms]
+    _pending_requests = 0
+    _lock = threading.Lock()
+    _flush_lock = threading.Lock()
+    _wakeup = threading.Event()
+    _thread = None
+    _app = None
+    _rollup_cache = {}  # (days, limit) -> (expires_at, rollups)
+
+    @staticmethod
+    def record(model, prompt_tokens=0, completion_tokens=0, embedding_tokens=0, latency=0.0,
+               feature=None, bot_style=None, line_user_id=None):
+        """Add one OpenAI request to the in-memory aggregate
+
+        Args:
+            latency (float, optional): Request duration in seconds
+            feature, bot_style, line_user_id: Override the values set with usage_context()
+        """
+        context = _usage_context.get()
+        key = (
+            datetime.utcnow().replace(second=0, microsecond=0),
+            line_user_id or context.get("line_user_id"),
+            bot_style or context.get("bot_style"),
+            feature or context.get("feature") or "chat",
+            model
+        )
+        with UsageTracker._lock:
+            totals = UsageTracker._pending.get(key)
+            if totals is None:
+                if len(UsageTracker._pending) >= UsageTracker.MAX_PENDING_KEYS:
+                    logger.warning("Usage buffer full, dropping usage record")
+                    return
+                totals = UsageTracker._pending[key] = [0, 0, 0, 0, 0]
+            totals[0] += 1
+            totals[1] += prompt_tokens or 0
+            totals[2] += completion_tokens or 0
+            totals[3] += embedding_tokens or 0
+            totals[4] += int(latency * 1000)
+            UsageTracker._pending_requests += 1
+            should_flush = UsageTracker._pending_requests >= UsageTracker.FLUSH_REQUESTS
+
+        if has_app_context():
+            UsageTracker.ensure_worker(current_app._get_current_object())
+        if should_flush:
+            UsageTracker._wakeup.set()
+
+    @staticmethod
+    def record_response(model, response, latency=0.0, **attributes):
+        """Record an OpenAI chat or embeddings response's usage object"""
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        if model.startswith("text-embedding"):
+            UsageTracker.record(model, embedding_tokens=getattr(usage, "prompt_tokens", 0),
+                                latency=latency, **attributes)
+        else:
+            UsageTracker.record(model, prompt_tokens=getattr(usage, "prompt_tokens", 0),
+                                completion_tokens=getattr(usage, "completion_tokens", 0),
+                                latency=latency, **attributes)
+
+    @staticmethod
+    def ensure_worker(app):
+        """Start the background flush thread for this process if it isn't running"""
+        if UsageTracker._thread is not None and UsageTracker._thread.is_alive():
+            return
+        with UsageTracker._flush_lock:
+            if UsageTracker._thread is not None and UsageTracker._thread.is_alive():
+                return
+            UsageTracker._app = app
+            UsageTracker._thread = threading.Thread(
+                target=UsageTracker._run_forever,
+                name="usage-flush-worker",
+                daemon=True
+            )
+            UsageTracker._thread.start()
+
+    @staticmethod
+    def _run_forever():
+        while True:
+            UsageTracker._wakeup.wait(UsageTracker.FLUSH_INTERVAL)
+            UsageTracker._wakeup.clear()
+            try:
+                with UsageTracker._app.app_context():
+                    UsageTracker.flush()
+            except Exception as e:
+                logger.error(f"Usage flush worker error: {e}")
+
+    @staticmethod
+    def flush():
+        """Write the pending aggregates to usage_record; returns the number of rows written"""
+        with UsageTracker._lock:
+            pending = UsageTracker._pending
+            UsageTracker._pending = {}
+            UsageTracker._pending_requests = 0
+        if not pending:
+            return 0
+
+        UsageRecord = get_usage_model()
+        db = get_db()
+        rows = [
+            {
+                "period_start": period_start,
+                "line_user_id": line_user_id,
+                "bot_style": bot_style,
+                "feature": feature,
+                "model": model,
+                "requests": totals[0],
+                "prompt_tokens": totals[1],
+                "completion_tokens": totals[2],
+                "embedding_tokens": totals[3],
+                "latency_ms": totals[4],
+            }
+            for (period_start, line_user_id, bot_style, feature, model), totals in pending.items()
+        ]
+        try:
+            # 一次 INSERT 多列，不逐筆建立 ORM 物件
+            db.session.execute(UsageRecord.__table__.insert(), rows)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error flushing {len(rows)} usage records: {e}")
+            # 放回緩衝區，下次再寫入
+            with UsageTracker._lock:
+                for key, totals in pending.items():
+                    current = UsageTracker._pending.setdefault(key, [0, 0, 0, 0, 0])
+                    for i, value in enumerate(totals):
+                        current[i] += value
+            return 0
+        return len(rows)
+
+    @staticmethod
+    def rollups(days=30, limit=10):
+        """Aggregate usage and estimated cost per day, LINE user, bot style and feature
+
+        Returns:
+            dict: {"days", "users", "styles", "features", "total"}; each row has "key", "requests",
+            "prompt_tokens", "completion_tokens", "embedding_tokens", "avg_latency_ms" and "cost".
+            Cost uses the current get_model_prices() so price changes apply retroactively.
+            Results are cached for ROLLUP_CACHE_TTL seconds.
+        """
+        cached = UsageTracker._rollup_cache.get((days, limit))
+        if cached and cached[0] > time.time():
+            return cached[1]
+        value = UsageTracker._rollups(days, limit)
+        UsageTracker._rollup_cache[(days, limit)] = (time.time() + UsageTracker.ROLLUP_CACHE_TTL, value)
+        return value
+
+    @staticmethod
+    def _rollups(days, limit):
+        from sqlalchemy import func
+        from config import get_model_prices
+
+        UsageRecord = get_usage_model()
+        db = get_db()
+        prices = get_model_prices()
+        since = datetime.utcnow() - timedelta(days=days)
+
+        def aggregate(column):
+            # 依維度與模型加總，再以模型價格換算成本後合併
+            query = db.session.query(
+                column,
+                UsageRecord.model,
+                func.sum(UsageRecord.requests),
+                func.sum(UsageRecord.prompt_tokens),
+                func.sum(UsageRecord.completion_tokens),
+                func.sum(UsageRecord.embedding_tokens),
+                func.sum(UsageRecord.latency_ms)
+            ).filter(UsageRecord.period_start >= since).group_by(column, UsageRecord.model)
+
+            rows = {}
+            for key, model, requests, prompt, completion, embedding, latency in query:
+                price = prices.get(model, {})
+                row = rows.setdefault(key, {
+                    "key": key, "requests": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                    "embedding_tokens": 0, "latency_ms": 0, "cost": 0.0
+                })
+                row["requests"] += requests or 0
+                row["prompt_tokens"] += prompt or 0
+                row["completion_tokens"] += completion or 0
+                row["embedding_tokens"] += embedding or 0
+                row["latency_ms"] += latency or 0
+                row["cost"] += ((prompt or 0) * price.get("prompt", 0)
+                                + (completion or 0) * price.get("completion", 0)
+                                + (embedding or 0) * price.get("embedding", 0)) / 1_000_000
+            for row in rows.values():
+                row["avg_latency_ms"] = row.pop("latency_ms") / row["requests"] if row["requests"] else 0
+            return list(rows.values())
+
+        by_day = aggregate(func.date(UsageRecord.period_start))
+        for row in by_day:
+            # SQLite 回傳字串，PostgreSQL 回傳 date
+            row["key"] = str(row["key"])
+        by_day.sort(key=lambda row: row["key"], reverse=True)
+
+        by_cost = lambda row: row["cost"]
+        users = sorted(aggregate(UsageRecord.line_user_id), key=by_cost, reverse=True)[:limit]
+        styles = sorted(aggregate(UsageRecord.bot_style), key=by_cost, reverse=True)
+        features = sorted(aggregate(UsageRecord.feature), key=by_cost, reverse=True)
+
+        return {
+            "days": by_day,
+            "users": users,
+            "styles": styles,
+            "features": features,
+            "total": {
+                "requests": sum(row["requests"] for row in features),
+                "cost": sum(row["cost"] for row in features),
+            }
+        }
+
+
+# 進程結束時寫入尚未 flush 的用量
+@atexit.register
+def _flush_on_exit():
+    if UsageTracker._app is None:
+        return
+    try:
+        with UsageTracker._app.app_context():
+            UsageTracker.flush()
+    except Exception as e:
+        logger.error(f"Error flushing usage records at exit: {e}")
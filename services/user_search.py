@@ -0,0 +1,62 @@
+from sqlalchemy import or_, func
+
+SEARCH_LIMIT = 10
+MAX_SEARCH_LIMIT = 50
+
+
+def _escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _prefix_filter(column, term, dialect):
+    """Case-insensitive prefix match on lower(column) that can use the ix_line_user_*_lower indexes
+
+    PostgreSQL 以 varchar_pattern_ops 運算式索引處理 LIKE 'abc%'；SQLite 的 LIKE 不分大小寫，
+    無法使用運算式索引，改以範圍條件 lower(欄位) BETWEEN 'abc' AND 'abc' || U+10FFFF 比對（二進位排序）。
+    """
+    lowered = func.lower(column)
+    if dialect == 'sqlite':
+        return lowered.between(func.lower(term), func.lower(term) + '\U0010ffff')
+    return lowered.like(func.lower(f'{_escape_like(term)}%'), escape='\\')
+
+
+def _user_dict(user):
+    return {
+        'line_user_id': user.line_user_id,
+        'display_name': user.display_name,
+        'last_interaction': user.last_interaction.isoformat() if user.last_interaction else None
+    }
+
+
+def search_line_users(LineUser, term, limit=SEARCH_LIMIT):
+    """Find LINE users whose display name or LINE user ID matches a search term
+
+    不分大小寫的前綴比對使用 lower(display_name) / lower(line_user_id) 的索引，優先回傳；
+    不足 limit 筆時才以子字串比對補足（需掃描資料表，但以 LIMIT 限制筆數）。
+
+    Returns:
+        list: Up to limit dicts with line_user_id, display_name and last_interaction
+    """
+    term = (term or '').strip()
+    limit = min(max(int(limit), 1), MAX_SEARCH_LIMIT)
+    if not term:
+        return []
+
+    dialect = LineUser.query.session.get_bind().dialect.name
+    prefix = LineUser.query.filter(or_(
+        _prefix_filter(LineUser.display_name, term, dialect),
+        _prefix_filter(LineUser.line_user_id, term, dialect)
+    )).order_by(LineUser.display_name).limit(limit).all()
+    if len(prefix) >= limit or len(term) < 2:
+        return [_user_dict(user) for user in prefix]
+
+    escaped = _escape_like(term)
+    found = {user.id for user in prefix}
+    query = LineUser.query.filter(or_(
+        LineUser.display_name.ilike(f'%{escaped}%', escape='\\'),
+        LineUser.line_user_id.ilike(f'%{escaped}%', escape='\\')
+    ))
+    if found:
+        query = query.filter(LineUser.id.notin_(found))
+    substring = query.order_by(LineUser.last_interaction.desc()).limit(limit - len(prefix)).all()
+    return [_user_dict(user) for user in prefix + substring]
@@ -8,38 +8,21 @@ document.addEventListener('DOMContentLoaded', function() {
 });
 
 /**
- * Initialize the bot activity chart
+ * Initialize the bot activity chart from the hourly message volume rollups
  */
 function initActivityChart() {
     const ctx = document.getElementById('activityChart');
     
-    if (!ctx) return;
+    if (!ctx || typeof Chart === 'undefined') return;
     
-    // Generate sample data for the past 7 days
-    const labels = [];
-    const userMessages = [];
-    const botMessages = [];
-    
-    // Get dates for the last 7 days
-    for (let i = 6; i >= 0; i--) {
-        const date = new Date();
-        date.setDate(date.getDate() - i);
-        labels.push(date.toLocaleDateString('en-US', { weekday: 'short', month: 'short', day: 'numeric' }));
-        
-        // Random data for demonstration
-        userMessages.push(Math.floor(Math.random() * 20 + 5));
-        botMessages.push(Math.floor(Math.random() * 20 + 5));
-    }
-    
-    // Create chart
-    new Chart(ctx, {
+    const chart = new Chart(ctx, {
         type: 'line',
         data: {
-            labels: labels,
+            labels: [],
             datasets: [
                 {
                     label: 'User Messages',
-                    data: userMessages,
+                    data: [],
                     borderColor: 'rgba(13, 110, 253, 1)',
                     backgroundColor: 'rgba(13, 110, 253, 0.1)',
                     tension: 0.4,
@@ -47,7 +30,7 @@ function initActivityChart() {
                 },
                 {
                     label: 'Bot Responses',
-                    data: botMessages,
+                    data: [],
                     borderColor: 'rgba(25, 135, 84, 1)',
                     backgroundColor: 'rgba(25, 135, 84, 0.1)',
                     tension: 0.4,
@@ -76,12 +59,6 @@ function initActivityChart() {
                     ticks: {
                         precision: 0
                     }
-                },
-                x: {
-                    title: {
-                        display: true,
-                        text: 'Date'
-                    }
                 }
             },
             interaction: {
@@ -90,6 +67,51 @@ function initActivityChart() {
             }
         }
     });
+    
+    let hourly = [];
+    let range = 'hourly';
+    
+    function render() {
+        // Buckets are UTC hours; labels and daily totals use the browser's local time
+        let rows;
+        if (range === 'daily') {
+            const days = new Map();
+            hourly.forEach(bucket => {
+                const label = new Date(bucket.hour).toLocaleDateString(undefined, { month: 'short', day: 'numeric' });
+                const day = days.get(label) || { label: label, user: 0, bot: 0 };
+                day.user += bucket.user_messages;
+                day.bot += bucket.bot_messages;
+                days.set(label, day);
+            });
+            rows = Array.from(days.values()).slice(-14);
+        } else {
+            rows = hourly.slice(-24).map(bucket => ({
+                label: new Date(bucket.hour).toLocaleTimeString(undefined, { hour: '2-digit', minute: '2-digit' }),
+                user: bucket.user_messages,
+                bot: bucket.bot_messages
+            }));
+        }
+        chart.data.labels = rows.map(row => row.label);
+        chart.data.datasets[0].data = rows.map(row => row.user);
+        chart.data.datasets[1].data = rows.map(row => row.bot);
+        chart.update();
+    }
+    
+    document.querySelectorAll('[data-activity-range]').forEach(button => {
+        button.addEventListener('click', () => {
+            range = button.dataset.activityRange;
+            document.querySelectorAll('[data-activity-range]').forEach(other => other.classList.toggle('active', other === button));
+            render();
+        });
+    });
+    
+    fetch(ctx.dataset.statsUrl, { credentials: 'same-origin' })
+        .then(response => response.json())
+        .then(data => {
+            hourly = data.hourly || [];
+            render();
+        })
+        .catch(error => console.error('Failed to load message volume:', error));
 }
 
 /**
@@ -11,6 +11,9 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // Initialize file upload functionality
     initFileUpload();
+    
+    // Initialize index job progress polling
+    initIndexJobProgress();
 });
 
 /**
@@ -106,8 +109,9 @@ function initFileUpload() {
             };
             reader.readAsText(file);
         } else {
-            // For non-text files, show a placeholder message
-            contentInput.value = `File content will be processed on upload.\nFile: ${file.name}\nType: ${file.type}\nSize: ${(file.size / 1024).toFixed(2)} KB`;
+            // For non-text files the text is extracted on the server; only show a hint
+            contentInput.value = '';
+            contentInput.placeholder = `File content will be extracted on upload.\nFile: ${file.name}\nSize: ${formatFileSize(file.size)}`;
         }
     });
 }
@@ -143,3 +147,78 @@ function getContentPreview(content) {
     
     return content;
 }
+
+/**
+ * Poll the latest background index build job and show its progress
+ */
+function initIndexJobProgress() {
+    const card = document.getElementById('indexJobCard');
+    if (!card) return;
+    
+    const progressBar = document.getElementById('indexJobProgress');
+    const statusText = document.getElementById('indexJobStatus');
+    const cancelBtn = document.getElementById('cancelIndexJobBtn');
+    const statusLabels = {
+        pending: '等待中',
+        running: '建立中',
+        completed: '已完成',
+        failed: '失敗',
+        cancelled: '已取消'
+    };
+    let currentJobId = null;
+    let pollTimer = null;
+    
+    function formatEta(seconds) {
+        if (seconds === null || seconds === undefined) return '';
+        if (seconds < 60) return `，預計剩餘 ${seconds} 秒`;
+        return `，預計剩餘 ${Math.ceil(seconds / 60)} 分鐘`;
+    }
+    
+    function render(job) {
+        const active = job.status === 'pending' || job.status === 'running';
+        card.classList.remove('d-none');
+        cancelBtn.classList.toggle('d-none', !active);
+        progressBar.style.width = `${job.percent}%`;
+        progressBar.setAttribute('aria-valuenow', job.percent);
+        progressBar.classList.toggle('progress-bar-animated', active);
+        progressBar.classList.toggle('bg-success', job.status === 'completed');
+        progressBar.classList.toggle('bg-danger', job.status === 'failed' || job.status === 'cancelled');
+        
+        let text = `${statusLabels[job.status] || job.status}：${job.processed}/${job.total} 個文件`;
+        if (job.status === 'running') text += formatEta(job.eta_seconds);
+        if (job.message) text += `（${job.message}）`;
+        statusText.textContent = text;
+    }
+    
+    function poll() {
+        fetch('/knowledge_base/jobs/latest', { headers: { 'Accept': 'application/json' } })
+            .then(response => response.json())
+            .then(data => {
+                const job = data.job;
+                if (!job) return;
+                currentJobId = job.id;
+                render(job);
+                
+                // 只有任務進行中才持續輪詢；最近完成的任務保留顯示結果
+                if (job.status === 'pending' || job.status === 'running') {
+                    pollTimer = setTimeout(poll, 2000);
+                }
+            })
+            .catch(error => {
+                console.error('Error fetching index job status:', error);
+                pollTimer = setTimeout(poll, 5000);
+            });
+    }
+    
+    cancelBtn.addEventListener('click', function() {
+        if (!currentJobId) return;
+        fetch(`/knowledge_base/jobs/${currentJobId}/cancel`, { method: 'POST' })
+            .then(() => {
+                clearTimeout(pollTimer);
+                poll();
+            })
+            .catch(error => console.error('Error cancelling index job:', error));
+    });
+    
+    poll();
+}
@@ -0,0 +1,284 @@
+"""Benchmark knowledge base indexing and retrieval offline
+
+Builds a RAGService index from synthetic documents (or a JSONL export with
+"title" and "content" fields) using a deterministic local embedding model, then
+reports build throughput, generation load time, search latency, retrieval hit
+rates, and recall / memory / latency of alternative FAISS index types.
+
+Usage:
+    python -m tools.bench_rag --docs 2000 --queries 200 --top-k 3
+    python -m tools.bench_rag --documents export.jsonl --index-types flat,hnsw,ivf,ivfpq
+"""
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import logging
+import resource
+import tempfile
+
+import numpy as np
+
+from tools.bench_search import percentile
+
+EMBEDDING_DIM = 1536  # 與 RAGService 使用的 text-embedding-3-small 維度相同
+
+TOPICS = {
+    "保固": ["保固", "維修", "免費", "人為損壞", "更換零件", "保固卡", "送修"],
+    "退貨": ["退貨", "退款", "七天", "鑑賞期", "包裝完整", "運費", "發票"],
+    "安裝": ["安裝", "螺絲", "壁掛", "電源", "插座", "說明書", "工具"],
+    "清潔": ["清潔", "濾網", "中性清潔劑", "擦拭", "水洗", "晾乾", "除塵"],
+    "付款": ["付款", "信用卡", "分期", "轉帳", "貨到付款", "手續費", "收據"],
+    "配送": ["配送", "宅配", "到貨", "物流", "追蹤碼", "離島", "超商取貨"],
+}
+
+
+class FakeEmbeddings:
+    """Deterministic hashed bag-of-tokens embeddings with the OpenAI client's call shape"""
+
+    def __init__(self, dim=EMBEDDING_DIM):
+        self.dim = dim
+        self.calls = 0
+        self.inputs = 0
+
+    def embed(self, text):
+        from services.text_tokenizer import tokenize
+
+        vector = np.zeros(self.dim, dtype="float32")
+        for token in tokenize(text):
+            h = int.from_bytes(hashlib.md5(token.encode("utf-8")).digest()[:8], "big")
+            vector[h % self.dim] += 1.0 if h >> 63 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def create(self, model, input):
+        texts = input if isinstance(input, list) else [input]
+        self.calls += 1
+        self.inputs += len(texts)
+        data = [type("Embedding", (), {"embedding": self.embed(text)})() for text in texts]
+        return type("EmbeddingResponse", (), {"data": data})()
+
+
+class FakeClient:
+    def __init__(self):
+        self.embeddings = FakeEmbeddings()
+
+
+def synthetic_documents(count, paragraphs, seed):
+    """Generate (title, content, query) triples; each query targets one known document"""
+    rng = random.Random(seed)
+    topics = list(TOPICS)
+    for i in range(count):
+        topic = topics[i % len(topics)]
+        code = f"FP-{i:05d}"
+        words = TOPICS[topic]
+        body = []
+        for _ in range(paragraphs):
+            sentence = "，".join(rng.choice(words) for _ in range(6))
+            body.append(f"型號 {code} 的{topic}說明：{sentence}。客服電話 02-{rng.randint(2000, 9999)}-{i % 10000:04d}。")
+        query = f"{code} {rng.choice(words)}"
+        yield f"{topic}手冊 {code}", "\n\n".join(body), query
+
+
+def load_documents(path):
+    """Load (title, content, query) triples from a JSONL export; the title doubles as the query"""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                item = json.loads(line)
+            except ValueError:
+                continue
+            if item.get("content"):
+                yield item.get("title") or "", item["content"], item.get("query") or item.get("title") or item["content"][:30]
+
+
+def rss_mb():
+    # Linux 回報 KB，macOS 回報 bytes
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage / 1024 / 1024 if sys.platform == "darwin" else usage / 1024
+
+
+def print_latencies(label, latencies):
+    print(f"{label:<22} p50 {percentile(latencies, 50) * 1000:7.2f} ms   "
+          f"p95 {percentile(latencies, 95) * 1000:7.2f} ms   p99 {percentile(latencies, 99) * 1000:7.2f} ms")
+
+
+def build_index(kind, vectors):
+    """Build one of the candidate FAISS index types over vectors"""
+    import faiss
+
+    dim = vectors.shape[1]
+    if kind == "flat":
+        index = faiss.IndexFlatL2(dim)
+    elif kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, 32)
+    elif kind in ("ivf", "ivfpq"):
+        nlist = max(1, int(np.sqrt(len(vectors))))
+        quantizer = faiss.IndexFlatL2(dim)
+        if kind == "ivf":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, 96, 8)
+        index.nprobe = min(nlist, 8)
+    else:
+        raise ValueError(f"Unknown index type: {kind}")
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def search_each(index, query_vectors, top_k):
+    """Search one query at a time (as the webhook does), returning (ids, latencies)"""
+    found = []
+    latencies = []
+    for row in query_vectors:
+        started = time.perf_counter()
+        _, ids = index.search(row.reshape(1, -1), top_k)
+        latencies.append(time.perf_counter() - started)
+        found.append(ids[0])
+    return found, latencies
+
+
+def compare_index_types(kinds, vectors, query_vectors, top_k):
+    """Report build time, serialized size, latency and recall@k against exact flat search"""
+    import faiss
+
+    truth, _ = search_each(build_index("flat", vectors), query_vectors, top_k)
+    print(f"\nindex types ({len(vectors)} vectors, recall@{top_k} vs flat):")
+    for kind in kinds:
+        if kind == "ivfpq" and len(vectors) < 256 * 39:
+            print(f"  {kind:<6} skipped (needs at least {256 * 39} vectors to train)")
+            continue
+        started = time.perf_counter()
+        index = build_index(kind, vectors)
+        build_time = time.perf_counter() - started
+
+        found, latencies = search_each(index, query_vectors, top_k)
+        recall = np.mean([len(set(f) & set(t)) / top_k for f, t in zip(found, truth)])
+        size = faiss.serialize_index(index).nbytes
+        print(f"  {kind:<6} build {build_time:6.2f} s   size {size / 1024 / 1024:7.1f} MB "
+              f"({size / len(vectors):6.0f} B/vec)   p50 {percentile(latencies, 50) * 1000:6.2f} ms   "
+              f"p99 {percentile(latencies, 99) * 1000:6.2f} ms   recall {recall:.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark RAGService indexing and retrieval offline")
+    parser.add_argument("--docs", type=int, default=1000, help="Number of synthetic documents")
+    parser.add_argument("--paragraphs", type=int, default=8, help="Paragraphs per synthetic document")
+    parser.add_argument("--documents", help="JSONL file of documents instead of synthetic data")
+    parser.add_argument("--queries", type=int, default=200, help="Number of searches to run")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--batch", type=int, default=32, help="Queries per search_many call")
+    parser.add_argument("--index-types", default="flat,hnsw,ivf",
+                        help="Comma-separated FAISS index types to compare: flat,hnsw,ivf,ivfpq")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    # 在暫存目錄中使用獨立的 SQLite 資料庫與索引目錄，不影響正式資料
+    work_dir = tempfile.mkdtemp(prefix="bench_rag_")
+    repo_dir = os.getcwd()
+    sys.path.insert(0, repo_dir)
+    os.chdir(work_dir)
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(work_dir, 'bench.db')}",
+        "SESSION_SECRET": "bench",
+        "RAG_ENABLED": "true",
+    })
+
+    from app import app, db, Document, init_db
+    from rag_service import RAGService
+    import rag_service
+    # app 匯入時會把 root logger 設為 DEBUG
+    logging.getLogger().setLevel(logging.WARNING)
+
+    client = FakeClient()
+    rag_service.LLMService.get_client = staticmethod(lambda: client)
+
+    if args.documents:
+        samples = list(load_documents(os.path.join(repo_dir, args.documents)))
+    else:
+        samples = list(synthetic_documents(args.docs, args.paragraphs, args.seed))
+    rng = random.Random(args.seed)
+
+    with app.app_context():
+        init_db(backfill_in_background=False)
+        rss_before = rss_mb()
+        db.session.add_all([Document(title=title, content=content, is_active=True) for title, content, _ in samples])
+        db.session.commit()
+        doc_ids = [doc_id for (doc_id,) in db.session.query(Document.id).order_by(Document.id)]
+
+        started = time.perf_counter()
+        if not RAGService.update_index():
+            print("index build failed")
+            return
+        build_time = time.perf_counter() - started
+        total_chars = sum(len(content) for _, content, _ in samples)
+
+        RAGService._generation_cache = (None, None)
+        started = time.perf_counter()
+        snapshot = RAGService.load_generation()
+        load_time = time.perf_counter() - started
+        index = snapshot["index"]
+        print(f"documents:   {len(samples)} ({total_chars / 1024 / 1024:.1f} MB of text), "
+              f"{index.ntotal} chunks after dedup")
+        print(f"build:       {build_time:.2f} s ({len(samples) / build_time:.0f} docs/s, "
+              f"{index.ntotal / build_time:.0f} chunks/s, {client.embeddings.calls} embedding calls)")
+        print(f"load:        {load_time * 1000:.1f} ms (generation {snapshot['generation']})")
+        print(f"max RSS:     {rss_mb():.0f} MB (+{rss_mb() - rss_before:.0f} MB during build)")
+
+        picks = [rng.randrange(len(samples)) for _ in range(args.queries)]
+        queries = [samples[i][2] for i in picks]
+        targets = [doc_ids[i] for i in picks]
+
+        # 逐筆搜尋（與 LINE webhook 相同的路徑）
+        latencies = []
+        hits = 0
+        for query, target in zip(queries, targets):
+            started = time.perf_counter()
+            results = RAGService.search(query, args.top_k) or []
+            latencies.append(time.perf_counter() - started)
+            hits += any(result["id"] == target for result in results)
+        print(f"\nsearches:    {len(queries)} (top_k {args.top_k})")
+        print_latencies("search()", latencies)
+
+        # 批次搜尋
+        latencies = []
+        for start in range(0, len(queries), args.batch):
+            batch = queries[start:start + args.batch]
+            started = time.perf_counter()
+            RAGService.search_many(batch, args.top_k)
+            latencies.append((time.perf_counter() - started) / len(batch))
+        print_latencies(f"search_many({args.batch}) /q", latencies)
+
+        # 檢索品質：目標文件是否出現在前 k 筆
+        keyword_hits = sum(
+            any(entry_id[0] == target for entry_id, _ in snapshot["keyword_index"].search(query, args.top_k))
+            for query, target in zip(queries, targets)
+        )
+        query_vectors = np.array([client.embeddings.embed(query) for query in queries], dtype="float32")
+        _, rows = index.search(query_vectors, args.top_k)
+        vector_hits = sum(
+            any(int(row) in snapshot["doc_embeddings"] and snapshot["doc_embeddings"][int(row)]["id"] == target
+                for row in row_ids)
+            for row_ids, target in zip(rows, targets)
+        )
+        print(f"\nhit@{args.top_k}:       hybrid {hits / len(queries):.3f}   "
+              f"keyword {keyword_hits / len(queries):.3f}   vector {vector_hits / len(queries):.3f}")
+
+        stats = RAGService.get_cache_stats()["generation"]
+        print(f"generation cache: {stats['hits']} hits / {stats['misses']} misses   "
+              f"embedding calls: {client.embeddings.calls} ({client.embeddings.inputs} inputs)")
+
+        vectors = index.reconstruct_n(0, index.ntotal)
+        kinds = [kind.strip() for kind in args.index_types.split(",") if kind.strip()]
+        compare_index_types(kinds, vectors, query_vectors, args.top_k)
+
+    print(f"\nwork dir: {work_dir}")
+
+
+if __name__ == "__main__":
+    main()
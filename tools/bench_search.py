@@ -0,0 +1,87 @@
+"""Benchmark the web search path offline against tools/mock_serpapi.py
+
+Usage:
+    python -m tools.bench_search --queries 50 --concurrency 4 --latency 0.2 [--no-cache]
+"""
+import os
+import time
+import argparse
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from tools.mock_serpapi import start_server
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark WebSearchService against a local mock SerpAPI")
+    parser.add_argument("--queries", type=int, default=50, help="Number of searches to run")
+    parser.add_argument("--distinct", type=int, default=10, help="Number of distinct queries")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.2, help="Mock server latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--provider", default="serpapi", choices=["serpapi", "local"])
+    parser.add_argument("--no-cache", action="store_true", help="Disable the search/page caches")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    server = start_server(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    store_dir = tempfile.mkdtemp(prefix="bench_search_")
+
+    # 所有設定都透過環境變數提供，不需要資料庫
+    ttl = "0" if args.no_cache else "3600"
+    os.environ.update({
+        "WEB_SEARCH_ENABLED": "true",
+        "SERPAPI_KEY": "bench",
+        "SEARCH_PROVIDER": args.provider,
+        "SEARCH_API_BASE_URL": f"{server.base_url}/search.json",
+        "SEARCH_LOCAL_CORPUS": "",
+        "SEARCH_RECORD_PATH": "",
+        "SEARCH_CACHE_PATH": os.path.join(store_dir, "search_cache.db"),
+        "SEARCH_CACHE_TTL": ttl,
+        "PAGE_CACHE_TTL": ttl,
+        "SEARCH_CACHE_MAX_ENTRIES": "500",
+        "WEB_SEARCH_FETCH_PAGES": os.environ.get("WEB_SEARCH_FETCH_PAGES", "3"),
+        "WEB_SEARCH_FETCH_DEADLINE": os.environ.get("WEB_SEARCH_FETCH_DEADLINE", "6"),
+    })
+    from web_search_service import WebSearchService
+
+    queries = [f"測試查詢 {i % args.distinct}" for i in range(args.queries)]
+    latencies = []
+    failures = 0
+
+    def run(query):
+        started = time.perf_counter()
+        result = WebSearchService.get_search_results_for_query(query)
+        return time.perf_counter() - started, result
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for elapsed, result in executor.map(run, queries):
+            latencies.append(elapsed)
+            if not result:
+                failures += 1
+    wall = time.perf_counter() - wall_start
+    server.shutdown()
+
+    print(f"searches:    {len(queries)} ({args.distinct} distinct, concurrency {args.concurrency})")
+    print(f"throughput:  {len(queries) / wall:.1f} searches/s")
+    print(f"latency p50: {percentile(latencies, 50) * 1000:.1f} ms")
+    print(f"latency p95: {percentile(latencies, 95) * 1000:.1f} ms")
+    print(f"latency p99: {percentile(latencies, 99) * 1000:.1f} ms")
+    print(f"failures:    {failures}")
+    for name, stats in WebSearchService.get_cache_stats().items():
+        print(f"{name} cache:  {stats['hits']} hits / {stats['misses']} misses")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""Load-test the LINE webhook end to end against local LINE and OpenAI stand-ins
+
+Sends correctly signed LINE webhook events to /webhook at a fixed (open-loop)
+rate and reports webhook response latency, end-to-end reply latency (event sent
+until the stub LINE API receives the reply) and error rates.
+
+By default the app is started in-process against a temporary SQLite database,
+with LINE_API_ENDPOINT / OPENAI_BASE_URL pointing at tools/stub_services.py.
+
+Usage:
+    python -m tools.load_webhook --rate 20 --duration 30 --openai-latency 0.8
+    python -m tools.load_webhook --rate 5 --requests 100 --error-rate 0.05 --rag
+    python -m tools.load_webhook --target http://127.0.0.1:5000 --channel-secret ... --stub-port 8091
+"""
+import os
+import sys
+import hmac
+import json
+import time
+import uuid
+import base64
+import random
+import hashlib
+import argparse
+import logging
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from tools.bench_search import percentile
+from tools.stub_services import start_server
+
+MESSAGES = [
+    "你好",
+    "請問保固期限是多久？",
+    "退貨需要什麼條件？",
+    "今天天氣如何",
+    "可以介紹一下你們的清潔服務嗎？",
+    "謝謝你的幫忙",
+]
+
+
+def build_event(user_id, text):
+    """Build a LINE webhook body with a single text message event; returns (reply_token, body)"""
+    reply_token = uuid.uuid4().hex
+    body = {
+        "destination": "Uload000000000000000000000000000",
+        "events": [{
+            "type": "message",
+            "mode": "active",
+            "timestamp": int(time.time() * 1000),
+            "webhookEventId": uuid.uuid4().hex.upper(),
+            "deliveryContext": {"isRedelivery": False},
+            "replyToken": reply_token,
+            "source": {"type": "user", "userId": user_id},
+            "message": {"id": str(random.getrandbits(48)), "type": "text", "text": text}
+        }]
+    }
+    return reply_token, json.dumps(body, ensure_ascii=False).encode("utf-8")
+
+
+def sign(channel_secret, body):
+    """X-Line-Signature: base64 HMAC-SHA256 of the raw body keyed by the channel secret"""
+    digest = hmac.new(channel_secret.encode("utf-8"), body, hashlib.sha256).digest()
+    return base64.b64encode(digest).decode("ascii")
+
+
+def start_app(stub_url, channel_secret, rag, verbose):
+    """Start the app in a background thread against a temporary database; returns (base URL, work dir)"""
+    work_dir = tempfile.mkdtemp(prefix="load_webhook_")
+    sys.path.insert(0, os.getcwd())
+    os.chdir(work_dir)
+    os.environ.update({
+        "DATABASE_URL": os.environ.get("DATABASE_URL") or f"sqlite:///{os.path.join(work_dir, 'load.db')}",
+        "SESSION_SECRET": "load-test",
+        "LINE_CHANNEL_ID": "load-test",
+        "LINE_CHANNEL_SECRET": channel_secret,
+        "LINE_CHANNEL_ACCESS_TOKEN": "load-test",
+        "LINE_API_ENDPOINT": stub_url,
+        "OPENAI_API_KEY": "load-test",
+        "OPENAI_BASE_URL": f"{stub_url}/v1",
+        "RAG_ENABLED": "true" if rag else "false",
+        "WEB_SEARCH_ENABLED": "false",
+    })
+
+    from werkzeug.serving import make_server
+    from app import app
+    # app 匯入時會把 root logger 設為 DEBUG；注入錯誤時應用程式的錯誤日誌會大量輸出，預設隱藏
+    logging.getLogger().setLevel(logging.WARNING if verbose else logging.CRITICAL)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="load-webhook-app", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", work_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test /webhook against local LINE and OpenAI stubs")
+    parser.add_argument("--rate", type=float, default=10.0, help="Webhook events per second")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to send for")
+    parser.add_argument("--requests", type=int, help="Number of events to send (overrides --duration)")
+    parser.add_argument("--users", type=int, default=20, help="Number of distinct LINE users")
+    parser.add_argument("--concurrency", type=int, default=32, help="Maximum in-flight webhook requests")
+    parser.add_argument("--reply-timeout", type=float, default=30.0,
+                        help="Seconds to wait for outstanding replies after sending")
+    parser.add_argument("--line-latency", type=float, default=0.05, help="Stub LINE API latency in seconds")
+    parser.add_argument("--openai-latency", type=float, default=0.5, help="Stub OpenAI API latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- stub latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of stub requests failing with 500")
+    parser.add_argument("--rag", action="store_true", help="Enable RAG (embedding calls go to the stub)")
+    parser.add_argument("--target", help="Base URL of an already running app instead of starting one")
+    parser.add_argument("--channel-secret", default="load-test-secret",
+                        help="Channel secret used to sign events (must match the target's)")
+    parser.add_argument("--stub-port", type=int, default=0,
+                        help="Port for the stubs; with --target, the app must use this as LINE_API_ENDPOINT")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--verbose", action="store_true", help="Show the app's warning and error logs")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    random.seed(args.seed)
+    stub = start_server(
+        port=args.stub_port,
+        line_latency=args.line_latency,
+        openai_latency=args.openai_latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate
+    )
+    if args.target:
+        target, work_dir = args.target.rstrip("/"), None
+    else:
+        target, work_dir = start_app(stub.base_url, args.channel_secret, args.rag, args.verbose)
+
+    total = args.requests or max(1, int(args.rate * args.duration))
+    users = [f"U{uuid.UUID(int=random.getrandbits(128)).hex}" for _ in range(args.users)]
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency))
+
+    sent_at = {}  # reply token -> scheduled send time
+    statuses = Counter()
+    latencies = []
+    lock = threading.Lock()
+
+    def send(scheduled, reply_token, body):
+        headers = {"Content-Type": "application/json", "X-Line-Signature": sign(args.channel_secret, body)}
+        try:
+            status = session.post(f"{target}/webhook", data=body, headers=headers, timeout=60).status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        # 以排定時間計算延遲，避免協調遺漏（coordinated omission）低估排隊時間
+        with lock:
+            latencies.append(time.time() - scheduled)
+            statuses[status] += 1
+
+    print(f"sending {total} events at {args.rate:g}/s to {target}/webhook (stubs on {stub.base_url})")
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for i in range(total):
+            scheduled = started + i / args.rate
+            delay = scheduled - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            reply_token, body = build_event(random.choice(users), random.choice(MESSAGES))
+            sent_at[reply_token] = scheduled
+            pool.submit(send, scheduled, reply_token, body)
+        send_time = time.time() - started
+
+    # 回覆可能在 webhook 回應之後才送達（例如改為非同步處理時），等待剩餘回覆
+    deadline = time.time() + args.reply_timeout
+    while time.time() < deadline and len(stub.replies.keys() & sent_at.keys()) < total:
+        time.sleep(0.1)
+
+    with stub._lock:
+        replies = {token: stub.replies[token] for token in sent_at if token in stub.replies}
+    reply_latencies = [received - sent_at[token] for token, (received, _) in replies.items()]
+    fallback_replies = sum(1 for _, text in replies.values() if text.startswith("很抱歉"))
+
+    print(f"\nsent:         {total} in {send_time:.1f} s ({total / send_time:.1f}/s achieved)")
+    print("webhook HTTP: " + ", ".join(f"{status}: {count}" for status, count in sorted(statuses.items(), key=str)))
+    print(f"webhook      p50 {percentile(latencies, 50) * 1000:8.1f} ms   p95 {percentile(latencies, 95) * 1000:8.1f} ms   "
+          f"p99 {percentile(latencies, 99) * 1000:8.1f} ms   max {max(latencies, default=0) * 1000:8.1f} ms")
+    print(f"replies:      {len(replies)} received, {total - len(replies)} missing "
+          f"({(total - len(replies)) / total:.1%}), {fallback_replies} error fallbacks")
+    print(f"reply        p50 {percentile(reply_latencies, 50) * 1000:8.1f} ms   p95 {percentile(reply_latencies, 95) * 1000:8.1f} ms   "
+          f"p99 {percentile(reply_latencies, 99) * 1000:8.1f} ms   max {max(reply_latencies, default=0) * 1000:8.1f} ms")
+    print("stub calls:   " + ", ".join(
+        f"{endpoint}: {count}" + (f" ({stub.errors[endpoint]} failed)" if stub.errors[endpoint] else "")
+        for endpoint, count in sorted(stub.requests.items())
+    ))
+    if work_dir:
+        # 應用程式在本進程內執行，可直接讀取各階段的延遲指標（/metrics 的同一份資料）
+        from services import metrics
+        print("\nstage                      count   mean ms    p50 ms    p95 ms    p99 ms  failures")
+        for stage in metrics.stage_summary():
+            print(f"{stage['stage']:<24} {stage['count']:>7} {stage['mean_ms']:>9.1f} {stage['p50_ms']:>9.1f} "
+                  f"{stage['p95_ms']:>9.1f} {stage['p99_ms']:>9.1f} {stage['failures']:>9}")
+        print(f"\nwork dir: {work_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""Local stand-in for the SerpAPI search endpoint
+
+Replays responses recorded by SerpApiProvider (SEARCH_RECORD_PATH) and serves
+synthetic result pages, with configurable latency and error injection, so the
+web search path can be exercised without network access.
+
+Usage:
+    python -m tools.mock_serpapi --port 8090 --recordings recordings.jsonl --latency 0.3
+
+Then point the app at it:
+    SEARCH_API_BASE_URL=http://127.0.0.1:8090/search.json SERPAPI_KEY=test
+"""
+import json
+import time
+import random
+import hashlib
+import argparse
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query):
+    return " ".join(query.split()).lower()
+
+
+def load_recordings(path):
+    """Load recorded responses (JSONL of {"q", "num", "response"}) keyed by normalized query"""
+    recordings = {}
+    if not path:
+        return recordings
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if "q" in entry and "response" in entry:
+                recordings[normalize_query(entry["q"])] = entry["response"]
+    logger.info(f"Loaded {len(recordings)} recorded search responses")
+    return recordings
+
+
+class MockSerpApiHandler(BaseHTTPRequestHandler):
+    """Request handler; configuration lives on the server instance"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        parsed = urlparse(self.path)
+        server.delay()
+
+        if random.random() < server.error_rate:
+            self._send(503, "application/json", json.dumps({"error": "injected failure"}).encode())
+            return
+
+        if parsed.path == "/search.json":
+            params = parse_qs(parsed.query)
+            query = params.get("q", [""])[0]
+            num = int(params.get("num", ["3"])[0])
+            data = server.recordings.get(normalize_query(query)) or server.synthesize(query, num)
+            self._send(200, "application/json", json.dumps(data, ensure_ascii=False).encode("utf-8"))
+        elif parsed.path.startswith("/page/"):
+            self._send(200, "text/html; charset=utf-8", server.render_page(parsed.path).encode("utf-8"))
+        else:
+            self._send(404, "text/plain", b"not found")
+
+    def _send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class MockSerpApiServer(ThreadingHTTPServer):
+    """Threaded HTTP server replaying recorded SerpAPI responses"""
+
+    daemon_threads = True
+
+    def __init__(self, address, recordings=None, latency=0.0, jitter=0.0, error_rate=0.0, page_kb=20):
+        super().__init__(address, MockSerpApiHandler)
+        self.recordings = recordings or {}
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.page_kb = page_kb
+
+    def handle_error(self, request, client_address):
+        # 客戶端讀到足夠內容後會提前關閉連線，這是預期行為
+        logger.debug(f"Connection from {client_address} closed early")
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+    def synthesize(self, query, num):
+        """Build a deterministic fake response for queries with no recording"""
+        digest = hashlib.md5(query.encode("utf-8")).hexdigest()[:8]
+        return {
+            "search_metadata": {"status": "Success", "mock": True},
+            "organic_results": [
+                {
+                    "position": i + 1,
+                    "title": f"{query} - 結果 {i + 1}",
+                    "link": f"{self.base_url}/page/{digest}/{i + 1}",
+                    "snippet": f"關於「{query}」的模擬搜尋摘要 {i + 1}。"
+                }
+                for i in range(num)
+            ]
+        }
+
+    def render_page(self, path):
+        """Render a synthetic HTML page of roughly page_kb kilobytes"""
+        filler = "<p>" + "模擬頁面內容，用於測試網頁擷取效能。" * 8 + "</p>\n"
+        repeat = max(1, self.page_kb * 1024 // len(filler.encode("utf-8")))
+        return (
+            "<html><head><title>Mock page</title><script>var tracking = 1;</script></head>"
+            f"<body><nav>選單</nav><main><h1>{path}</h1>{filler * repeat}</main>"
+            "<footer>頁尾</footer></body></html>"
+        )
+
+
+def start_server(host="127.0.0.1", port=0, **kwargs):
+    """Start a mock server in a background thread and return it"""
+    server = MockSerpApiServer((host, port), **kwargs)
+    thread = threading.Thread(target=server.serve_forever, name="mock-serpapi", daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the SerpAPI search endpoint")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--recordings", help="JSONL file written via SEARCH_RECORD_PATH")
+    parser.add_argument("--latency", type=float, default=0.0, help="Base response latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--page-kb", type=int, default=20, help="Size of synthetic result pages")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    server = MockSerpApiServer(
+        (args.host, args.port),
+        recordings=load_recordings(args.recordings),
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        page_kb=args.page_kb
+    )
+    logger.info(f"Mock SerpAPI listening on {server.base_url}/search.json")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Measure how long `import app` takes and check it against the cold start budgets
+
+Runs `python -X importtime -c "import app"` in a fresh interpreter (so nothing is cached in
+sys.modules), prints the slowest modules and the app's own startup phases, and exits non-zero
+when the import exceeds the budget or loads a module that should only be imported on first use.
+
+Usage:
+    python -m tools.startup_profile [--budget-ms 900] [--runs 3] [--top 15]
+"""
+import os
+import re
+import sys
+import argparse
+import subprocess
+import tempfile
+
+# 以 Python 3.11 量測約 450–550 ms（匯入時不存取資料庫）；預算保留一些餘裕
+DEFAULT_BUDGET_MS = 900
+# 第一次使用時才導入的模組（見 app.HEAVY_MODULES）
+LAZY_MODULES = ("openai", "numpy", "faiss", "linebot", "requests")
+
+_IMPORTTIME_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def run_import(env):
+    """Import app in a new interpreter
+
+    Returns:
+        tuple: ({module: (self us, cumulative us, depth)}, startup profile log lines); the entry for
+            app also holds the list of modules it imports directly
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        env=env, capture_output=True, text=True, cwd=os.getcwd()
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"import app failed:\n{result.stderr[-2000:]}")
+    modules = {}
+    children = []  # 依輸出順序，子模組列在父模組之前
+    log_lines = []
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            depth = (len(indent) - 1) // 2
+            modules[name] = (int(self_us), int(cumulative_us), depth)
+            if depth == 1:
+                children.append(name)
+            elif depth == 0:
+                if name == "app":
+                    modules["app"] += (children,)
+                children = []
+        elif "Startup profile" in line:
+            log_lines.append(line)
+    return modules, log_lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cold start import time of app.py")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS, help="Maximum `import app` time")
+    parser.add_argument("--runs", type=int, default=3, help="Number of imports; the fastest one is reported")
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest top-level modules to list")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env["STARTUP_PROFILE"] = "true"
+    if "DATABASE_URL" not in env:
+        env["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='startup_profile_'), 'app.db')}"
+
+    runs = [run_import(env) for _ in range(max(args.runs, 1))]
+    modules, log_lines = min(runs, key=lambda run: run[0]["app"][1])
+    total_ms = modules["app"][1] / 1000
+
+    print(f"import app: {total_ms:.0f} ms (fastest of {len(runs)}, budget {args.budget_ms:.0f} ms)")
+    for line in log_lines:
+        print("  " + line.split(" - ")[-1])
+    print("\nSlowest modules imported by app (cumulative):")
+    top_level = [(name, modules[name][1]) for name in modules["app"][3]]
+    for name, cumulative in sorted(top_level, key=lambda item: -item[1])[:args.top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    failures = []
+    if total_ms > args.budget_ms:
+        failures.append(f"import app took {total_ms:.0f} ms, over the {args.budget_ms:.0f} ms budget")
+    eager = [name for name in LAZY_MODULES if name in modules]
+    if eager:
+        failures.append(f"imported at startup but should be lazy: {', '.join(eager)}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+"""Local stand-ins for the LINE Messaging API and the OpenAI API
+
+Serves the endpoints the bot calls while handling a webhook:
+
+    POST /v2/bot/message/reply      POST /v2/bot/message/push
+    GET  /v2/bot/profile/<userId>
+    POST /v1/chat/completions       POST /v1/embeddings
+
+with configurable latency and error injection. Replies are recorded by reply
+token so tools/load_webhook.py can measure end-to-end reply latency.
+
+Usage:
+    python -m tools.stub_services --port 8091 --line-latency 0.05 --openai-latency 0.8
+
+Then point the app at it:
+    LINE_API_ENDPOINT=http://127.0.0.1:8091 OPENAI_BASE_URL=http://127.0.0.1:8091/v1
+"""
+import json
+import time
+import random
+import argparse
+import logging
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from tools.bench_rag import FakeEmbeddings
+
+logger = logging.getLogger(__name__)
+
+
+class StubServicesHandler(BaseHTTPRequestHandler):
+    """Request handler; configuration and recorded replies live on the server instance"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path.startswith("/v2/bot/profile/"):
+            if self.server.inject("line", "profile"):
+                return self._send_error()
+            user_id = path.rsplit("/", 1)[1]
+            self._send_json({
+                "userId": user_id,
+                "displayName": f"測試用戶 {user_id[-4:]}",
+                "pictureUrl": "https://example.com/avatar.png",
+                "statusMessage": "load test"
+            })
+        else:
+            self._send(404, "text/plain", b"not found")
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self._send(400, "application/json", b'{"message": "invalid json"}')
+
+        if path in ("/v2/bot/message/reply", "/v2/bot/message/push"):
+            endpoint = path.rsplit("/", 1)[1]
+            if self.server.inject("line", endpoint):
+                return self._send_error()
+            if endpoint == "reply":
+                self.server.record_reply(body.get("replyToken"), body.get("messages", []))
+            self._send_json({})
+        elif path == "/v1/chat/completions":
+            if self.server.inject("openai", "chat"):
+                return self._send_error()
+            self._send_json(self.server.chat_completion(body))
+        elif path == "/v1/embeddings":
+            if self.server.inject("openai", "embeddings"):
+                return self._send_error()
+            self._send_json(self.server.embeddings(body))
+        else:
+            self._send(404, "text/plain", b"not found")
+
+    def _send_json(self, data):
+        self._send(200, "application/json", json.dumps(data, ensure_ascii=False).encode("utf-8"))
+
+    def _send_error(self):
+        self._send(500, "application/json", json.dumps({"message": "injected failure"}).encode())
+
+    def _send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class StubServicesServer(ThreadingHTTPServer):
+    """Threaded HTTP server emulating LINE and OpenAI with latency and error injection"""
+
+    daemon_threads = True
+
+    def __init__(self, address, line_latency=0.05, openai_latency=0.5, jitter=0.0, error_rate=0.0):
+        super().__init__(address, StubServicesHandler)
+        self.latency = {"line": line_latency, "openai": openai_latency}
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests = Counter()
+        self.errors = Counter()
+        self.replies = {}  # reply token -> (received at, text)
+        self._lock = threading.Lock()
+        self._embeddings = FakeEmbeddings()
+
+    def handle_error(self, request, client_address):
+        logger.debug(f"Connection from {client_address} closed early")
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def inject(self, service, endpoint):
+        """Apply latency, count the request and return True if it should fail"""
+        delay = self.latency[service] + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        failed = random.random() < self.error_rate
+        with self._lock:
+            self.requests[f"{service}.{endpoint}"] += 1
+            if failed:
+                self.errors[f"{service}.{endpoint}"] += 1
+        return failed
+
+    def record_reply(self, reply_token, messages):
+        text = " ".join(message.get("text", "") for message in messages)
+        with self._lock:
+            self.replies[reply_token] = (time.time(), text)
+
+    def chat_completion(self, body):
+        messages = body.get("messages", [])
+        user_text = messages[-1]["content"] if messages else ""
+        prompt_tokens = sum(len(message.get("content", "")) for message in messages) // 2 + 1
+        content = f"（模擬回應）你說：{user_text[:100]}"
+        completion_tokens = len(content) // 2 + 1
+        return {
+            "id": f"chatcmpl-stub-{random.getrandbits(32):08x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        }
+
+    def embeddings(self, body):
+        texts = body.get("input", [])
+        texts = texts if isinstance(texts, list) else [texts]
+        tokens = sum(len(text) for text in texts) // 2 + 1
+        return {
+            "object": "list",
+            "data": [
+                {"object": "embedding", "index": i, "embedding": self._embeddings.embed(text)}
+                for i, text in enumerate(texts)
+            ],
+            "model": body.get("model", "text-embedding-3-small"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+        }
+
+
+def start_server(host="127.0.0.1", port=0, **kwargs):
+    """Start the stub server in a background thread and return it"""
+    server = StubServicesServer((host, port), **kwargs)
+    thread = threading.Thread(target=server.serve_forever, name="stub-services", daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-ins for the LINE Messaging API and OpenAI")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8091)
+    parser.add_argument("--line-latency", type=float, default=0.05, help="LINE API latency in seconds")
+    parser.add_argument("--openai-latency", type=float, default=0.5, help="OpenAI API latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 500")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    server = StubServicesServer(
+        (args.host, args.port),
+        line_latency=args.line_latency,
+        openai_latency=args.openai_latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate
+    )
+    logger.info(f"Stub LINE API on {server.base_url}, stub OpenAI API on {server.base_url}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
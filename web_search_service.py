@@ -1,13 +1,83 @@
 import logging
 import requests
-import json
 import re
-from urllib.parse import quote
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from requests.adapters import HTTPAdapter
 from services.llm_service import LLMService
-from config import is_web_search_enabled, get_serpapi_key
+from services.search_cache import SearchCache
+from services.html_extractor import extract_text_from_response
+from services.search_providers import SerpApiProvider, LocalCorpusProvider
+from services import metrics
+from config import (
+    is_web_search_enabled,
+    get_serpapi_key,
+    get_search_cache_settings,
+    get_web_fetch_settings,
+    get_search_provider_settings
+)
 
 logger = logging.getLogger(__name__)
 
+# 搜尋結果與網頁內容的快取（延遲初始化，每個進程一份）
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_search_caches():
+    """Get the (query cache, page cache) pair, creating them on first use"""
+    with _caches_lock:
+        if not _caches:
+            settings = get_search_cache_settings()
+            _caches["query"] = SearchCache("query", settings["query_ttl"], settings["max_entries"], settings["store_path"])
+            _caches["page"] = SearchCache("page", settings["page_ttl"], settings["max_entries"], settings["store_path"])
+        return _caches["query"], _caches["page"]
+
+# 共用的 HTTP 連線池，避免每次請求都重新建立 TCP/TLS 連線
+_session = None
+_session_lock = threading.Lock()
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml",
+    "Accept-Language": "en-US,en;q=0.9,zh-TW;q=0.8,zh;q=0.7",
+    "Connection": "keep-alive"
+}
+
+def get_http_session():
+    """Get the shared pooled requests.Session used for search and page fetches"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=20, pool_maxsize=20)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+def get_search_provider():
+    """Get the configured search provider (SEARCH_PROVIDER: serpapi or local)"""
+    settings = get_search_provider_settings()
+    if settings["provider"] == "local":
+        with _caches_lock:
+            provider = _caches.get("local_provider")
+            if provider is None or provider.corpus_path != settings["corpus_path"]:
+                query_cache, page_cache = _caches.get("query"), _caches.get("page")
+                provider = LocalCorpusProvider(query_cache, page_cache, settings["corpus_path"])
+                _caches["local_provider"] = provider
+            return provider
+    
+    return SerpApiProvider(
+        get_serpapi_key(),
+        base_url=settings["base_url"],
+        session=get_http_session(),
+        record_path=settings["record_path"]
+    )
+
+def normalize_query(query):
+    """Normalize a search query so trivially different spellings share a cache entry"""
+    return re.sub(r'\s+', ' ', query).strip().lower()
+
 class WebSearchService:
     """Service for web search and information retrieval"""
     
@@ -15,121 +85,57 @@ class WebSearchService:
     
     @staticmethod
     def search_google(query, num_results=3):
-        """Search Google for information on a topic"""
+        """Search Google (or the configured search provider) for information on a topic"""
         if not is_web_search_enabled():
             logger.info("Web search is disabled")
             return None
-            
-        # 重試機制設置
-        max_retries = 3
-        retry_delay = 1
         
-        for attempt in range(max_retries):
-            try:
-                # Prepare the query
-                search_query = quote(query)
-                
-                # Using SerpAPI-compatible endpoint
-                api_key = get_serpapi_key()
-                if not api_key:
-                    logger.error("SERPAPI_KEY not configured")
-                    return None
-                    
-                url = f"https://serpapi.com/search.json?q={search_query}&api_key={api_key}&num={num_results}"
-                
-                # 設置請求超時時間
-                response = requests.get(url, timeout=15)
-                
-                # Check response
-                if response.status_code != 200:
-                    error_msg = f"Error searching Google: Status {response.status_code}"
-                    if response.status_code == 429:
-                        error_msg = "Rate limit exceeded for SerpAPI. Try again later."
-                    elif response.status_code == 401:
-                        error_msg = "Invalid SerpAPI key. Please check your configuration."
-                    
-                    logger.error(error_msg)
-                    
-                    # 只有在達到請求限制或暫時性錯誤時重試
-                    if response.status_code in [429, 500, 502, 503, 504] and attempt < max_retries - 1:
-                        import time
-                        time.sleep(retry_delay)
-                        retry_delay *= 2
-                        continue
-                    
-                    return None
-                    
-                # Parse results
-                data = response.json()
-                
-                # Extract organic results
-                if "organic_results" not in data:
-                    logger.warning("No organic results found in search response")
-                    return None
-                    
-                results = []
-                for result in data["organic_results"][:num_results]:
-                    results.append({
-                        "title": result.get("title", ""),
-                        "link": result.get("link", ""),
-                        "snippet": result.get("snippet", "")
-                    })
-                    
-                return results
-            
-            except requests.exceptions.Timeout:
-                logger.warning(f"SerpAPI request timed out (attempt {attempt+1}/{max_retries})")
-                if attempt < max_retries - 1:
-                    import time
-                    time.sleep(retry_delay)
-                    retry_delay *= 2
-                else:
-                    logger.error("All SerpAPI request attempts timed out")
-                    return None
+        # 先檢查快取，避免重複消耗 SerpAPI 配額
+        query_cache, _ = get_search_caches()
+        provider = get_search_provider()
+        cache_key = f"{provider.name}:{num_results}:{normalize_query(query)}"
+        cached_results = query_cache.get(cache_key)
+        if cached_results is not None:
+            logger.info(f"Search cache hit: {query}")
+            return cached_results
             
-            except requests.exceptions.RequestException as req_err:
-                logger.error(f"Request error in web search: {req_err}")
-                # 網絡連接錯誤時重試
-                if attempt < max_retries - 1:
-                    import time
-                    time.sleep(retry_delay)
-                    retry_delay *= 2
-                else:
-                    return None
-            
-            except json.JSONDecodeError as json_err:
-                logger.error(f"JSON parsing error in search response: {json_err}")
-                return None
-            
-            except Exception as e:
-                logger.error(f"Unexpected error in web search: {e}")
-                return None
+        with metrics.timed("web_search.provider"):
+            results = provider.search(query, num_results)
+        if results:
+            query_cache.set(cache_key, results)
+        
+        return results
     
     @staticmethod
-    def extract_content_from_url(url):
-        """Get content from a URL"""
+    def extract_content_from_url(url, timeout=8, max_retries=2):
+        """Get content from a URL
+        
+        Args:
+            url (str): The page to fetch
+            timeout (float, optional): Per-request timeout in seconds. Defaults to 8.
+            max_retries (int, optional): Number of attempts. Defaults to 2.
+        """
+        _, page_cache = get_search_caches()
+        cached_content = page_cache.get(url)
+        if cached_content is not None:
+            logger.info(f"Page cache hit: {url}")
+            return cached_content
+        
         # 重試機制設置
-        max_retries = 2
         retry_delay = 1
         
         for attempt in range(max_retries):
             try:
-                headers = {
-                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-                    "Accept": "text/html,application/xhtml+xml,application/xml",
-                    "Accept-Language": "en-US,en;q=0.9,zh-TW;q=0.8,zh;q=0.7",
-                    "Connection": "keep-alive"
-                }
-                
                 # 設置更短的超時時間以避免阻塞
-                response = requests.get(url, headers=headers, timeout=8, 
-                                        allow_redirects=True, stream=True)
+                response = get_http_session().get(url, headers=DEFAULT_HEADERS, timeout=timeout,
+                                                  allow_redirects=True, stream=True)
                 
                 if response.status_code != 200:
                     logger.error(f"Error fetching URL (attempt {attempt+1}): Status {response.status_code}")
                     
                     # 只有特定狀態碼才重試
                     if response.status_code in [429, 500, 502, 503, 504] and attempt < max_retries - 1:
+                        metrics.record_retry("web_search.fetch_page")
                         import time
                         time.sleep(retry_delay)
                         retry_delay *= 2
@@ -137,29 +143,18 @@ class WebSearchService:
                     
                     return None
                 
-                # 只讀取有限的內容，避免大型頁面
-                content = response.text[:30000]  # 只提取前 30KB 的內容
-                
-                # 簡易的 HTML 內容提取，主要針對文本
-                # 移除 script 和 style 標籤及其內容
-                content = re.sub(r'<script[^>]*>.*?</script>', ' ', content, flags=re.DOTALL)
-                content = re.sub(r'<style[^>]*>.*?</style>', ' ', content, flags=re.DOTALL)
-                
-                # 移除 HTML 標籤
-                content = re.sub(r'<[^>]+>', ' ', content)
+                # 串流讀取並解析，最多讀取固定的位元組預算
+                content = extract_text_from_response(response)
                 
-                # 移除多餘空白
-                content = re.sub(r'\s+', ' ', content).strip()
-                
-                # 限制內容長度
-                if len(content) > 1500:
-                    content = content[:1500] + "..."
+                if content:
+                    page_cache.set(url, content)
                 
                 return content
                 
             except requests.exceptions.Timeout:
                 logger.warning(f"Request to {url} timed out (attempt {attempt+1}/{max_retries})")
                 if attempt < max_retries - 1:
+                    metrics.record_retry("web_search.fetch_page")
                     import time
                     time.sleep(retry_delay)
                     retry_delay *= 2
@@ -173,6 +168,7 @@ class WebSearchService:
             except requests.exceptions.RequestException as req_err:
                 logger.error(f"Request error for URL {url}: {req_err}")
                 if attempt < max_retries - 1:
+                    metrics.record_retry("web_search.fetch_page")
                     import time
                     time.sleep(retry_delay)
                     retry_delay *= 2
@@ -183,6 +179,46 @@ class WebSearchService:
                 logger.error(f"Unexpected error extracting content from {url}: {e}")
                 return None
     
+    @staticmethod
+    def fetch_pages(urls, deadline):
+        """Fetch and extract several pages concurrently under one overall deadline
+        
+        Args:
+            urls (list): Page URLs to fetch
+            deadline (float): Total seconds to wait for all fetches
+            
+        Returns:
+            dict: URL -> extracted content for the pages that finished in time
+        """
+        urls = [url for url in dict.fromkeys(urls) if url]
+        if not urls:
+            return {}
+        
+        # 單次請求的超時不超過整體期限，且不重試，由整體期限控制延遲
+        timeout = max(1.0, min(8.0, deadline))
+        executor = ThreadPoolExecutor(max_workers=len(urls), thread_name_prefix="page-fetch")
+        futures = {
+            executor.submit(WebSearchService.extract_content_from_url, url, timeout, 1): url
+            for url in urls
+        }
+        done, not_done = wait(futures, timeout=deadline)
+        # 不等待逾時的請求，讓它們在背景結束
+        executor.shutdown(wait=False, cancel_futures=True)
+        
+        if not_done:
+            logger.info(f"Page fetch deadline reached: {len(done)}/{len(urls)} pages fetched")
+        
+        pages = {}
+        for future in done:
+            try:
+                content = future.result()
+            except Exception as e:
+                logger.error(f"Error fetching {futures[future]}: {e}")
+                continue
+            if content:
+                pages[futures[future]] = content
+        return pages
+    
     @staticmethod
     def get_search_results_for_query(query):
         """Search the web for information about a query"""
@@ -193,6 +229,12 @@ class WebSearchService:
         search_results = WebSearchService.search_google(query)
         if not search_results:
             return None
+        
+        # 並行抓取前 N 個結果頁面，只使用在期限內完成的內容
+        fetch_settings = get_web_fetch_settings()
+        top_links = [result['link'] for result in search_results[:fetch_settings["max_pages"]]]
+        with metrics.timed("web_search.fetch_pages"):
+            pages = WebSearchService.fetch_pages(top_links, fetch_settings["deadline"])
             
         # Prepare search results summary
         summary = "Search results information:\n\n"
@@ -202,14 +244,21 @@ class WebSearchService:
             summary += f"   URL: {result['link']}\n"
             summary += f"   Summary: {result['snippet']}\n\n"
             
-            # Try to get more content from the first result
-            if i == 0:
-                content = WebSearchService.extract_content_from_url(result['link'])
-                if content:
-                    summary += f"Extracted content from the top result:\n{content[:500]}...\n\n"
+            content = pages.get(result['link'])
+            if content:
+                summary += f"Extracted content from this result:\n{content[:500]}...\n\n"
         
         return summary
     
+    @staticmethod
+    def get_cache_stats():
+        """Get hit/miss statistics for the search and page caches"""
+        query_cache, page_cache = get_search_caches()
+        return {
+            "query": query_cache.stats(),
+            "page": page_cache.stats()
+        }
+    
     @staticmethod
     def answer_with_web_search(query):
         """Search the web and generate a response using the search results"""